@@ -0,0 +1,355 @@
+"""
+Benchmarks for Lambda maintenance handler hot paths.
+
+Each case is timed per call and reported as p50/p99 latency. Results can be
+saved as a JSON baseline and later runs compared against it; the run fails
+(exit status 1) when p50 or p99 of any case regresses past the threshold.
+
+Usage:
+    python benchmark_lambda_handler.py
+    python benchmark_lambda_handler.py --save-baseline benchmark-baseline.json
+    python benchmark_lambda_handler.py --baseline benchmark-baseline.json --threshold 20
+    python benchmark_lambda_handler.py --only handler --only routes
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+# Add this directory to path to import lambda_handler when run from elsewhere
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import lambda_handler
+from local_server import FakeContext, LocalLambdaClient, LocalS3Client, build_event
+
+TEMPLATE_SIZES = (1024, 10 * 1024, 100 * 1024, 1024 * 1024)
+PLACEHOLDER_COUNTS = (0, 10, 100, 500)
+ROUTE_COUNTS = (10, 100, 1000)
+GROUPS = ('handler', 'templates', 'routes', 'responses')
+
+
+def build_routes(count: int):
+    """Build a mix of exact, prefix and glob routes."""
+    routes = []
+    for i in range(count):
+        kind = i % 3
+        if kind == 0:
+            routes.append({'path': f'/svc{i}/api', 'match': 'prefix', 'arn': f'arn-{i}'})
+        elif kind == 1:
+            routes.append({'path': f'/svc{i}/health', 'match': 'exact', 'arn': f'arn-{i}'})
+        else:
+            routes.append({'path': f'/svc{i}/*/hook', 'match': 'glob', 'arn': f'arn-{i}'})
+    return routes
+
+
+def build_pattern_routes(count: int):
+    """Build glob routes whose first segment is an in-segment pattern (``/hookN-*/event``)."""
+    return [{'path': f'/hook{i}-*/event', 'match': 'glob', 'arn': f'arn-{i}'} for i in range(count)]
+
+
+def build_template(size: int, placeholders: int) -> str:
+    """Build an HTML template of about ``size`` bytes with evenly spread placeholders."""
+    names = sorted(lambda_handler.PLACEHOLDER_RESOLVERS)
+    slots = ['{{' + names[i % len(names)] + '}}' for i in range(placeholders)]
+    chunk = max(1, (size - sum(map(len, slots))) // (placeholders + 1))
+    line = '<p>Maintenance in progress. Please try again later.</p>\n'
+    filler = (line * (chunk // len(line) + 1))[:chunk]
+    parts = [filler]
+    for slot in slots:
+        parts.append(slot)
+        parts.append(filler)
+    return ''.join(parts)
+
+
+def measure(func: Callable[[], Any], samples: int, max_seconds: float = 2.0,
+            setup: Optional[Callable[[], Any]] = None) -> Dict[str, Any]:
+    """
+    Time ``func`` call by call.
+
+    Stops after ``samples`` calls or ``max_seconds`` (but always takes at
+    least 20 samples). ``setup`` runs untimed before every call.
+
+    Returns:
+        Dict with p50/p99 in microseconds and the sample count
+    """
+    for _ in range(3):
+        if setup:
+            setup()
+        func()
+
+    timings = []
+    deadline = time.perf_counter() + max_seconds
+    while len(timings) < samples and (len(timings) < 20 or time.perf_counter() < deadline):
+        if setup:
+            setup()
+        started = time.perf_counter_ns()
+        func()
+        timings.append(time.perf_counter_ns() - started)
+
+    timings.sort()
+    return {
+        'p50_us': round(timings[len(timings) // 2] / 1000, 2),
+        'p99_us': round(timings[min(len(timings) - 1, int(len(timings) * 0.99))] / 1000, 2),
+        'samples': len(timings)
+    }
+
+
+class FailingS3Client:
+    """S3 stand-in that always fails, forcing the fallback page."""
+
+    def get_object(self, **params):
+        raise lambda_handler.S3Error(500, 'InternalError')
+
+
+def bench_handler(samples: int) -> Dict[str, Dict[str, Any]]:
+    """Time lambda_handler on each of its branches against local stand-ins."""
+    results = {}
+    page_dir = os.path.dirname(os.path.abspath(__file__))
+
+    base = {
+        'S3_KEY': 'maintenance.html',
+        'SPECIAL_LAMBDA_ARN': 'arn:aws:lambda:ap-northeast-1:123456789012:function:special',
+        'PAGE_TMP_DIR': '',
+        'COMPRESSION_ENABLED': 'false',
+        'METRICS_ENABLED': 'false'
+    }
+    headers = {'host': 'example.com', 'user-agent': 'bench', 'accept': 'text/html'}
+    page_event = build_event('GET', '/shop/items', headers, b'', '192.168.1.100', 443)
+    special_event = build_event('GET', '/special/endpoint', headers, b'', '192.168.1.100', 443)
+    context = FakeContext()
+    cases = (
+        ('normal', {'MAINTENANCE_MODE': 'false'}, LocalS3Client(page_dir), page_event, False),
+        ('maintenance_cold', {'MAINTENANCE_MODE': 'true'}, LocalS3Client(page_dir), page_event, True),
+        ('maintenance_warm', {'MAINTENANCE_MODE': 'true'}, LocalS3Client(page_dir), page_event, False),
+        ('special', {'MAINTENANCE_MODE': 'true'}, LocalS3Client(page_dir), special_event, False),
+        ('fallback', {'MAINTENANCE_MODE': 'true'}, FailingS3Client(), page_event, True),
+    )
+
+    saved = lambda_handler.config_snapshot, lambda_handler.s3_client, lambda_handler.lambda_client
+    try:
+        for name, overrides, s3, event, cold in cases:
+            lambda_handler.config_snapshot = lambda_handler.load_config({**base, **overrides})
+            lambda_handler.s3_client = s3
+            lambda_handler.lambda_client = LocalLambdaClient()
+            lambda_handler.clear_page_cache()
+            results[f'handler/{name}'] = measure(
+                lambda: lambda_handler.lambda_handler(event, context), samples,
+                setup=lambda_handler.clear_page_cache if cold else None
+            )
+    finally:
+        lambda_handler.config_snapshot, lambda_handler.s3_client, lambda_handler.lambda_client = saved
+        lambda_handler.clear_page_cache()
+    return results
+
+
+def bench_templates(samples: int) -> Dict[str, Dict[str, Any]]:
+    """Time replace_parameters across template sizes and placeholder counts."""
+    results = {}
+    event = build_event('GET', '/shop/items', {'host': 'example.com', 'user-agent': 'bench'}, b'')
+    context = FakeContext()
+    for size in TEMPLATE_SIZES:
+        for count in PLACEHOLDER_COUNTS:
+            html = build_template(size, count)
+            results[f'replace_parameters/{size // 1024}KB/{count}'] = measure(
+                lambda: lambda_handler.replace_parameters(html, event, context), samples
+            )
+    return results
+
+
+def bench_routes(samples: int) -> Dict[str, Dict[str, Any]]:
+    """Time should_invoke_special_lambda across route table sizes."""
+    results = {}
+    for count in ROUTE_COUNTS:
+        config = lambda_handler.load_config({'SPECIAL_ROUTES': json.dumps(build_routes(count))})
+        hit_path = f'/svc{(count - 1) // 3 * 3}/api/v1/items'
+        miss_path = '/not/a/special/route'
+        assert lambda_handler.should_invoke_special_lambda(hit_path, config)
+        assert not lambda_handler.should_invoke_special_lambda(miss_path, config)
+        # A single lookup is well under a microsecond, so time batches of 100
+        results[f'routes/{count}/hit_x100'] = measure(
+            lambda: [lambda_handler.should_invoke_special_lambda(hit_path, config) for _ in range(100)], samples
+        )
+        results[f'routes/{count}/miss_x100'] = measure(
+            lambda: [lambda_handler.should_invoke_special_lambda(miss_path, config) for _ in range(100)], samples
+        )
+
+        # In-segment patterns indexed by literal prefix; the last route has the longest prefix
+        pattern_config = lambda_handler.load_config({'SPECIAL_ROUTES': json.dumps(build_pattern_routes(count))})
+        pattern_path = f'/hook{count - 1}-github/event'
+        assert lambda_handler.match_special_route(pattern_path, pattern_config).arn == f'arn-{count - 1}'
+        results[f'routes/{count}/pattern_x100'] = measure(
+            lambda: [lambda_handler.should_invoke_special_lambda(pattern_path, pattern_config) for _ in range(100)],
+            samples
+        )
+    return results
+
+
+def allocated_per_call(func: Callable[[], Any], calls: int = 200) -> int:
+    """Return the average peak bytes allocated by one call of ``func``."""
+    func()
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    total = 0
+    try:
+        for _ in range(calls):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            result = func()
+            total += tracemalloc.get_traced_memory()[1] - before
+            del result
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+    return total // calls
+
+
+def rebuild_json_response(status_description: str, body: Dict[str, Any]) -> Dict[str, Any]:
+    """Build a JSON response from scratch, as the handler did before the response catalog."""
+    return {
+        'statusCode': int(status_description.split(' ', 1)[0]),
+        'statusDescription': status_description,
+        'isBase64Encoded': False,
+        'headers': {
+            'Content-Type': 'application/json'
+        },
+        'body': json.dumps(body)
+    }
+
+
+def bench_responses(samples: int) -> Dict[str, Dict[str, Any]]:
+    """Compare catalog responses against rebuilding them on every call (time and allocations)."""
+    error = RuntimeError('Task timed out after 3.00 seconds')
+    cases = {
+        'normal': (
+            lambda: lambda_handler.RESPONSE_CATALOG['normal'].render('/shop/items'),
+            lambda: rebuild_json_response('200 OK', {'message': 'Service is operational', 'path': '/shop/items'})
+        ),
+        'handle_error': (
+            lambda: lambda_handler.handle_error(error),
+            lambda: rebuild_json_response('500 Internal Server Error', {
+                'error': 'Internal server error', 'message': str(error)
+            })
+        ),
+        'not_configured': (
+            lambda: lambda_handler.RESPONSE_CATALOG['not_configured'].render(),
+            lambda: rebuild_json_response('503 Service Unavailable', {'error': 'Special Lambda ARN not configured'})
+        ),
+        'fallback': (
+            lambda: lambda_handler.get_fallback_maintenance_response('S3 down'),
+            lambda: {
+                'statusCode': 503,
+                'statusDescription': '503 Service Unavailable',
+                'isBase64Encoded': False,
+                'headers': {'Content-Type': 'text/html; charset=utf-8', 'Retry-After': '3600'},
+                'body': lambda_handler.FALLBACK_HTML
+            }
+        ),
+    }
+    results = {}
+    for name, (catalog, rebuilt) in cases.items():
+        for variant, func in (('catalog', catalog), ('rebuilt', rebuilt)):
+            result = measure(func, samples)
+            result['alloc_bytes'] = allocated_per_call(func)
+            results[f'responses/{name}/{variant}'] = result
+    return results
+
+
+BENCHMARKS = {
+    'handler': bench_handler,
+    'templates': bench_templates,
+    'routes': bench_routes,
+    'responses': bench_responses,
+}
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]],
+            threshold: float) -> List[str]:
+    """
+    Compare results against a baseline.
+
+    Args:
+        results: Current results keyed by case name
+        baseline: Baseline results keyed by case name
+        threshold: Allowed slowdown in percent
+
+    Returns:
+        Descriptions of the cases whose p50 or p99 regressed past the threshold
+    """
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        for metric in ('p50_us', 'p99_us'):
+            if current[metric] > previous[metric] * (1 + threshold / 100):
+                change = (current[metric] / previous[metric] - 1) * 100 if previous[metric] else float('inf')
+                regressions.append(f'{name} {metric}: {previous[metric]:.2f} -> {current[metric]:.2f} (+{change:.0f}%)')
+    return regressions
+
+
+def print_results(results: Dict[str, Dict[str, Any]], baseline: Optional[Dict[str, Dict[str, Any]]] = None):
+    print(f'{"case":<40} {"p50 (us)":>12} {"p99 (us)":>12} {"samples":>8} {"alloc B":>8}'
+          + (' {:>10}'.format('p50 diff') if baseline else ''))
+    for name, result in results.items():
+        alloc = result.get('alloc_bytes')
+        line = (f'{name:<40} {result["p50_us"]:>12.2f} {result["p99_us"]:>12.2f} {result["samples"]:>8}'
+                f' {alloc if alloc is not None else "":>8}')
+        previous = (baseline or {}).get(name)
+        if previous and previous['p50_us']:
+            line += f' {(result["p50_us"] / previous["p50_us"] - 1) * 100:>+9.0f}%'
+        print(line)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the maintenance handler.')
+    parser.add_argument('--only', action='append', choices=GROUPS, help='run only these groups')
+    parser.add_argument('--samples', type=int, default=500, help='samples per case (default: 500)')
+    parser.add_argument('--baseline', help='compare against this JSON baseline')
+    parser.add_argument('--threshold', type=float, default=20.0,
+                        help='allowed p50/p99 slowdown against the baseline, in percent (default: 20)')
+    parser.add_argument('--save-baseline', help='write the results to this JSON file')
+    args = parser.parse_args(argv)
+
+    # Errors logged on the fallback branch would dominate its timing
+    logging.disable(logging.CRITICAL)
+
+    results = {}
+    for group in args.only or GROUPS:
+        results.update(BENCHMARKS[group](args.samples))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+    print_results(results, baseline)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'results': results
+            }, f, indent=2)
+        print(f'Baseline written to {args.save_baseline}')
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f'\nRegressions past {args.threshold:.0f}%:')
+            for regression in regressions:
+                print(f'  {regression}')
+            return 1
+        print(f'\nNo regressions past {args.threshold:.0f}%')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,187 @@
+"""
+Cold start harness for the Lambda maintenance handler.
+
+Every run starts a fresh interpreter (``python -X importtime``), imports
+``lambda_handler``, installs the local S3/Lambda stand-ins and invokes the
+handler once on one branch, like the first request of a new sandbox. Over N
+runs per branch it reports import time, first-invoke time, peak RSS and the
+import time of each module ``lambda_handler`` pulls in.
+
+Usage:
+    python coldstart_lambda_handler.py
+    python coldstart_lambda_handler.py --runs 20 --branch maintenance --env JSON_BACKEND=stdlib
+    python coldstart_lambda_handler.py --json coldstart.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import Any, Dict, List, Tuple
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BRANCHES = ('normal', 'maintenance', 'special', 'fallback')
+
+BRANCH_ENV = {
+    'normal': {'MAINTENANCE_MODE': 'false'},
+    'maintenance': {'MAINTENANCE_MODE': 'true'},
+    'special': {'MAINTENANCE_MODE': 'true', 'SPECIAL_LAMBDA_ARN': 'arn:aws:lambda:ap-northeast-1:123456789012:function:special'},
+    'fallback': {'MAINTENANCE_MODE': 'true', 'PAGE_BUNDLED_PATH': ''},
+}
+
+# Runs in the child interpreter. Only sys and time (both already loaded at
+# startup) are imported before lambda_handler so its import is measured alone.
+CHILD_CODE = r'''
+import sys, time
+started = time.perf_counter()
+import lambda_handler
+imported = time.perf_counter()
+
+import json, resource
+from local_server import FakeContext, LocalLambdaClient, LocalS3Client, build_event, install_stand_ins
+
+
+class FailingS3Client:
+    def get_object(self, **params):
+        raise lambda_handler.S3Error(500, 'InternalError')
+
+
+branch, page_dir = sys.argv[1], sys.argv[2]
+install_stand_ins(FailingS3Client() if branch == 'fallback' else LocalS3Client(page_dir), LocalLambdaClient())
+path = '/special/endpoint' if branch == 'special' else '/'
+event = build_event('GET', path, {'host': 'example.com', 'accept-encoding': 'gzip'}, b'', '192.168.1.100', 443)
+
+invoke_started = time.perf_counter()
+response = lambda_handler.lambda_handler(event, FakeContext())
+invoked = time.perf_counter()
+
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_invoke_ms': (invoked - invoke_started) * 1000,
+    'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'status': response['statusCode'],
+    'boto3_imported': 'boto3' in sys.modules
+}))
+'''
+
+
+def parse_importtime(stderr: str, root: str = 'lambda_handler') -> Dict[str, float]:
+    """
+    Extract the import cost of the modules ``root`` imports directly.
+
+    ``-X importtime`` prints each module after its dependencies, indented by
+    nesting level, so the modules imported by ``root`` are the deeper lines
+    right before it.
+
+    Args:
+        stderr: Output of ``python -X importtime``
+        root: Module whose imports to break down
+
+    Returns:
+        Cumulative import time in milliseconds keyed by module name, with
+        ``root`` itself under its own name and its own module body (including
+        compiling it when there is no bytecode cache) under ``root (self)``
+    """
+    entries: List[Tuple[int, str, float, float]] = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line.split(':', 1)[1].split('|')
+        level = (len(name) - len(name.lstrip())) // 2
+        entries.append((level, name.strip(), int(self_us) / 1000, int(cumulative_us) / 1000))
+
+    for index in range(len(entries) - 1, -1, -1):
+        level, name, self_ms, cumulative_ms = entries[index]
+        if name == root:
+            break
+    else:
+        return {}
+
+    breakdown = {root: cumulative_ms, f'{root} (self)': self_ms}
+    for child_level, child_name, _, child_ms in reversed(entries[:index]):
+        if child_level <= level:
+            break
+        if child_level == level + 1:
+            breakdown[child_name] = child_ms
+    return breakdown
+
+
+def run_once(branch: str, extra_env: Dict[str, str]) -> Dict[str, Any]:
+    """Run one cold start of ``branch`` in a fresh interpreter."""
+    with tempfile.TemporaryDirectory(prefix='coldstart-') as tmp_dir:
+        env = dict(os.environ)
+        env.update({
+            'S3_KEY': 'maintenance.html',
+            'PAGE_TMP_DIR': os.path.join(tmp_dir, 'pages'),
+            'WARMUP_ENABLED': 'false',
+        })
+        env.update(BRANCH_ENV[branch])
+        env.update(extra_env)
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', CHILD_CODE, branch, HERE],
+            cwd=HERE, env=env, capture_output=True, text=True, check=False
+        )
+    if result.returncode != 0:
+        raise RuntimeError(f'{branch} run failed:\n{result.stderr[-2000:]}')
+    sample = json.loads(result.stdout.strip().splitlines()[-1])
+    sample['modules_ms'] = parse_importtime(result.stderr)
+    return sample
+
+
+def summarize(samples: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Reduce the runs of one branch to medians and maxima."""
+    summary = {'runs': len(samples), 'status': samples[0]['status'],
+               'boto3_imported': any(sample['boto3_imported'] for sample in samples)}
+    for metric in ('import_ms', 'first_invoke_ms', 'peak_rss_mb'):
+        values = [sample[metric] for sample in samples]
+        summary[metric] = {'median': round(statistics.median(values), 2), 'max': round(max(values), 2)}
+    modules = {}
+    for sample in samples:
+        for name, ms in sample['modules_ms'].items():
+            modules.setdefault(name, []).append(ms)
+    summary['modules_ms'] = dict(sorted(
+        ((name, round(statistics.median(values), 2)) for name, values in modules.items()),
+        key=lambda item: -item[1]
+    ))
+    return summary
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Measure lambda_handler cold starts in fresh interpreters.')
+    parser.add_argument('--runs', type=int, default=10, help='cold starts per branch (default: 10)')
+    parser.add_argument('--branch', action='append', choices=BRANCHES, help='measure only these branches')
+    parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE',
+                        help='extra environment for the handler, e.g. S3_FETCHER=sigv4')
+    parser.add_argument('--top', type=int, default=10, help='modules shown in the breakdown (default: 10)')
+    parser.add_argument('--json', help='also write the summary to this JSON file')
+    args = parser.parse_args(argv)
+
+    extra_env = dict(item.split('=', 1) for item in args.env)
+    report = {}
+    for branch in args.branch or BRANCHES:
+        report[branch] = summarize([run_once(branch, extra_env) for _ in range(args.runs)])
+
+    print(f'{"branch":<12} {"status":>6} {"import ms":>16} {"first invoke ms":>16} {"peak RSS MB":>16}  (median / max)')
+    for branch, summary in report.items():
+        cells = [f'{summary[m]["median"]:.1f} / {summary[m]["max"]:.1f}'
+                 for m in ('import_ms', 'first_invoke_ms', 'peak_rss_mb')]
+        print(f'{branch:<12} {summary["status"]:>6} {cells[0]:>16} {cells[1]:>16} {cells[2]:>16}'
+              + ('  boto3 imported' if summary['boto3_imported'] else ''))
+
+    first = next(iter(report.values()))
+    print(f'\nImport breakdown (median cumulative ms, {args.runs} runs)')
+    for name, ms in list(first['modules_ms'].items())[:args.top + 1]:
+        print(f'  {name:<30} {ms:>8.2f}')
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f'\nSummary written to {args.json}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -39,6 +39,8 @@ pip install -r requirements.txt -t ./package/
 # Lambda関数ファイルをパッケージにコピー
 echo "Lambda関数をパッケージング中..."
 cp lambda_handler.py ./package/
+# PAGE_BUNDLED_PATH=maintenance.html で使用する同梱メンテナンス画面
+cp maintenance.html ./package/
 
 # ZIPファイルを作成
 cd package
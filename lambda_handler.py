@@ -8,38 +8,2247 @@ This Lambda function:
 - Routes specific URLs to invoke another Lambda function for special processing
 """
 
+import abc
+import base64
+import collections
+import dataclasses
+import datetime
+import fnmatch
+import functools
+import hashlib
+import hmac
 import json
+import logging
 import os
-import boto3
-from typing import Dict, Any
+import re
+import struct
+import sys
+import threading
+import time
+import weakref
+import zlib
+from typing import Dict, Any, Callable, List, Optional, Tuple
 
-# Initialize AWS clients (lazy initialization to avoid region errors during import)
+try:
+    import brotli
+except ImportError:  # optional dependency, not bundled with the Lambda runtime
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Initialize AWS clients (lazy initialization to avoid region errors during import).
+# boto3/botocore are imported inside the factories so that sandboxes that never
+# build a client (normal mode, cached page) do not pay for importing them.
 s3_client = None
 lambda_client = None
+# Serializes client creation between the INIT warmup thread and requests
+client_lock = threading.Lock()
+
+def get_client_config(read_timeout: float, config: Optional['Config'] = None,
+                      max_attempts: Optional[int] = None):
+    """
+    Build the botocore settings shared by the AWS clients.
+    
+    Args:
+        read_timeout: Socket read timeout in seconds for this client
+        config: Configuration (optional, uses the sandbox snapshot if not provided)
+        max_attempts: Total attempts including the first (optional, defaults to CLIENT_MAX_ATTEMPTS)
+    
+    Returns:
+        botocore client configuration
+    """
+    from botocore.config import Config as BotocoreConfig
+    
+    if config is None:
+        config = get_config()
+    return BotocoreConfig(
+        connect_timeout=config.client_connect_timeout,
+        read_timeout=read_timeout,
+        retries={
+            'mode': config.client_retry_mode,
+            'total_max_attempts': max_attempts or config.client_max_attempts
+        },
+        tcp_keepalive=config.client_tcp_keepalive,
+        max_pool_connections=config.client_max_pool_connections
+    )
+
+def get_s3_client():
+    """Get or create S3 client."""
+    global s3_client
+    if s3_client is None:
+        with client_lock:
+            if s3_client is None:
+                config = get_config()
+                if config.s3_fetcher == 'sigv4':
+                    s3_client = LightweightS3Client(
+                        endpoint_url=config.s3_endpoint_url,
+                        timeout=config.s3_read_timeout
+                    )
+                else:
+                    import boto3
+                    s3_client = boto3.client(
+                        's3',
+                        endpoint_url=config.s3_endpoint_url or None,
+                        config=get_client_config(config.s3_read_timeout, config)
+                    )
+    return s3_client
+
+def get_lambda_client():
+    """
+    Get or create Lambda client.
+    
+    The client never retries: botocore treats read timeouts as retryable, so
+    one slow call could otherwise outlast the function timeout, and special
+    functions are not idempotent in general (hedging covers the ones that are).
+    """
+    global lambda_client
+    if lambda_client is None:
+        with client_lock:
+            if lambda_client is None:
+                import boto3
+                lambda_client = boto3.client(
+                    'lambda',
+                    config=get_client_config(get_config().lambda_read_timeout, max_attempts=1)
+                )
+    return lambda_client
+
+# Lightweight S3 reader (SigV4 over a pooled stdlib HTTPS connection)
+EMPTY_SHA256 = hashlib.sha256(b'').hexdigest()
+S3_ERROR_CODE_PATTERN = re.compile(r'<Code>([^<]+)</Code>')
+
+
+class S3Error(Exception):
+    """
+    Error answer from S3, shaped like botocore's ClientError.
+    
+    ``response`` carries ``Error.Code`` and ``ResponseMetadata.HTTPStatusCode``
+    so callers can handle both clients the same way.
+    """
+
+    def __init__(self, status: int, code: str, message: str = ''):
+        super().__init__(f'S3 GetObject failed: {status} {code} {message}'.strip())
+        self.response = {
+            'Error': {'Code': code, 'Message': message},
+            'ResponseMetadata': {'HTTPStatusCode': status}
+        }
+
+
+def hmac_sha256(key: bytes, message: str) -> bytes:
+    return hmac.new(key, message.encode('utf-8'), hashlib.sha256).digest()
+
+
+@functools.lru_cache(maxsize=8)
+def sigv4_signing_key(secret_key: str, date: str, region: str, service: str) -> bytes:
+    """Derive (and memoize per day) the SigV4 signing key."""
+    key = hmac_sha256(('AWS4' + secret_key).encode('utf-8'), date)
+    key = hmac_sha256(key, region)
+    key = hmac_sha256(key, service)
+    return hmac_sha256(key, 'aws4_request')
+
+
+def sigv4_headers(method: str, host: str, path: str, region: str, access_key: str, secret_key: str,
+                  session_token: Optional[str] = None, amz_date: Optional[str] = None,
+                  service: str = 's3') -> Dict[str, str]:
+    """
+    Build SigV4 headers for a request without a query string or body.
+    
+    Args:
+        method: HTTP method
+        host: Host header value
+        path: URI-encoded request path
+        region: AWS region
+        access_key: AWS access key ID
+        secret_key: AWS secret access key
+        session_token: Session token for temporary credentials (optional)
+        amz_date: Request time as YYYYMMDDTHHMMSSZ (defaults to now)
+        service: Service name used in the credential scope
+    
+    Returns:
+        Headers to send, including Authorization
+    """
+    if amz_date is None:
+        amz_date = time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())
+    date = amz_date[:8]
+    headers = {
+        'host': host,
+        'x-amz-content-sha256': EMPTY_SHA256,
+        'x-amz-date': amz_date,
+    }
+    if session_token:
+        headers['x-amz-security-token'] = session_token
+    
+    signed_headers = ';'.join(sorted(headers))
+    canonical_headers = ''.join(f'{name}:{headers[name]}\n' for name in sorted(headers))
+    canonical_request = '\n'.join([method, path, '', canonical_headers, signed_headers, EMPTY_SHA256])
+    scope = f'{date}/{region}/{service}/aws4_request'
+    string_to_sign = '\n'.join([
+        'AWS4-HMAC-SHA256', amz_date, scope,
+        hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()
+    ])
+    signature = hmac.new(
+        sigv4_signing_key(secret_key, date, region, service),
+        string_to_sign.encode('utf-8'), hashlib.sha256
+    ).hexdigest()
+    headers['authorization'] = (
+        f'AWS4-HMAC-SHA256 Credential={access_key}/{scope}, '
+        f'SignedHeaders={signed_headers}, Signature={signature}'
+    )
+    return headers
+
+
+class LightweightS3Client:
+    """
+    Minimal S3 reader that implements only ``get_object``.
+    
+    Requests are signed with SigV4 using the credentials Lambda exposes in the
+    environment (AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_SESSION_TOKEN)
+    and sent over one persistent HTTP(S) connection per host, avoiding the
+    cost of importing boto3 and loading the S3 service model. Responses use
+    the boto3 shapes that download_maintenance_page relies on.
+    """
+
+    def __init__(self, region: Optional[str] = None, endpoint_url: str = '', timeout: float = 3.0):
+        self.region = region or os.environ.get('AWS_REGION') or os.environ.get('AWS_DEFAULT_REGION')
+        if not self.region:
+            raise ValueError('AWS_REGION is not set')
+        self.endpoint_url = endpoint_url.rstrip('/')
+        self.timeout = timeout
+        self.connections = {}
+        self.lock = threading.Lock()
+
+    def address(self, bucket: str, key: str) -> Tuple[str, str, str]:
+        """Return (scheme, host, path) for an object."""
+        from urllib.parse import quote
+        
+        key_path = quote(key, safe='/~')
+        if self.endpoint_url:
+            scheme, _, host = self.endpoint_url.partition('://')
+            return scheme, host, f'/{quote(bucket, safe="")}/{key_path}'
+        return 'https', f'{bucket}.s3.{self.region}.amazonaws.com', '/' + key_path
+
+    def connection(self, scheme: str, host: str):
+        conn = self.connections.get((scheme, host))
+        if conn is None:
+            import http.client
+            
+            factory = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+            conn = self.connections[(scheme, host)] = factory(host, timeout=self.timeout)
+        return conn
+
+    def request(self, scheme: str, host: str, path: str, headers: Dict[str, str]):
+        """Send a GET, retrying once on a dropped keep-alive connection."""
+        import http.client
+        
+        for attempt in (1, 2):
+            conn = self.connection(scheme, host)
+            try:
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+                return response.status, response.getheader('ETag'), response.read()
+            except (http.client.HTTPException, OSError) as e:
+                conn.close()
+                del self.connections[(scheme, host)]
+                if attempt == 2 or isinstance(e, TimeoutError):
+                    raise
+
+    def get_object(self, Bucket: str, Key: str, IfNoneMatch: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Fetch an object, optionally as a conditional GET.
+        
+        Args:
+            Bucket: S3 bucket name
+            Key: S3 object key
+            IfNoneMatch: ETag of a cached copy (optional)
+        
+        Returns:
+            Dict with ``Body`` (readable) and ``ETag``
+        
+        Raises:
+            S3Error: On any non-200 answer, including 304 Not Modified
+        """
+        import io
+        
+        scheme, host, path = self.address(Bucket, Key)
+        headers = sigv4_headers(
+            'GET', host, path, self.region,
+            os.environ.get('AWS_ACCESS_KEY_ID', ''),
+            os.environ.get('AWS_SECRET_ACCESS_KEY', ''),
+            os.environ.get('AWS_SESSION_TOKEN')
+        )
+        if IfNoneMatch:
+            headers['if-none-match'] = IfNoneMatch
+        
+        with self.lock:
+            status, etag, body = self.request(scheme, host, path, headers)
+        
+        if status == 200:
+            return {'Body': io.BytesIO(body), 'ETag': etag}
+        if status == 304:
+            raise S3Error(304, '304', 'Not Modified')
+        match = S3_ERROR_CODE_PATTERN.search(body.decode('utf-8', 'replace'))
+        raise S3Error(status, match.group(1) if match else str(status))
+
+
+# Configuration (parsed and validated once per sandbox)
+class ConfigError(ValueError):
+    """Raised when an environment variable holds an invalid value."""
+
+
+TRUE_VALUES = frozenset(['true', '1', 'yes', 'on'])
+FALSE_VALUES = frozenset(['false', '0', 'no', 'off'])
+
+
+def parse_bool(environ, name: str, default: bool) -> bool:
+    """Parse a boolean environment variable, rejecting unknown spellings."""
+    value = environ.get(name)
+    if value is None or value.strip() == '':
+        return default
+    value = value.strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise ConfigError(f'{name} must be true or false, got {value!r}')
+
+
+def parse_float(environ, name: str, default: float, minimum: float = 0.0) -> float:
+    """Parse a numeric environment variable with a lower bound."""
+    value = environ.get(name)
+    if value is None or value.strip() == '':
+        return default
+    try:
+        number = float(value)
+    except ValueError:
+        raise ConfigError(f'{name} must be a number, got {value!r}') from None
+    if not number >= minimum:
+        raise ConfigError(f'{name} must be >= {minimum}, got {value!r}')
+    return number
+
+
+def parse_int(environ, name: str, default: int, minimum: int = 0) -> int:
+    """Parse an integer environment variable with a lower bound."""
+    value = environ.get(name)
+    if value is None or value.strip() == '':
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        raise ConfigError(f'{name} must be an integer, got {value!r}') from None
+    if number < minimum:
+        raise ConfigError(f'{name} must be >= {minimum}, got {value!r}')
+    return number
+
+
+def parse_choice(environ, name: str, default: str, choices: Tuple[str, ...]) -> str:
+    """Parse an environment variable restricted to a fixed set of values."""
+    value = (environ.get(name) or '').strip() or default
+    if value not in choices:
+        raise ConfigError(f'{name} must be one of {", ".join(choices)}, got {value!r}')
+    return value
+
+
+# Special URL routing
+ROUTE_MATCH_TYPES = ('exact', 'prefix', 'glob')
+INVOCATION_TYPES = ('RequestResponse', 'Event')
+GLOB_CHARS = re.compile(r'[*?\[]')
+
+
+class EventProjection:
+    """
+    Rules for trimming the ALB event before it is sent to a special Lambda.
+    
+    ``headers`` is True (keep all), False (drop all) or a frozenset of
+    lower-case header names to keep; ``body``, ``query``, ``request_context``
+    and ``context`` say whether the body, the query string parameters, the
+    ALB request context and the Lambda context dict are sent. ``path`` and
+    ``httpMethod`` are always kept.
+    """
+
+    __slots__ = ('headers', 'body', 'query', 'request_context', 'context')
+
+    OPTIONS = ('headers', 'body', 'query', 'request_context', 'context')
+
+    def __init__(self, headers=True, body: bool = True, query: bool = True,
+                 request_context: bool = True, context: bool = True):
+        self.headers = headers
+        self.body = body
+        self.query = query
+        self.request_context = request_context
+        self.context = context
+
+    @classmethod
+    def from_dict(cls, spec: Any, route_path: str) -> 'EventProjection':
+        """Build a projection from its route JSON, validating every option."""
+        if not isinstance(spec, dict) or set(spec) - set(cls.OPTIONS):
+            raise ConfigError(f'Invalid projection for route {route_path!r}: {spec!r}')
+        headers = spec.get('headers', True)
+        if isinstance(headers, list) and all(isinstance(name, str) for name in headers):
+            headers = frozenset(name.lower() for name in headers)
+        elif not isinstance(headers, bool):
+            raise ConfigError(f'Projection headers for route {route_path!r} must be a boolean or a list of names')
+        flags = {}
+        for name in ('body', 'query', 'request_context', 'context'):
+            flags[name] = spec.get(name, True)
+            if not isinstance(flags[name], bool):
+                raise ConfigError(f'Projection {name} for route {route_path!r} must be a boolean')
+        return cls(headers=headers, **flags)
+
+    def apply(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        """Return a trimmed shallow copy of the event."""
+        projected = dict(event)
+        if self.headers is not True:
+            for name in ('headers', 'multiValueHeaders'):
+                values = projected.pop(name, None)
+                if self.headers and values:
+                    projected[name] = {k: v for k, v in values.items() if k.lower() in self.headers}
+        if not self.body:
+            projected.pop('body', None)
+            projected.pop('isBase64Encoded', None)
+        if not self.query:
+            projected.pop('queryStringParameters', None)
+            projected.pop('multiValueQueryStringParameters', None)
+        if not self.request_context:
+            projected.pop('requestContext', None)
+        return projected
+
+
+class Route:
+    """
+    A special URL rule routed to a Lambda function.
+    
+    ``invocation_type`` is ``RequestResponse`` (wait for the function's
+    response) or ``Event`` (fire and forget, answered with 202 Accepted).
+    ``projection`` optionally trims the event sent to the function.
+    ``idempotent`` routes may be invoked twice (see invoke_hedged).
+    """
+
+    __slots__ = ('path', 'match', 'arn', 'invocation_type', 'projection', 'idempotent')
+
+    def __init__(self, path: str, match: str, arn: str, invocation_type: str = 'RequestResponse',
+                 projection: Optional[EventProjection] = None, idempotent: bool = False):
+        self.path = path
+        self.match = match
+        self.arn = arn
+        self.invocation_type = invocation_type
+        self.projection = projection
+        self.idempotent = idempotent
+
+    def __repr__(self):
+        return f'Route({self.match} {self.path!r} -> {self.arn!r})'
+
+
+class RouteNode:
+    """
+    One path segment of the route trie.
+    
+    ``patterns`` holds the in-segment glob patterns in insertion order as
+    ``(order, regex, child)``. Each pattern is also indexed by its literal
+    prefix (``hook1-`` for ``hook1-*``) in ``by_prefix``, or failing that by
+    its literal suffix (``.json`` for ``*.json``) in ``by_suffix``; patterns
+    with neither (``*x*``) are kept in ``unanchored`` and tried for every
+    segment.
+    """
+
+    __slots__ = (
+        'children', 'patterns', 'by_prefix', 'prefix_lengths', 'by_suffix', 'suffix_lengths', 'unanchored',
+        'wildcard', 'exact', 'prefix',
+    )
+
+    def __init__(self):
+        self.children = {}
+        self.patterns = []
+        self.by_prefix = {}
+        self.prefix_lengths = ()
+        self.by_suffix = {}
+        self.suffix_lengths = ()
+        self.unanchored = []
+        self.wildcard = None
+        self.exact = None
+        self.prefix = None
+
+
+def split_path(path: str) -> List[str]:
+    """Split a URL path into segments, ignoring empty ones."""
+    return [segment for segment in path.split('/') if segment]
+
+
+def literal_affixes(pattern: str) -> Tuple[str, str]:
+    """
+    Return the literal text before the first and after the last glob character.
+    
+    The suffix is left empty for patterns with a ``[...]`` class, whose
+    closing bracket is not a glob character on its own.
+    """
+    first = GLOB_CHARS.search(pattern).start()
+    if '[' in pattern:
+        return pattern[:first], ''
+    last = max(pattern.rfind('*'), pattern.rfind('?'))
+    return pattern[:first], pattern[last + 1:]
+
+
+class RouteTable:
+    """
+    Special URL routes compiled into a segment trie.
+    
+    Matching is segment aware (``/special`` matches ``/special/x`` but not
+    ``/specialx``) and walks one trie node per path segment, so lookup cost
+    for literal and ``*`` segments depends on the path length rather than
+    the number of routes. Exact
+    matches win over prefix matches, deeper matches over shallower ones, and
+    literal segments over glob segments.
+    
+    Glob routes match per segment: ``*`` matches one segment, ``**`` as the
+    last segment matches any remainder, and fnmatch patterns such as
+    ``*.json`` match within a segment. In-segment patterns are indexed by
+    their literal prefix or suffix, so a segment is only matched against the
+    patterns sharing one of its affixes; patterns with no literal affix
+    (``*x*``) are matched against every segment and cost O(patterns).
+    """
+
+    def __init__(self, routes: List[Route]):
+        self.routes = tuple(routes)
+        self.root = RouteNode()
+        for route in routes:
+            self.add(route)
+
+    def __len__(self):
+        return len(self.routes)
+
+    def add(self, route: Route):
+        if route.match not in ROUTE_MATCH_TYPES:
+            raise ConfigError(f'Unknown route match type {route.match!r} for {route.path!r}')
+        if route.invocation_type not in INVOCATION_TYPES:
+            raise ConfigError(f'Unknown invocation type {route.invocation_type!r} for {route.path!r}')
+        if not isinstance(route.idempotent, bool):
+            raise ConfigError(f'"idempotent" must be true or false for {route.path!r}')
+        segments = split_path(route.path)
+        terminal = 'exact' if route.match == 'exact' else 'prefix'
+        node = self.root
+        for i, segment in enumerate(segments):
+            if route.match == 'glob' and segment == '**':
+                if i != len(segments) - 1:
+                    raise ConfigError(f'"**" must be the last segment in {route.path!r}')
+                terminal = 'prefix'
+                break
+            node = self.child(node, segment, route.match == 'glob')
+        else:
+            if route.match == 'glob':
+                terminal = 'exact'
+        if getattr(node, terminal) is not None:
+            raise ConfigError(f'Duplicate special route {route.path!r}')
+        setattr(node, terminal, route)
+
+    @staticmethod
+    def child(node: RouteNode, segment: str, glob: bool) -> RouteNode:
+        if glob and segment == '*':
+            if node.wildcard is None:
+                node.wildcard = RouteNode()
+            return node.wildcard
+        if glob and GLOB_CHARS.search(segment):
+            regex = re.compile(fnmatch.translate(segment))
+            for _, existing, child in node.patterns:
+                if existing.pattern == regex.pattern:
+                    return child
+            child = RouteNode()
+            entry = (len(node.patterns), regex, child)
+            node.patterns.append(entry)
+            head, tail = literal_affixes(segment)
+            if head:
+                node.by_prefix.setdefault(head, []).append(entry)
+                node.prefix_lengths = tuple(sorted(set(node.prefix_lengths) | {len(head)}))
+            elif tail:
+                node.by_suffix.setdefault(tail, []).append(entry)
+                node.suffix_lengths = tuple(sorted(set(node.suffix_lengths) | {len(tail)}))
+            else:
+                node.unanchored.append(entry)
+            return child
+        child = node.children.get(segment)
+        if child is None:
+            child = node.children[segment] = RouteNode()
+        return child
+
+    @staticmethod
+    def pattern_candidates(node: RouteNode, segment: str) -> list:
+        """Return the patterns of ``node`` sharing a literal affix with ``segment``, in insertion order."""
+        candidates = list(node.unanchored)
+        for length in node.prefix_lengths:
+            if length > len(segment):
+                break
+            candidates += node.by_prefix.get(segment[:length], ())
+        for length in node.suffix_lengths:
+            if length > len(segment):
+                break
+            candidates += node.by_suffix.get(segment[-length:], ())
+        candidates.sort(key=lambda entry: entry[0])
+        return candidates
+
+    def lookup(self, path: str) -> Optional[Route]:
+        """Return the best route for ``path``, or None if no route matches."""
+        return self.walk(self.root, split_path(path), 0)
+
+    def walk(self, node: RouteNode, segments: List[str], i: int) -> Optional[Route]:
+        if i == len(segments):
+            return node.exact or node.prefix
+        segment = segments[i]
+        child = node.children.get(segment)
+        if child is not None:
+            route = self.walk(child, segments, i + 1)
+            if route is not None:
+                return route
+        if node.patterns:
+            for _, regex, child in self.pattern_candidates(node, segment):
+                if regex.match(segment):
+                    route = self.walk(child, segments, i + 1)
+                    if route is not None:
+                        return route
+        if node.wildcard is not None:
+            route = self.walk(node.wildcard, segments, i + 1)
+            if route is not None:
+                return route
+        return node.prefix
+
+
+def parse_routes(environ) -> RouteTable:
+    """
+    Build the special route table.
+    
+    Routes come from SPECIAL_ROUTES (a JSON list) or, if unset, from the JSON
+    file named by SPECIAL_ROUTES_FILE. Each entry is an object with ``path``,
+    ``arn``, an optional ``match`` (``exact``, ``prefix`` or ``glob``;
+    default ``prefix``), an optional ``invocation_type`` (``RequestResponse``
+    or ``Event``; default ``RequestResponse``), an optional ``projection``
+    object (see EventProjection) limiting what is sent to the function and an
+    optional ``idempotent`` flag allowing hedged invocations. Without either,
+    SPECIAL_URL_PATH, SPECIAL_LAMBDA_ARN, SPECIAL_INVOCATION_TYPE and
+    SPECIAL_IDEMPOTENT define a single prefix route.
+    
+    Args:
+        environ: Mapping to read from
+    
+    Returns:
+        Compiled route table
+    
+    Raises:
+        ConfigError: If the route definitions are invalid
+    """
+    source = environ.get('SPECIAL_ROUTES', '').strip()
+    source_name = 'SPECIAL_ROUTES'
+    routes_file = environ.get('SPECIAL_ROUTES_FILE', '').strip()
+    if not source and routes_file:
+        source_name = routes_file
+        try:
+            with open(routes_file, encoding='utf-8') as f:
+                source = f.read()
+        except OSError as e:
+            raise ConfigError(f'Cannot read SPECIAL_ROUTES_FILE: {e}') from None
+    
+    if not source:
+        path = environ.get('SPECIAL_URL_PATH', '/special')
+        if not path:
+            return RouteTable([])
+        invocation_type = environ.get('SPECIAL_INVOCATION_TYPE', '') or 'RequestResponse'
+        return RouteTable([Route(path, 'prefix', environ.get('SPECIAL_LAMBDA_ARN', ''), invocation_type,
+                                 idempotent=parse_bool(environ, 'SPECIAL_IDEMPOTENT', False))])
+    
+    try:
+        entries = json.loads(source)
+    except ValueError as e:
+        raise ConfigError(f'{source_name} is not valid JSON: {e}') from None
+    if not isinstance(entries, list):
+        raise ConfigError(f'{source_name} must be a JSON list of routes')
+    
+    routes = []
+    for entry in entries:
+        if not isinstance(entry, dict) or not isinstance(entry.get('path'), str) or not entry['path'].startswith('/'):
+            raise ConfigError(f'Invalid route in {source_name}: {entry!r}')
+        projection = entry.get('projection')
+        routes.append(Route(
+            entry['path'],
+            entry.get('match', 'prefix'),
+            entry.get('arn', ''),
+            entry.get('invocation_type', 'RequestResponse'),
+            EventProjection.from_dict(projection, entry['path']) if projection is not None else None,
+            entry.get('idempotent', False)
+        ))
+    return RouteTable(routes)
+
+
+# JSON backends (stdlib, or orjson when installed)
+JSON_BACKENDS = ('auto', 'stdlib', 'orjson')
+
+
+class JsonBackend:
+    """A JSON implementation: ``dumps`` returns compact UTF-8 bytes, ``loads`` accepts str or bytes."""
+
+    __slots__ = ('name', 'dumps', 'loads')
+
+    def __init__(self, name: str, dumps: Callable[[Any], bytes], loads: Callable[[Any], Any]):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+    def __repr__(self):
+        return f'JsonBackend({self.name!r})'
+
+
+def stdlib_json_dumps(obj: Any) -> bytes:
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def load_json_backend(name: str) -> JsonBackend:
+    """
+    Resolve a JSON_BACKEND setting.
+    
+    Args:
+        name: 'auto' (orjson if importable, else stdlib), 'stdlib' or 'orjson'
+    
+    Returns:
+        The JSON backend
+    
+    Raises:
+        ConfigError: If orjson is requested but not installed
+    """
+    if name in ('auto', 'orjson'):
+        try:
+            import orjson
+        except ImportError:
+            if name == 'orjson':
+                raise ConfigError('JSON_BACKEND is orjson but orjson is not installed') from None
+        else:
+            return JsonBackend('orjson', orjson.dumps, orjson.loads)
+    return JsonBackend('stdlib', stdlib_json_dumps, json.loads)
+
+
+# Configuration settings: allowed values and defaults
+RETRY_MODES = ('legacy', 'standard', 'adaptive')
+S3_FETCHERS = ('boto3', 'sigv4')
+LANGUAGE_TAG_PATTERN = re.compile(r'[A-Za-z]{1,8}(?:-[A-Za-z0-9]{1,8})*')
+PAGE_TMP_DIR_DEFAULT = '/tmp/maintenance-pages'
+PROFILE_DIR_DEFAULT = '/tmp/profiles'
+
+
+def parse_breaker_response(environ) -> Dict[str, Any]:
+    """
+    Build the response returned while a circuit breaker is open.
+    
+    BREAKER_RESPONSE may hold a complete ALB response as JSON; otherwise a 503
+    JSON error with a Retry-After of BREAKER_OPEN_DURATION is used.
+    """
+    source = (environ.get('BREAKER_RESPONSE') or '').strip()
+    if not source:
+        retry_after = int(parse_float(environ, 'BREAKER_OPEN_DURATION', 30.0))
+        return {
+            'statusCode': 503,
+            'statusDescription': '503 Service Unavailable',
+            'isBase64Encoded': False,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Retry-After': str(max(retry_after, 1))
+            },
+            'body': json.dumps({
+                'error': 'Special Lambda temporarily unavailable'
+            })
+        }
+    try:
+        response = json.loads(source)
+    except ValueError as e:
+        raise ConfigError(f'BREAKER_RESPONSE is not valid JSON: {e}') from None
+    problem = validate_alb_response(response)
+    if problem:
+        raise ConfigError(f'BREAKER_RESPONSE is not a valid ALB response: {problem}')
+    return response
+
+
+def parse_key_map(environ) -> Dict[str, str]:
+    """Parse S3_KEY_MAP, a JSON object mapping host names to S3 keys."""
+    source = (environ.get('S3_KEY_MAP') or '').strip()
+    if not source:
+        return {}
+    try:
+        mapping = json.loads(source)
+    except ValueError as e:
+        raise ConfigError(f'S3_KEY_MAP is not valid JSON: {e}') from None
+    if not isinstance(mapping, dict) or not all(isinstance(k, str) and isinstance(v, str) and v
+                                                for k, v in mapping.items()):
+        raise ConfigError('S3_KEY_MAP must be a JSON object of host names to non-empty S3 keys')
+    return {host.lower(): key for host, key in mapping.items()}
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Config:
+    """Immutable handler configuration parsed from environment variables.
+    
+    Use dataclasses.replace() to derive a modified copy and reload_config()
+    to re-read the environment.
+    """
+    
+    maintenance_mode: bool
+    s3_bucket: str
+    s3_key: str
+    special_routes: RouteTable
+    page_cache_enabled: bool
+    page_cache_ttl: float
+    page_cache_swr: bool
+    page_cache_max_stale: float
+    compression_enabled: bool
+    client_connect_timeout: float
+    s3_read_timeout: float
+    lambda_read_timeout: float
+    client_retry_mode: str
+    client_max_attempts: int
+    client_tcp_keepalive: bool
+    client_max_pool_connections: int
+    function_timeout: float
+    warmup_enabled: bool
+    warmup_timeout: float
+    s3_fetcher: str
+    s3_endpoint_url: str
+    page_tmp_dir: str
+    page_bundled_path: str
+    json: JsonBackend
+    breaker_enabled: bool
+    breaker_window: float
+    breaker_min_requests: int
+    breaker_error_rate: float
+    breaker_slow_call: float
+    breaker_open_duration: float
+    breaker_half_open_probes: int
+    breaker_response: Dict[str, Any]
+    hedge_delay: float
+    hedge_budget: float
+    metrics_enabled: bool
+    metrics_namespace: str
+    profile_every_n: int
+    profile_top_k: int
+    profile_dir: str
+    s3_key_template: str
+    s3_key_template_hosts: Tuple[str, ...]
+    s3_key_map: Dict[str, str]
+    page_cache_max_bytes: int
+    page_languages: Tuple[str, ...]
+    page_default_language: str
+
+
+def load_config(environ=None) -> Config:
+    """
+    Parse and validate the configuration from environment variables.
+    
+    Args:
+        environ: Mapping to read from (defaults to os.environ)
+    
+    Returns:
+        Parsed configuration
+    
+    Raises:
+        ConfigError: If a variable holds an invalid value
+    """
+    env = os.environ if environ is None else environ
+    config = Config(
+        maintenance_mode=parse_bool(env, 'MAINTENANCE_MODE', True),
+        s3_bucket=env.get('S3_BUCKET', 'maintenance-pages'),
+        s3_key=env.get('S3_KEY', 'maintenance.html'),
+        special_routes=parse_routes(env),
+        page_cache_enabled=parse_bool(env, 'PAGE_CACHE_ENABLED', True),
+        page_cache_ttl=parse_float(env, 'PAGE_CACHE_TTL', 60.0),
+        page_cache_swr=parse_bool(env, 'PAGE_CACHE_SWR', False),
+        page_cache_max_stale=parse_float(env, 'PAGE_CACHE_MAX_STALE', 3600.0),
+        compression_enabled=parse_bool(env, 'COMPRESSION_ENABLED', True),
+        client_connect_timeout=parse_float(env, 'CLIENT_CONNECT_TIMEOUT', 2.0, minimum=0.1),
+        s3_read_timeout=parse_float(env, 'S3_READ_TIMEOUT', 3.0, minimum=0.1),
+        lambda_read_timeout=parse_float(env, 'LAMBDA_READ_TIMEOUT', 25.0, minimum=0.1),
+        client_retry_mode=parse_choice(env, 'CLIENT_RETRY_MODE', 'adaptive', RETRY_MODES),
+        client_max_attempts=parse_int(env, 'CLIENT_MAX_ATTEMPTS', 3, minimum=1),
+        client_tcp_keepalive=parse_bool(env, 'CLIENT_TCP_KEEPALIVE', True),
+        client_max_pool_connections=parse_int(env, 'CLIENT_MAX_POOL_CONNECTIONS', 10, minimum=1),
+        function_timeout=parse_float(env, 'FUNCTION_TIMEOUT', 30.0, minimum=1.0),
+        warmup_enabled=parse_bool(env, 'WARMUP_ENABLED', False),
+        warmup_timeout=parse_float(env, 'WARMUP_TIMEOUT', 2.0),
+        s3_fetcher=parse_choice(env, 'S3_FETCHER', 'boto3', S3_FETCHERS),
+        s3_endpoint_url=env.get('S3_ENDPOINT_URL', '').strip(),
+        page_tmp_dir=env.get('PAGE_TMP_DIR', PAGE_TMP_DIR_DEFAULT).strip(),
+        page_bundled_path=env.get('PAGE_BUNDLED_PATH', '').strip(),
+        json=load_json_backend(parse_choice(env, 'JSON_BACKEND', 'auto', JSON_BACKENDS)),
+        breaker_enabled=parse_bool(env, 'BREAKER_ENABLED', False),
+        breaker_window=parse_float(env, 'BREAKER_WINDOW', 30.0, minimum=1.0),
+        breaker_min_requests=parse_int(env, 'BREAKER_MIN_REQUESTS', 10, minimum=1),
+        breaker_error_rate=parse_float(env, 'BREAKER_ERROR_RATE', 0.5, minimum=0.01),
+        breaker_slow_call=parse_float(env, 'BREAKER_SLOW_CALL', 5.0, minimum=0.001),
+        breaker_open_duration=parse_float(env, 'BREAKER_OPEN_DURATION', 30.0),
+        breaker_half_open_probes=parse_int(env, 'BREAKER_HALF_OPEN_PROBES', 1, minimum=1),
+        breaker_response=parse_breaker_response(env),
+        hedge_delay=parse_float(env, 'HEDGE_DELAY', 0.0),
+        hedge_budget=parse_float(env, 'HEDGE_BUDGET', 5.0),
+        metrics_enabled=parse_bool(env, 'METRICS_ENABLED', True),
+        metrics_namespace=env.get('METRICS_NAMESPACE', '') or 'MaintenanceHandler',
+        profile_every_n=parse_int(env, 'PROFILE_EVERY_N', 0),
+        profile_top_k=parse_int(env, 'PROFILE_TOP_K', 10, minimum=1),
+        profile_dir=env.get('PROFILE_DIR', PROFILE_DIR_DEFAULT),
+        s3_key_template=env.get('S3_KEY_TEMPLATE', '').strip(),
+        s3_key_template_hosts=tuple(
+            suffix.strip().lstrip('.').lower() for suffix in env.get('S3_KEY_TEMPLATE_HOSTS', '').split(',')
+            if suffix.strip().lstrip('.')
+        ),
+        s3_key_map=parse_key_map(env),
+        page_cache_max_bytes=parse_int(env, 'PAGE_CACHE_MAX_BYTES', 64 * 1024 * 1024, minimum=1024),
+        page_languages=tuple(
+            tag.strip() for tag in env.get('PAGE_LANGUAGES', '').split(',') if tag.strip()
+        ),
+        page_default_language=env.get('PAGE_DEFAULT_LANGUAGE', '').strip() or 'ja',
+    )
+    if not config.s3_bucket or not config.s3_key:
+        raise ConfigError('S3_BUCKET and S3_KEY must not be empty')
+    if config.s3_key_template and '{host}' not in config.s3_key_template:
+        raise ConfigError(f'S3_KEY_TEMPLATE must contain {{host}}, got {config.s3_key_template!r}')
+    for tag in config.page_languages + (config.page_default_language,):
+        if not LANGUAGE_TAG_PATTERN.fullmatch(tag):
+            raise ConfigError(f'Invalid language tag {tag!r} in PAGE_LANGUAGES/PAGE_DEFAULT_LANGUAGE')
+    s3_budget = (config.client_connect_timeout + config.s3_read_timeout) * config.client_max_attempts
+    if s3_budget >= config.function_timeout:
+        raise ConfigError(
+            f'(CLIENT_CONNECT_TIMEOUT + S3_READ_TIMEOUT) x CLIENT_MAX_ATTEMPTS ({s3_budget:g}s) '
+            f'must be below FUNCTION_TIMEOUT ({config.function_timeout:g}s)'
+        )
+    lambda_budget = config.client_connect_timeout + config.lambda_read_timeout
+    if lambda_budget >= config.function_timeout:
+        raise ConfigError(
+            f'CLIENT_CONNECT_TIMEOUT + LAMBDA_READ_TIMEOUT ({lambda_budget:g}s) '
+            f'must be below FUNCTION_TIMEOUT ({config.function_timeout:g}s)'
+        )
+    if config.hedge_budget > 100:
+        raise ConfigError(f'HEDGE_BUDGET must be <= 100, got {config.hedge_budget}')
+    if config.breaker_error_rate > 1:
+        raise ConfigError(f'BREAKER_ERROR_RATE must be <= 1, got {config.breaker_error_rate}')
+    if config.s3_endpoint_url and not re.match(r'https?://[^/]+/?$', config.s3_endpoint_url):
+        raise ConfigError(f'S3_ENDPOINT_URL must be http(s)://host[:port], got {config.s3_endpoint_url!r}')
+    return config
+
+
+# Configuration snapshot for this sandbox; None until first loaded
+config_snapshot: Optional[Config] = None
+
+
+def get_config() -> Config:
+    """Get the configuration snapshot, parsing the environment on first use."""
+    global config_snapshot
+    if config_snapshot is None:
+        config_snapshot = load_config()
+    return config_snapshot
+
+
+def reload_config(environ=None) -> Config:
+    """
+    Re-read the configuration snapshot (for tests and explicit reloads).
+    
+    Args:
+        environ: Mapping to read from (defaults to os.environ)
+    
+    Returns:
+        The new configuration
+    """
+    global config_snapshot
+    config_snapshot = load_config(environ)
+    return config_snapshot
+
+
+# Maintenance page cache (per sandbox, survives across warm invocations)
+class CachedPage:
+    """
+    A maintenance page fetched from S3 together with its validator.
+    
+    ``nbytes`` estimates the memory the page holds: the body plus its
+    compiled template and every compressed variant built from it so far
+    (before compilation the template is assumed to be the body's size).
+    Pages coming from S3, /tmp or the bundle are compiled on load, so a
+    template error surfaces before the page is cached.
+    """
+
+    __slots__ = ('body', 'etag', 'fetched_at', '_template')
+
+    def __init__(self, body: str, etag: Optional[str], fetched_at: float,
+                 template: Optional['CompiledTemplate'] = None):
+        self.body = body
+        self.etag = etag
+        self.fetched_at = fetched_at
+        self._template = template
+
+    @property
+    def nbytes(self) -> int:
+        template_bytes = self._template.nbytes if self._template is not None else sys.getsizeof(self.body)
+        return sys.getsizeof(self.body) + template_bytes
+
+    @property
+    def template(self) -> 'CompiledTemplate':
+        """Compiled form of the page, parsed once per page version."""
+        if self._template is None:
+            self._template = get_compiled_template(self.body, self.etag)
+        return self._template
+
+
+class PageLRU:
+    """
+    Least-recently-used page cache bounded by total bytes (CachedPage.nbytes).
+    
+    Pages vary from a few KB to MBs per tenant, so the bound is on their
+    estimated memory rather than their count. The most recent page is always
+    kept, even if it alone exceeds the bound. ``charged`` holds the size each
+    entry was stored with; a page that grew since (compressed variants are
+    built on first use) is charged again by putting it back.
+    """
+
+    def __init__(self):
+        self.entries: 'collections.OrderedDict[Tuple[str, str], CachedPage]' = collections.OrderedDict()
+        self.charged: Dict[Tuple[str, str], int] = {}
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: Tuple[str, str]) -> Optional[CachedPage]:
+        with self.lock:
+            page = self.entries.get(key)
+            if page is not None:
+                self.entries.move_to_end(key)
+            return page
+
+    def put(self, key: Tuple[str, str], page: CachedPage, max_bytes: int):
+        """Store a page, evicting the least recently used ones beyond ``max_bytes``."""
+        with self.lock:
+            if self.entries.pop(key, None) is not None:
+                self.total_bytes -= self.charged.pop(key)
+            self.entries[key] = page
+            self.charged[key] = page.nbytes
+            self.total_bytes += self.charged[key]
+            while self.total_bytes > max_bytes and len(self.entries) > 1:
+                evicted, _ = self.entries.popitem(last=False)
+                self.total_bytes -= self.charged.pop(evicted)
+                page_cache_stats['evictions'] += 1
+
+    def outgrown(self, key: Tuple[str, str], page: CachedPage) -> bool:
+        """Tell whether ``page`` grew since it was stored under ``key``."""
+        return self.charged.get(key, page.nbytes) != page.nbytes
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.charged.clear()
+            self.total_bytes = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+
+page_cache = PageLRU()
+page_cache_stats = {
+    'hits': 0, 'misses': 0, 'revalidations': 0, 'not_modified': 0,
+    'stale_hits': 0, 'background_refreshes': 0, 'refresh_errors': 0,
+    'tmp_hits': 0, 'bundled_hits': 0, 'evictions': 0, 'template_errors': 0
+}
+# Guards page_cache/page_cache_stats, template_cache and missing_pages against
+# the background refresh thread and concurrent handler calls (local_server.py)
+page_cache_lock = threading.Lock()
+# Cache keys with a background refresh in flight (at most one per key)
+refreshing_pages = set()
+
+
+def get_page_cache_stats() -> Dict[str, int]:
+    """Return a snapshot of the page cache counters."""
+    return dict(page_cache_stats)
+
+
+def count_page_stats(*names: str):
+    """Increment page cache counters under page_cache_lock, like the background refresh does."""
+    with page_cache_lock:
+        for name in names:
+            page_cache_stats[name] += 1
+
+
+def clear_page_cache():
+    """Drop all cached pages and reset the counters."""
+    with page_cache_lock:
+        page_cache.clear()
+        template_cache.clear()
+        missing_pages.clear()
+        refreshing_pages.clear()
+        bundled_pages.clear()
+        for name in page_cache_stats:
+            page_cache_stats[name] = 0
+
+
+def is_not_modified(error: Exception) -> bool:
+    """Check whether an S3 error is the 304 answer to a conditional GET."""
+    response = getattr(error, 'response', None) or {}
+    code = str(response.get('Error', {}).get('Code', ''))
+    status = response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+    return code in ('304', 'NotModified') or status == 304
+
+
+def download_maintenance_page(bucket: str, key: str, etag: Optional[str] = None) -> Optional[CachedPage]:
+    """
+    Download the maintenance page from S3.
+    
+    Args:
+        bucket: S3 bucket name
+        key: S3 object key
+        etag: ETag of the cached copy; when given, a conditional GET is sent
+    
+    Returns:
+        The freshly downloaded page, or None if S3 answered 304 Not Modified
+    
+    Raises:
+        TemplateError: If the downloaded page uses an unknown placeholder
+    """
+    params = {'Bucket': bucket, 'Key': key}
+    if etag:
+        params['IfNoneMatch'] = etag
+    try:
+        response = get_s3_client().get_object(**params)
+    except Exception as e:
+        if etag and is_not_modified(e):
+            return None
+        raise
+    body = response['Body'].read().decode('utf-8')
+    etag = response.get('ETag')
+    return CachedPage(body, etag, time.monotonic(), get_compiled_template(body, etag))
+
+
+# Page tiers, in lookup order
+TIER_MEMORY = 'memory'
+TIER_TMP = 'tmp'
+TIER_BUNDLED = 'bundled'
+TIER_S3 = 's3'
+
+
+def tmp_page_paths(tmp_dir: str, bucket: str, key: str) -> Tuple[str, str]:
+    """Return the (body, metadata) file paths of a page persisted under /tmp."""
+    name = hashlib.sha256(f'{bucket}/{key}'.encode('utf-8')).hexdigest()[:32]
+    return os.path.join(tmp_dir, name + '.html'), os.path.join(tmp_dir, name + '.json')
+
+
+def write_atomic(path: str, data: bytes):
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+def save_tmp_page(config: Config, bucket: str, key: str, page: CachedPage, body_changed: bool = True):
+    """
+    Persist a page (or just its metadata) under PAGE_TMP_DIR.
+    
+    /tmp outlives the Python process, so a sandbox whose runtime was restarted
+    (after a crash or timeout) can still serve and revalidate its last copy.
+    Write failures are logged and otherwise ignored.
+    """
+    if not config.page_tmp_dir:
+        return
+    body_path, meta_path = tmp_page_paths(config.page_tmp_dir, bucket, key)
+    meta = {
+        'bucket': bucket,
+        'key': key,
+        'etag': page.etag,
+        'fetched_at': time.time() - (time.monotonic() - page.fetched_at)
+    }
+    try:
+        os.makedirs(config.page_tmp_dir, exist_ok=True)
+        if body_changed:
+            write_atomic(body_path, page.body.encode('utf-8'))
+        write_atomic(meta_path, json.dumps(meta).encode('utf-8'))
+    except OSError as e:
+        logger.warning('Could not persist maintenance page to %s: %s', config.page_tmp_dir, e)
+
+
+def load_tmp_page(config: Config, bucket: str, key: str) -> Optional[CachedPage]:
+    """Load a page persisted under PAGE_TMP_DIR, or None if there is none."""
+    if not config.page_tmp_dir:
+        return None
+    body_path, meta_path = tmp_page_paths(config.page_tmp_dir, bucket, key)
+    try:
+        with open(meta_path, 'rb') as f:
+            meta = json.loads(f.read())
+        if meta.get('bucket') != bucket or meta.get('key') != key:
+            return None
+        etag = meta.get('etag')
+        if etag is not None and not isinstance(etag, str):
+            return None
+        # Translate the wall-clock fetch time into this process's monotonic clock
+        fetched_at = time.monotonic() - (time.time() - float(meta.get('fetched_at', 0)))
+        with open(body_path, 'rb') as f:
+            body = f.read().decode('utf-8')
+        template = get_compiled_template(body, etag)
+    except (OSError, ValueError, TypeError, AttributeError, TemplateError):
+        # Missing, truncated or foreign files are treated as no copy at all
+        return None
+    return CachedPage(body, etag, fetched_at, template)
+
+
+# Pages bundled in the deployment package, loaded once per path
+bundled_pages: Dict[str, Optional[CachedPage]] = {}
+
+
+def load_bundled_page(config: Config) -> Optional[CachedPage]:
+    """Load the page bundled in the deployment package (PAGE_BUNDLED_PATH), if any."""
+    path = config.page_bundled_path
+    if not path:
+        return None
+    if path not in bundled_pages:
+        full_path = path if os.path.isabs(path) else os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+        try:
+            with open(full_path, 'rb') as f:
+                body = f.read().decode('utf-8')
+            # Never fresh: it only stands in until S3 has been reached
+            bundled_pages[path] = CachedPage(body, None, float('-inf'), compile_template(body))
+        except (OSError, ValueError) as e:
+            logger.warning('Could not load bundled maintenance page %s: %s', full_path, e)
+            bundled_pages[path] = None
+    return bundled_pages[path]
+
+
+def revalidate_page(config: Config, bucket: str, key: str, entry: Optional[CachedPage]) -> CachedPage:
+    """
+    Fetch the page from S3, as a conditional GET when a copy is already cached.
+    
+    Args:
+        config: Configuration
+        bucket: S3 bucket name
+        key: S3 object key
+        entry: Expired cache entry (optional)
+    
+    A new version that does not compile never replaces the cached copy: the
+    error is logged and the entry is kept with its TTL restarted, so the
+    broken version is not fetched again before the TTL expires.
+    
+    Returns:
+        The entry itself with its TTL restarted on 304, otherwise the new page
+    
+    Raises:
+        TemplateError: If the new version does not compile and nothing is cached
+    """
+    try:
+        fresh = download_maintenance_page(bucket, key, entry.etag if entry is not None else None)
+    except TemplateError as e:
+        with page_cache_lock:
+            page_cache_stats['template_errors'] += 1
+        if entry is None:
+            raise
+        logger.warning('Keeping the cached maintenance page for s3://%s/%s: %s', bucket, key, e)
+        entry.fetched_at = time.monotonic()
+        with page_cache_lock:
+            page_cache.put((bucket, key), entry, config.page_cache_max_bytes)
+        return entry
+    with page_cache_lock:
+        if entry is not None:
+            page_cache_stats['revalidations'] += 1
+        if fresh is None:
+            page_cache_stats['not_modified'] += 1
+            entry.fetched_at = time.monotonic()
+        page_cache.put((bucket, key), fresh or entry, config.page_cache_max_bytes)
+    save_tmp_page(config, bucket, key, fresh or entry, body_changed=fresh is not None)
+    return fresh or entry
+
+
+def refresh_page_in_background(config: Config, bucket: str, key: str, entry: Optional[CachedPage]):
+    """
+    Start a single background fetch for a stale (or missing) cache entry.
+    
+    Lambda freezes the sandbox between invocations, so a refresh that does not
+    finish before the response is returned simply resumes on the next one.
+    
+    Args:
+        config: Configuration
+        bucket: S3 bucket name
+        key: S3 object key
+        entry: Stale cache entry (optional)
+    """
+    cache_key = (bucket, key)
+    with page_cache_lock:
+        if cache_key in refreshing_pages:
+            return
+        refreshing_pages.add(cache_key)
+        page_cache_stats['background_refreshes'] += 1
+    
+    def refresh():
+        try:
+            revalidate_page(config, bucket, key, entry)
+        except Exception:
+            with page_cache_lock:
+                page_cache_stats['refresh_errors'] += 1
+        finally:
+            with page_cache_lock:
+                refreshing_pages.discard(cache_key)
+    
+    threading.Thread(target=refresh, name='page-refresh', daemon=True).start()
+
+
+def fetch_maintenance_page(config: Config) -> CachedPage:
+    """
+    Return the maintenance page, served from the page cache when fresh.
+    
+    See lookup_maintenance_page for the lookup order.
+    
+    Args:
+        config: Configuration
+    
+    Returns:
+        Maintenance page
+    """
+    return lookup_maintenance_page(config)[0]
+
+
+def lookup_maintenance_page(config: Config, key: Optional[str] = None) -> Tuple[CachedPage, str]:
+    """
+    Find the maintenance page in the cache tiers: memory, /tmp, bundled, S3.
+    
+    A fresh copy in memory is served directly. Without one, a copy persisted
+    under PAGE_TMP_DIR is promoted into memory. Expired copies are
+    revalidated against S3 with a conditional GET on the stored ETag (on 304
+    the cached body is kept and its TTL restarted), and downloads are written
+    back to memory and /tmp. The bundled copy (PAGE_BUNDLED_PATH) is never
+    considered fresh; it stands in when S3 cannot be reached and nothing else
+    was ever loaded.
+    
+    With PAGE_CACHE_SWR enabled, an expired copy younger than TTL plus
+    PAGE_CACHE_MAX_STALE (or the bundled copy, when nothing was loaded yet) is
+    served immediately while one background thread fetches from S3. In every
+    mode, an S3 failure serves the best stale copy rather than raising.
+    The bundled copy only stands in for the default S3_KEY, not tenant keys.
+    
+    Args:
+        config: Configuration
+        key: S3 key of the page (optional, defaults to S3_KEY)
+    
+    Returns:
+        Tuple of the page and the tier that served it
+    """
+    bucket, key = config.s3_bucket, key or config.s3_key
+    default_key = key == config.s3_key
+    if not config.page_cache_enabled:
+        return download_maintenance_page(bucket, key), TIER_S3
+    
+    cache_key = (bucket, key)
+    entry = page_cache.get(cache_key)
+    tier = TIER_MEMORY
+    if entry is not None and page_cache.outgrown(cache_key, entry):
+        # Charge the compressed variants built since the page was stored
+        with page_cache_lock:
+            page_cache.put(cache_key, entry, config.page_cache_max_bytes)
+    if entry is None:
+        entry = load_tmp_page(config, bucket, key)
+        if entry is not None:
+            tier = TIER_TMP
+            with page_cache_lock:
+                page_cache_stats['tmp_hits'] += 1
+                page_cache.put(cache_key, entry, config.page_cache_max_bytes)
+    
+    if entry is not None:
+        age = time.monotonic() - entry.fetched_at
+        if age < config.page_cache_ttl:
+            count_page_stats('hits')
+            return entry, tier
+        if config.page_cache_swr and age < config.page_cache_ttl + config.page_cache_max_stale:
+            count_page_stats('stale_hits')
+            refresh_page_in_background(config, bucket, key, entry)
+            return entry, tier
+    else:
+        count_page_stats('misses')
+        bundled = load_bundled_page(config) if default_key else None
+        if bundled is not None and config.page_cache_swr:
+            count_page_stats('bundled_hits')
+            refresh_page_in_background(config, bucket, key, None)
+            return bundled, TIER_BUNDLED
+    
+    try:
+        return revalidate_page(config, bucket, key, entry), TIER_S3
+    except Exception:
+        stale, stale_tier = entry, tier
+        if stale is None and default_key:
+            stale, stale_tier = load_bundled_page(config), TIER_BUNDLED
+        if stale is None:
+            raise
+        count_page_stats('refresh_errors', 'bundled_hits' if stale_tier == TIER_BUNDLED else 'stale_hits')
+        return stale, stale_tier
+
+
+# Multi-tenant page selection by Host header
+HOST_PATTERN = re.compile(r'[a-z0-9](?:[a-z0-9.-]{0,251}[a-z0-9])?')
+MISSING_PAGES_MAX = 1024
+# Tenant keys whose page could not be loaded -> monotonic time of the failure,
+# least recently used first
+missing_pages: 'collections.OrderedDict[str, float]' = collections.OrderedDict()
+
+
+def resolve_s3_key(event: Dict[str, Any], config: Config) -> str:
+    """
+    Choose the maintenance page's S3 key from the request's Host header.
+    
+    The host (lower-cased, without port) is looked up in S3_KEY_MAP first,
+    then substituted into S3_KEY_TEMPLATE if it is a valid host name (and,
+    when S3_KEY_TEMPLATE_HOSTS is set, equal to or under one of its domains).
+    Requests matching neither get the default S3_KEY.
+    
+    Args:
+        event: ALB event
+        config: Configuration
+    
+    Returns:
+        S3 key of the page to serve
+    """
+    if not config.s3_key_map and not config.s3_key_template:
+        return config.s3_key
+    host = ((event.get('headers') or {}).get('host') or '').split(':', 1)[0].strip().lower()
+    key = config.s3_key_map.get(host)
+    if key is not None:
+        return key
+    if (config.s3_key_template and HOST_PATTERN.fullmatch(host)
+            and host_allowed(host, config.s3_key_template_hosts)):
+        return config.s3_key_template.replace('{host}', host)
+    return config.s3_key
+
+
+def host_allowed(host: str, domains: Tuple[str, ...]) -> bool:
+    """Check whether ``host`` is one of ``domains`` or a subdomain of one (any host if empty)."""
+    return not domains or any(host == domain or host.endswith('.' + domain) for domain in domains)
+
+
+def language_key(key: str, language: str) -> str:
+    """Return the S3 key of a page's language variant (maintenance.html -> maintenance.en.html)."""
+    base, dot, extension = key.rpartition('.')
+    if not dot or '/' in extension:
+        return f'{key}.{language}'
+    return f'{base}.{language}.{extension}'
+
+
+@functools.lru_cache(maxsize=256)
+def negotiate_language(accept_language: Optional[str], languages: Tuple[str, ...], default: str) -> str:
+    """
+    Pick the page language for an Accept-Language header.
+    
+    Language ranges are tried in order of q-value (ties keep header order),
+    each truncated one subtag at a time (``en-US`` then ``en``) as in RFC 4647
+    lookup; ``*`` and no match select the default. Results are memoized per
+    header string, as real traffic has few distinct values.
+    
+    Args:
+        accept_language: Raw Accept-Language header value
+        languages: Languages with a page variant (PAGE_LANGUAGES)
+        default: Language of the page at the base key (PAGE_DEFAULT_LANGUAGE)
+    
+    Returns:
+        One of ``languages`` or ``default``
+    """
+    if not accept_language or not languages:
+        return default
+    ranges = []
+    for index, item in enumerate(accept_language.split(',')):
+        tag, _, params = item.partition(';')
+        tag = tag.strip().lower()
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if tag and q > 0:
+            ranges.append((-q, index, tag))
+    ranges.sort()
+    
+    available = {language.lower(): language for language in languages}
+    available[default.lower()] = default
+    for _, _, tag in ranges:
+        if tag == '*':
+            return default
+        while tag:
+            if tag in available:
+                return available[tag]
+            tag = tag.rpartition('-')[0]
+    return default
+
+
+def page_candidates(event: Dict[str, Any], config: Config) -> List[Tuple[str, str]]:
+    """
+    List the pages to try for a request, most specific first.
+    
+    Args:
+        event: ALB event
+        config: Configuration
+    
+    Returns:
+        (S3 key, language) pairs, ending with S3_KEY in the default language
+    """
+    key = resolve_s3_key(event, config)
+    default = config.page_default_language
+    language = default
+    if config.page_languages:
+        headers = event.get('headers') or {}
+        language = negotiate_language(headers.get('accept-language'), config.page_languages, default)
+    candidates = []
+    for base in dict.fromkeys((key, config.s3_key)):
+        if language != default:
+            candidates.append((language_key(base, language), language))
+        candidates.append((base, default))
+    return candidates
+
+
+def lookup_tenant_page(event: Dict[str, Any], config: Config) -> Tuple[CachedPage, str, str]:
+    """
+    Find the maintenance page for the request's host and language.
+    
+    Candidates are tried in order: the tenant's page in the negotiated
+    language, the tenant's page, then the same for the default S3_KEY. A
+    candidate that cannot be loaded (an unknown host under S3_KEY_TEMPLATE, a
+    missing translation) is not retried for PAGE_CACHE_TTL seconds. Up to
+    MISSING_PAGES_MAX such keys are remembered, least recently seen evicted
+    first; each new unknown host still costs one S3 request, which
+    S3_KEY_TEMPLATE_HOSTS bounds to the configured domains.
+    
+    Args:
+        event: ALB event
+        config: Configuration
+    
+    Returns:
+        Tuple of the page, the tier that served it and its language
+    """
+    candidates = page_candidates(event, config)
+    for key, language in candidates[:-1]:
+        with page_cache_lock:
+            failed_at = missing_pages.get(key)
+            recently_missing = failed_at is not None and time.monotonic() - failed_at < config.page_cache_ttl
+            if recently_missing:
+                missing_pages.move_to_end(key)
+        if recently_missing:
+            continue
+        try:
+            page, tier = lookup_maintenance_page(config, key)
+        except Exception as e:
+            with page_cache_lock:
+                missing_pages[key] = time.monotonic()
+                missing_pages.move_to_end(key)
+                while len(missing_pages) > MISSING_PAGES_MAX:
+                    missing_pages.popitem(last=False)
+            logger.warning('No maintenance page at %s, trying the next candidate: %s', key, e)
+            continue
+        with page_cache_lock:
+            missing_pages.pop(key, None)
+        return page, tier, language
+    page, tier = lookup_maintenance_page(config)
+    return page, tier, config.page_default_language
+
+
+# Template compilation
+PLACEHOLDER_PATTERN = re.compile(r'\{\{([A-Za-z0-9_]+)\}\}')
+
+# Placeholder name -> resolver(event, context); resolvers only run for slots
+# that actually appear in the compiled template.
+PLACEHOLDER_RESOLVERS: Dict[str, Callable[[Dict[str, Any], Any], Any]] = {}
+
+
+class TemplateError(ValueError):
+    """Raised when a template references placeholders with no resolver."""
+
+
+def placeholder(name: str):
+    """Register the decorated function as the resolver for ``{{name}}``."""
+    def register(resolver):
+        PLACEHOLDER_RESOLVERS[name] = resolver
+        return resolver
+    return register
+
+
+@placeholder('REQUEST_ID')
+def resolve_request_id(event: Dict[str, Any], context: Any) -> str:
+    return context.request_id
+
+
+@placeholder('TIMESTAMP')
+def resolve_timestamp(event: Dict[str, Any], context: Any) -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+@placeholder('PATH')
+def resolve_path(event: Dict[str, Any], context: Any) -> str:
+    return event.get('path', '/')
+
+
+@placeholder('METHOD')
+def resolve_method(event: Dict[str, Any], context: Any) -> str:
+    return event.get('httpMethod', 'GET')
+
+
+@placeholder('SOURCE_IP')
+def resolve_source_ip(event: Dict[str, Any], context: Any) -> str:
+    return (event.get('requestContext') or {}).get('identity', {}).get('sourceIp', 'unknown')
+
+
+@placeholder('USER_AGENT')
+def resolve_user_agent(event: Dict[str, Any], context: Any) -> str:
+    return (event.get('headers') or {}).get('user-agent', 'unknown')
+
+
+@placeholder('HOST')
+def resolve_host(event: Dict[str, Any], context: Any) -> str:
+    return (event.get('headers') or {}).get('host', 'unknown')
+
+
+@placeholder('FUNCTION_NAME')
+def resolve_function_name(event: Dict[str, Any], context: Any) -> str:
+    return context.function_name
+
+
+class CompiledTemplate:
+    """
+    A template parsed into alternating literal segments and placeholder slots.
+    
+    ``parts`` always has an odd length: even indices hold literal text and odd
+    indices hold placeholder names, so rendering is a single join. The
+    resolvers for the distinct slots are bound at compile time. ``nbytes``
+    estimates the memory of the parts plus the compressed variants built.
+    """
+
+    __slots__ = ('parts', 'resolvers', 'variants', 'nbytes', '__weakref__')
+
+    def __init__(self, parts: List[str]):
+        self.parts = parts
+        self.resolvers = tuple((name, PLACEHOLDER_RESOLVERS[name]) for name in dict.fromkeys(parts[1::2]))
+        self.variants = {}
+        self.nbytes = sys.getsizeof(parts) + sum(map(sys.getsizeof, parts))
+
+    @property
+    def slots(self) -> frozenset:
+        """Names of the placeholders used by this template."""
+        return frozenset(name for name, _ in self.resolvers)
+
+    def render_parts(self, event: Dict[str, Any], context: Any) -> List[str]:
+        """Return ``parts`` with every slot replaced by its resolved value."""
+        if not self.resolvers:
+            return self.parts
+        values = {name: str(resolver(event, context)) for name, resolver in self.resolvers}
+        parts = self.parts[:]
+        for i in range(1, len(parts), 2):
+            parts[i] = values[parts[i]]
+        return parts
+
+    def render(self, event: Dict[str, Any], context: Any) -> str:
+        """Resolve each slot once from the event/context and join the result."""
+        return ''.join(self.render_parts(event, context))
+
+    def variant(self, encoding: str) -> 'EncodedTemplate':
+        """Return the compressed variant for ``encoding``, built once per template."""
+        encoded = self.variants.get(encoding)
+        if encoded is None:
+            built = ENCODED_TEMPLATE_TYPES[encoding](self)
+            encoded = self.variants.setdefault(encoding, built)
+            if encoded is built:
+                self.nbytes += built.nbytes
+        return encoded
+
+
+def compile_template(html: str) -> CompiledTemplate:
+    """
+    Parse an HTML template into a CompiledTemplate.
+    
+    Args:
+        html: HTML template with {{PARAMETER}} placeholders
+    
+    Returns:
+        Compiled template
+    
+    Raises:
+        TemplateError: If the template uses a placeholder with no registered resolver
+    """
+    parts = PLACEHOLDER_PATTERN.split(html)
+    unknown = sorted(set(parts[1::2]) - PLACEHOLDER_RESOLVERS.keys())
+    if unknown:
+        raise TemplateError('Unknown template placeholders: ' + ', '.join(unknown))
+    return CompiledTemplate(parts)
+
+
+# Compiled templates keyed by S3 ETag (one entry per page version). Values are
+# weak: a template lives only as long as a cached page holds it, so pages
+# evicted from page_cache do not keep their templates (and variants) alive.
+template_cache: 'weakref.WeakValueDictionary[str, CompiledTemplate]' = weakref.WeakValueDictionary()
+
+
+def get_compiled_template(html: str, etag: Optional[str] = None) -> CompiledTemplate:
+    """
+    Compile a template, reusing an earlier compilation of the same page version.
+    
+    Args:
+        html: HTML template
+        etag: ETag of the S3 object the template came from, if known
+    
+    Returns:
+        Compiled template
+    """
+    if etag is None:
+        return compile_template(html)
+    with page_cache_lock:
+        template = template_cache.get(etag)
+    if template is None:
+        template = compile_template(html)
+        with page_cache_lock:
+            template = template_cache.setdefault(etag, template)
+    return template
+
+
+# Response compression
+#
+# gzip and deflate variants are assembled from raw deflate pieces: each static
+# literal of the template is compressed once (ending in a sync flush so it is
+# byte aligned and self-contained), and the per-request slot values are
+# appended as stored blocks. Every piece is padded with empty stored blocks to
+# a multiple of 3 bytes so that its base64 text can be cached and concatenated.
+DEFLATE_EMPTY_STORED_BLOCK = b'\x00\x00\x00\xff\xff'
+DEFLATE_FINAL_BLOCK = b'\x03\x00'
+DEFLATE_MAX_STORED = 0xFFFF
+GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+ZLIB_HEADER = b'\x78\x01'
+BROTLI_QUALITY = 5
+
+
+def pad_deflate(data: bytes) -> bytes:
+    """Pad byte-aligned deflate data with empty stored blocks to a multiple of 3 bytes."""
+    remainder = len(data) % 3
+    if remainder == 1:
+        return data + DEFLATE_EMPTY_STORED_BLOCK
+    if remainder == 2:
+        return data + DEFLATE_EMPTY_STORED_BLOCK * 2
+    return data
+
+
+def deflate_segment(data: bytes) -> bytes:
+    """Compress one segment into non-final, byte-aligned raw deflate blocks."""
+    if not data:
+        return b''
+    compressor = zlib.compressobj(zlib.Z_BEST_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+def deflate_stored(data: bytes) -> bytes:
+    """Wrap data in non-final stored (uncompressed) deflate blocks."""
+    blocks = []
+    for start in range(0, len(data), DEFLATE_MAX_STORED):
+        chunk = data[start:start + DEFLATE_MAX_STORED]
+        blocks.append(b'\x00' + struct.pack('<HH', len(chunk), len(chunk) ^ 0xFFFF) + chunk)
+    return b''.join(blocks)
+
+
+def b64(data: bytes) -> str:
+    """Base64-encode bytes into an ALB body string."""
+    return base64.b64encode(data).decode('ascii')
+
+
+class EncodedTemplate(abc.ABC):
+    """
+    Base class for a compressed variant of a CompiledTemplate.
+    
+    ``render`` returns the base64 text of the compressed page, ready to be used
+    as an ALB body with ``isBase64Encoded``. ``nbytes`` estimates the memory
+    of the precompressed data, charged to the template when built.
+    """
+
+    encoding = ''
+
+    def __init__(self, template: CompiledTemplate):
+        self.template = template
+        self.nbytes = 0
+
+    @abc.abstractmethod
+    def render(self, event: Dict[str, Any], context: Any) -> str:
+        """Render the compressed page for one request as base64 text."""
+
+
+class DeflateStreamTemplate(EncodedTemplate):
+    """Shared segment assembly for the gzip and deflate (zlib) containers."""
+
+    header = b''
+
+    def __init__(self, template: CompiledTemplate):
+        super().__init__(template)
+        self.literals = [literal.encode('utf-8') for literal in template.parts[0::2]]
+        self.static_b64 = [
+            b64(pad_deflate((self.header if i == 0 else b'') + deflate_segment(literal)))
+            for i, literal in enumerate(self.literals)
+        ]
+        self.static_size = sum(len(literal) for literal in self.literals)
+        self.static_checksum = self.checksum(b''.join(self.literals)) if not template.resolvers else None
+        self.nbytes = sum(map(sys.getsizeof, self.literals)) + sum(map(sys.getsizeof, self.static_b64))
+
+    @abc.abstractmethod
+    def checksum(self, data: bytes, value: Optional[int] = None) -> int:
+        """Update the container's running checksum (``value``) with ``data``."""
+
+    @abc.abstractmethod
+    def trailer(self, checksum: int, size: int) -> bytes:
+        """Return the container trailer for the final checksum and uncompressed size."""
+
+    def render(self, event: Dict[str, Any], context: Any) -> str:
+        if self.static_checksum is not None:
+            return self.static_b64[0] + b64(DEFLATE_FINAL_BLOCK + self.trailer(self.static_checksum, self.static_size))
+        
+        parts = self.template.render_parts(event, context)
+        literals = self.literals
+        checksum = self.checksum(literals[0])
+        size = self.static_size
+        body = [self.static_b64[0]]
+        for i in range(1, len(parts), 2):
+            value = parts[i].encode('utf-8')
+            literal = literals[(i + 1) // 2]
+            checksum = self.checksum(literal, self.checksum(value, checksum))
+            size += len(value)
+            if value:
+                body.append(b64(pad_deflate(deflate_stored(value))))
+            body.append(self.static_b64[(i + 1) // 2])
+        body.append(b64(DEFLATE_FINAL_BLOCK + self.trailer(checksum, size)))
+        return ''.join(body)
+
+
+class GzipTemplate(DeflateStreamTemplate):
+    encoding = 'gzip'
+    header = GZIP_HEADER
+
+    def checksum(self, data: bytes, value: Optional[int] = None) -> int:
+        return zlib.crc32(data) if value is None else zlib.crc32(data, value)
+
+    def trailer(self, checksum: int, size: int) -> bytes:
+        return struct.pack('<II', checksum, size & 0xFFFFFFFF)
+
+
+class ZlibTemplate(DeflateStreamTemplate):
+    encoding = 'deflate'
+    header = ZLIB_HEADER
+
+    def checksum(self, data: bytes, value: Optional[int] = None) -> int:
+        return zlib.adler32(data) if value is None else zlib.adler32(data, value)
+
+    def trailer(self, checksum: int, size: int) -> bytes:
+        return struct.pack('>I', checksum)
+
+
+class BrotliTemplate(EncodedTemplate):
+    """
+    Brotli variant. Brotli streams cannot be spliced like deflate, so pages with
+    slots are compressed per request; slot-free pages are compressed once.
+    negotiate_encoding only picks br for slot-free pages.
+    """
+
+    encoding = 'br'
+
+    def __init__(self, template: CompiledTemplate):
+        super().__init__(template)
+        self.static_body = None
+        if not template.resolvers:
+            self.static_body = b64(brotli.compress(template.parts[0].encode('utf-8'), quality=BROTLI_QUALITY))
+            self.nbytes = sys.getsizeof(self.static_body)
+
+    def render(self, event: Dict[str, Any], context: Any) -> str:
+        if self.static_body is not None:
+            return self.static_body
+        html = self.template.render(event, context)
+        return b64(brotli.compress(html.encode('utf-8'), quality=BROTLI_QUALITY))
+
+
+ENCODED_TEMPLATE_TYPES = {
+    'gzip': GzipTemplate,
+    'deflate': ZlibTemplate,
+}
+if brotli is not None:
+    ENCODED_TEMPLATE_TYPES['br'] = BrotliTemplate
+
+# Server preference when the client weighs several encodings equally. br is
+# only offered for slot-free pages: pages with slots would be recompressed on
+# every request, while gzip/deflate splice precompressed segments.
+ENCODING_PREFERENCE = tuple(name for name in ('gzip', 'deflate') if name in ENCODED_TEMPLATE_TYPES)
+STATIC_ENCODING_PREFERENCE = tuple(name for name in ('br', 'gzip', 'deflate') if name in ENCODED_TEMPLATE_TYPES)
+
+
+@functools.lru_cache(maxsize=256)
+def negotiate_encoding(accept_encoding: Optional[str], static: bool = False) -> Optional[str]:
+    """
+    Pick a content coding from an Accept-Encoding header.
+    
+    Args:
+        accept_encoding: Raw Accept-Encoding header value
+        static: Whether the page has no slots (its br variant is compressed once)
+    
+    Returns:
+        'br', 'gzip' or 'deflate', or None to send the page uncompressed
+    """
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.partition(';')
+        name = name.strip().lower()
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name == 'x-gzip':
+            name = 'gzip'
+        weights[name] = q
+    
+    best, best_q = None, 0.0
+    for name in STATIC_ENCODING_PREFERENCE if static else ENCODING_PREFERENCE:
+        q = weights.get(name, weights.get('*', 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+# Circuit breakers for special Lambda invocations (one per function ARN)
+class CircuitBreaker:
+    """
+    Closed/open/half-open circuit breaker driven by error rate and latency.
+    
+    Outcomes within the last ``window`` seconds are tracked; a call counts as
+    failed when it errors or takes at least ``slow_call`` seconds. Once at
+    least ``min_requests`` outcomes are recorded and the failure ratio reaches
+    ``error_rate``, the breaker opens and rejects calls for ``open_duration``
+    seconds. It then lets ``half_open_probes`` trial calls through: if all
+    succeed it closes, and any failure opens it again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    # Numeric state reported as the BreakerState metric
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name: str, window: float, min_requests: int, error_rate: float,
+                 slow_call: float, open_duration: float, half_open_probes: int):
+        self.name = name
+        self.window = window
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.slow_call = slow_call
+        self.open_duration = open_duration
+        self.half_open_probes = half_open_probes
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.outcomes = collections.deque()
+        self.failures = 0
+        self.probes_in_flight = 0
+        self.probe_successes = 0
+        self.trips = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        """Return True if a call may proceed, counting it as a probe when half-open."""
+        with self.lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.open_duration:
+                    self.rejected += 1
+                    return False
+                self.transition(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN:
+                if self.probes_in_flight >= self.half_open_probes:
+                    self.rejected += 1
+                    return False
+                self.probes_in_flight += 1
+            return True
+
+    def record(self, success: bool, elapsed: float):
+        """Record the outcome of an allowed call."""
+        failed = not success or elapsed >= self.slow_call
+        now = time.monotonic()
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                self.probes_in_flight = max(0, self.probes_in_flight - 1)
+                if failed:
+                    self.trip(now)
+                else:
+                    self.probe_successes += 1
+                    if self.probe_successes >= self.half_open_probes:
+                        self.transition(self.CLOSED)
+                return
+            if self.state == self.OPEN:
+                return
+            
+            self.outcomes.append((now, failed))
+            self.failures += failed
+            while self.outcomes and now - self.outcomes[0][0] > self.window:
+                self.failures -= self.outcomes.popleft()[1]
+            total = len(self.outcomes)
+            if total >= self.min_requests and self.failures >= self.error_rate * total:
+                self.trip(now)
+
+    def trip(self, now: float):
+        self.trips += 1
+        self.opened_at = now
+        self.transition(self.OPEN)
+
+    def transition(self, state: str):
+        logger.warning('Circuit breaker %s: %s -> %s (trips=%d, rejected=%d)',
+                       self.name, self.state, state, self.trips, self.rejected)
+        self.state = state
+        self.outcomes.clear()
+        self.failures = 0
+        self.probes_in_flight = 0
+        self.probe_successes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the breaker's state and counters."""
+        with self.lock:
+            return {'state': self.state, 'trips': self.trips, 'rejected': self.rejected}
+
+
+circuit_breakers: Dict[str, CircuitBreaker] = {}
+circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(arn: str, config: Config) -> Optional[CircuitBreaker]:
+    """
+    Get or create the circuit breaker for a function ARN.
+    
+    Args:
+        arn: Special Lambda function ARN
+        config: Configuration
+    
+    Returns:
+        The breaker, or None if BREAKER_ENABLED is off
+    """
+    if not config.breaker_enabled:
+        return None
+    breaker = circuit_breakers.get(arn)
+    if breaker is None:
+        with circuit_breakers_lock:
+            breaker = circuit_breakers.get(arn)
+            if breaker is None:
+                breaker = circuit_breakers[arn] = CircuitBreaker(
+                    arn,
+                    window=config.breaker_window,
+                    min_requests=config.breaker_min_requests,
+                    error_rate=config.breaker_error_rate,
+                    slow_call=config.breaker_slow_call,
+                    open_duration=config.breaker_open_duration,
+                    half_open_probes=config.breaker_half_open_probes
+                )
+    return breaker
+
+
+def get_circuit_breaker_stats() -> Dict[str, Dict[str, Any]]:
+    """Return the state and counters of every circuit breaker, keyed by ARN."""
+    return {arn: breaker.stats() for arn, breaker in list(circuit_breakers.items())}
+
+
+def clear_circuit_breakers():
+    """Drop every circuit breaker (they are recreated closed on next use)."""
+    with circuit_breakers_lock:
+        circuit_breakers.clear()
 
-def get_s3_client():
-    """Get or create S3 client."""
-    global s3_client
-    if s3_client is None:
-        s3_client = boto3.client('s3')
-    return s3_client
 
-def get_lambda_client():
-    """Get or create Lambda client."""
-    global lambda_client
-    if lambda_client is None:
-        lambda_client = boto3.client('lambda')
-    return lambda_client
+def get_breaker_open_response(config: Config) -> Dict[str, Any]:
+    """
+    Return the fail-fast response used while a circuit breaker is open.
+    
+    Args:
+        config: Configuration
+    
+    Returns:
+        Copy of the configured (precomputed) response
+    """
+    response = dict(config.breaker_response)
+    response['headers'] = dict(response.get('headers') or {})
+    return response
+
+
+# Per-phase timings, emitted as CloudWatch Embedded Metric Format log lines
+PHASE_METRICS = {
+    'config': 'ConfigMs',
+    'routing': 'RoutingMs',
+    'fetch': 'PageFetchMs',
+    'render': 'RenderMs',
+    'invoke': 'InvokeMs',
+    'response': 'ResponseMs',
+}
+
+
+class PhaseTimer:
+    """
+    Records how long each phase of one invocation takes.
+    
+    ``mark(phase)`` charges the time since the previous mark to ``phase``, so
+    timing a phase costs one perf_counter call. ``branch`` and ``tier`` become
+    the metric dimensions. A circuit breaker passed to ``watch_breaker`` is
+    reported with its function ARN as the dimension.
+    """
+
+    __slots__ = ('started', 'last', 'phases', 'branch', 'tier', 'breaker', 'breaker_counts')
+
+    def __init__(self):
+        self.started = self.last = time.perf_counter()
+        self.phases = {}
+        self.branch = 'error'
+        self.tier = 'none'
+        self.breaker = None
+        self.breaker_counts = (0, 0)
+
+    def mark(self, phase: str):
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + (now - self.last)
+        self.last = now
+
+    def watch_breaker(self, breaker: CircuitBreaker):
+        """Report ``breaker`` with this invocation, counting trips and rejections from now on."""
+        self.breaker = breaker
+        stats = breaker.stats()
+        self.breaker_counts = (stats['trips'], stats['rejected'])
+
+    def to_emf(self, namespace: str) -> Dict[str, Any]:
+        """Return the timings as an Embedded Metric Format document."""
+        document = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': namespace,
+                    'Dimensions': [['Branch', 'CacheTier']],
+                    'Metrics': [{'Name': PHASE_METRICS[phase], 'Unit': 'Milliseconds'} for phase in self.phases]
+                    + [{'Name': 'TotalMs', 'Unit': 'Milliseconds'}]
+                }]
+            },
+            'Branch': self.branch,
+            'CacheTier': self.tier
+        }
+        for phase, elapsed in self.phases.items():
+            document[PHASE_METRICS[phase]] = round(elapsed * 1000, 3)
+        document['TotalMs'] = round((self.last - self.started) * 1000, 3)
+        
+        if self.breaker is not None:
+            # Trips and rejections are this invocation's share, so they sum across sandboxes
+            stats = self.breaker.stats()
+            document['_aws']['CloudWatchMetrics'].append({
+                'Namespace': namespace,
+                'Dimensions': [['FunctionArn']],
+                'Metrics': [
+                    {'Name': 'BreakerState', 'Unit': 'None'},
+                    {'Name': 'BreakerTrips', 'Unit': 'Count'},
+                    {'Name': 'BreakerRejected', 'Unit': 'Count'}
+                ]
+            })
+            document['FunctionArn'] = self.breaker.name
+            document['BreakerState'] = CircuitBreaker.STATE_VALUES[stats['state']]
+            document['BreakerTrips'] = stats['trips'] - self.breaker_counts[0]
+            document['BreakerRejected'] = stats['rejected'] - self.breaker_counts[1]
+            document['Breaker'] = stats
+        return document
+
 
-def get_config():
-    """Get configuration from environment variables (runtime)."""
-    return {
-        'MAINTENANCE_MODE': os.environ.get('MAINTENANCE_MODE', 'true').lower() == 'true',
-        'S3_BUCKET': os.environ.get('S3_BUCKET', 'maintenance-pages'),
-        'S3_KEY': os.environ.get('S3_KEY', 'maintenance.html'),
-        'SPECIAL_URL_PATH': os.environ.get('SPECIAL_URL_PATH', '/special'),
-        'SPECIAL_LAMBDA_ARN': os.environ.get('SPECIAL_LAMBDA_ARN', '')
+def emit_metrics(timer: PhaseTimer, config: Config):
+    """Write the invocation's timings to stdout as one EMF JSON line."""
+    sys.stdout.write(config.json.dumps(timer.to_emf(config.metrics_namespace)).decode('utf-8') + '\n')
+
+
+# Sampling profiler (one invocation in every PROFILE_EVERY_N)
+PROFILE_DUMPS_KEPT = 20
+invocation_count = 0
+invocation_count_lock = threading.Lock()
+
+
+def profile_due() -> bool:
+    """Count the invocation and tell whether it is the one in N to profile."""
+    global invocation_count
+    try:
+        every = get_config().profile_every_n
+    except Exception:
+        return False
+    if not every:
+        return False
+    with invocation_count_lock:
+        invocation_count += 1
+        return invocation_count % every == 0
+
+
+def short_location(filename: str, lineno: int, name: Optional[str] = None) -> str:
+    location = f'{os.path.basename(filename)}:{lineno}'
+    return f'{location}({name})' if name else location
+
+
+def run_profiled(handler: Callable[[Dict[str, Any], Any], Dict[str, Any]], event: Dict[str, Any],
+                 context: Any, config: Config) -> Dict[str, Any]:
+    """
+    Run one invocation under cProfile and tracemalloc.
+    
+    Writes a compact JSON record with the top PROFILE_TOP_K functions by
+    cumulative time and the top allocation sites to stdout, and saves the full
+    pstats dump under PROFILE_DIR (keeping the newest PROFILE_DUMPS_KEPT).
+    
+    Args:
+        handler: Function handling the invocation
+        event: ALB event
+        context: Lambda context
+        config: Configuration
+    
+    Returns:
+        The handler's response
+    """
+    import cProfile
+    import pstats
+    import tracemalloc
+    
+    profiler = cProfile.Profile()
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    started = time.perf_counter()
+    profiler.enable()
+    try:
+        return handler(event, context)
+    finally:
+        profiler.disable()
+        elapsed = time.perf_counter() - started
+        snapshot = tracemalloc.take_snapshot()
+        if not tracing:
+            tracemalloc.stop()
+        try:
+            write_profile(profiler, pstats.Stats(profiler), snapshot, elapsed, context, config)
+        except Exception as e:
+            logger.warning('Could not write profile: %s', e)
+
+
+def write_profile(profiler, stats, snapshot, elapsed: float, context: Any, config: Config):
+    """Log the top functions and allocation sites of a profile and dump its stats."""
+    import tracemalloc
+    
+    top_k = config.profile_top_k
+    functions = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:top_k]
+    snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+    allocations = snapshot.statistics('lineno')[:top_k]
+    
+    request_id = getattr(context, 'request_id', None) or getattr(context, 'aws_request_id', None) or 'unknown'
+    dump_path = None
+    if config.profile_dir:
+        os.makedirs(config.profile_dir, exist_ok=True)
+        name = f'{int(time.time() * 1000)}-{invocation_count}-{request_id}.pstats'
+        dump_path = os.path.join(config.profile_dir, name)
+        profiler.dump_stats(dump_path)
+        dumps = sorted(name for name in os.listdir(config.profile_dir) if name.endswith('.pstats'))
+        for name in dumps[:-PROFILE_DUMPS_KEPT]:
+            os.remove(os.path.join(config.profile_dir, name))
+    
+    record = {
+        'profile': {
+            'request_id': request_id,
+            'invocation': invocation_count,
+            'elapsed_ms': round(elapsed * 1000, 3),
+            'functions': [
+                [short_location(filename, lineno, name), calls, round(cumulative * 1000, 3)]
+                for (filename, lineno, name), (_, calls, _, cumulative, _) in functions
+            ],
+            'allocations': [
+                [short_location(stat.traceback[0].filename, stat.traceback[0].lineno), stat.size, stat.count]
+                for stat in allocations
+            ],
+            'dump': dump_path
+        }
     }
+    sys.stdout.write(config.json.dumps(record).decode('utf-8') + '\n')
 
 
 def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
@@ -53,8 +2262,27 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     Returns:
         Dict containing status code, headers, and body for ALB response
     """
+    if profile_due():
+        return run_profiled(handle_request, event, context, get_config())
+    return handle_request(event, context)
+
+
+def handle_request(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """
+    Route an ALB request to the special Lambda, maintenance page or normal response.
+    
+    Args:
+        event: ALB event containing request information
+        context: Lambda context object
+    
+    Returns:
+        Dict containing status code, headers, and body for ALB response
+    """
+    timer = PhaseTimer()
+    config = None
     try:
         config = get_config()
+        timer.mark('config')
         
         # Extract request information from ALB event
         request_path = event.get('path', '/')
@@ -63,120 +2291,420 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         headers = event.get('headers') or {}
         
         # Check if this is a special URL that should invoke another Lambda
-        if should_invoke_special_lambda(request_path, config):
-            return invoke_special_lambda(event, context, config)
+        route = match_special_route(request_path, config)
+        timer.mark('routing')
+        if route is not None:
+            timer.branch = 'special'
+            response = invoke_special_lambda(event, context, config, route, timer)
         
         # If in maintenance mode, return maintenance page
-        if config['MAINTENANCE_MODE']:
-            return get_maintenance_response(event, context, config)
+        elif config.maintenance_mode:
+            timer.branch = 'maintenance'
+            response = get_maintenance_response(event, context, config, timer)
         
         # Normal processing (when not in maintenance mode)
         # This would typically forward to your application
-        return {
-            'statusCode': 200,
-            'statusDescription': '200 OK',
-            'isBase64Encoded': False,
-            'headers': {
-                'Content-Type': 'application/json'
-            },
-            'body': json.dumps({
-                'message': 'Service is operational',
-                'path': request_path
-            })
-        }
+        else:
+            timer.branch = 'normal'
+            response = RESPONSE_CATALOG['normal'].render(request_path)
         
     except Exception as e:
-        return handle_error(e)
+        timer.branch = 'error'
+        response = handle_error(e)
+    
+    if config is not None and config.metrics_enabled:
+        timer.mark('response')
+        emit_metrics(timer, config)
+    return response
 
 
-def should_invoke_special_lambda(path: str, config: Dict[str, Any] = None) -> bool:
+def should_invoke_special_lambda(path: str, config: Optional[Config] = None) -> bool:
     """
     Check if the request path matches the special URL pattern.
     
     Args:
         path: Request path
-        config: Configuration dict (optional, will fetch if not provided)
+        config: Configuration (optional, uses the sandbox snapshot if not provided)
     
     Returns:
         True if should invoke special Lambda, False otherwise
     """
+    return match_special_route(path, config) is not None
+
+
+def match_special_route(path: str, config: Optional[Config] = None) -> Optional[Route]:
+    """
+    Find the special route for a request path.
+    
+    Args:
+        path: Request path
+        config: Configuration (optional, uses the sandbox snapshot if not provided)
+    
+    Returns:
+        The matching route, or None
+    """
     if config is None:
         config = get_config()
-    return path.startswith(config['SPECIAL_URL_PATH'])
+    return config.special_routes.lookup(path)
 
 
-def invoke_special_lambda(event: Dict[str, Any], context: Any, config: Dict[str, Any] = None) -> Dict[str, Any]:
+def invoke_special_lambda(event: Dict[str, Any], context: Any, config: Optional[Config] = None,
+                          route: Optional[Route] = None, timer: Optional[PhaseTimer] = None) -> Dict[str, Any]:
     """
     Invoke another Lambda function for special URL processing.
     
     Args:
         event: ALB event to pass to the special Lambda
         context: Lambda context
-        config: Configuration dict (optional, will fetch if not provided)
+        config: Configuration (optional, uses the sandbox snapshot if not provided)
+        route: Matched route (optional, looked up from the event path if not provided)
+        timer: Phase timer to charge the invoke to (optional)
     
     Returns:
         Response from the special Lambda function
     """
     if config is None:
         config = get_config()
+    if route is None:
+        route = match_special_route(event.get('path', '/'), config)
         
-    if not config['SPECIAL_LAMBDA_ARN']:
-        return {
-            'statusCode': 503,
-            'statusDescription': '503 Service Unavailable',
-            'isBase64Encoded': False,
-            'headers': {
-                'Content-Type': 'application/json'
-            },
-            'body': json.dumps({
-                'error': 'Special Lambda ARN not configured'
-            })
-        }
+    if route is None or not route.arn:
+        return RESPONSE_CATALOG['not_configured'].render()
+    
+    # Fail fast while the function's circuit breaker is open
+    breaker = get_circuit_breaker(route.arn, config)
+    if breaker is not None and timer is not None:
+        timer.watch_breaker(breaker)
+    if breaker is not None and not breaker.allow_request():
+        return get_breaker_open_response(config)
+    started = time.monotonic()
+    succeeded = False
     
     try:
-        # Invoke the special Lambda function
-        response = get_lambda_client().invoke(
-            FunctionName=config['SPECIAL_LAMBDA_ARN'],
-            InvocationType='RequestResponse',
-            Payload=json.dumps({
-                'event': event,
-                'context': {
-                    'function_name': context.function_name,
-                    'function_version': context.function_version,
-                    'request_id': context.request_id,
-                    'memory_limit_in_mb': context.memory_limit_in_mb
-                }
-            })
-        )
+        # Trim the event to what the route's function needs before serializing it
+        projection = route.projection
+        request_payload = {'event': projection.apply(event) if projection is not None else event}
+        if projection is None or projection.context:
+            request_payload['context'] = {
+                'function_name': context.function_name,
+                'function_version': context.function_version,
+                'request_id': context.request_id,
+                'memory_limit_in_mb': context.memory_limit_in_mb
+            }
+        
+        # Fire-and-forget routes are acknowledged without waiting for the function
+        if route.invocation_type == 'Event':
+            get_lambda_client().invoke(
+                FunctionName=route.arn,
+                InvocationType='Event',
+                Payload=config.json.dumps(request_payload)
+            )
+            if timer is not None:
+                timer.mark('invoke')
+            succeeded = True
+            return get_accepted_response()
+        
+        # Invoke the special Lambda function, hedging slow calls on idempotent routes
+        if route.idempotent and config.hedge_budget > 0:
+            response, body = invoke_hedged(route.arn, config.json.dumps(request_payload), config)
+        else:
+            response, body, _ = call_special_lambda(route.arn, config.json.dumps(request_payload))
+        if timer is not None:
+            timer.mark('invoke')
         
         # Parse the response from the special Lambda
-        payload = json.loads(response['Payload'].read())
+        payload = config.json.loads(body)
+        
+        # Check only the top-level keys the ALB needs; the body is passed through as is
+        problem = 'function error: ' + str(response['FunctionError']) if response.get('FunctionError') else None
+        problem = problem or validate_alb_response(payload)
+        if problem:
+            return get_bad_gateway_response(f'Invalid response from special Lambda: {problem}')
         
         # Return the response from the special Lambda
+        succeeded = True
         return payload
         
     except Exception as e:
-        return {
-            'statusCode': 500,
-            'statusDescription': '500 Internal Server Error',
-            'isBase64Encoded': False,
-            'headers': {
-                'Content-Type': 'application/json'
-            },
-            'body': json.dumps({
-                'error': f'Error invoking special Lambda: {str(e)}'
-            })
-        }
+        return RESPONSE_CATALOG['invoke_error'].render(f'Error invoking special Lambda: {str(e)}')
+    
+    finally:
+        if breaker is not None:
+            breaker.record(succeeded, time.monotonic() - started)
+
+
+def call_special_lambda(arn: str, payload: bytes) -> Tuple[Dict[str, Any], bytes, float]:
+    """
+    Synchronously invoke a special Lambda and read its response payload.
+    
+    Args:
+        arn: Function ARN
+        payload: Serialized request payload
+    
+    Returns:
+        Tuple of (invoke response, payload bytes, elapsed seconds)
+    """
+    started = time.monotonic()
+    response = get_lambda_client().invoke(
+        FunctionName=arn,
+        InvocationType='RequestResponse',
+        Payload=payload
+    )
+    body = response['Payload'].read()
+    return response, body, time.monotonic() - started
+
+
+# Hedged invocations for idempotent routes
+HEDGE_LATENCY_SAMPLES = 200
+HEDGE_MIN_SAMPLES = 20
+HEDGE_PERCENTILE = 0.95
+# Most hedges the budget can save up while traffic is quiet
+HEDGE_BURST = 5.0
+
+
+class LatencyTracker:
+    """Recent invoke latencies of one function, for the adaptive hedge delay."""
+
+    def __init__(self, size: int = HEDGE_LATENCY_SAMPLES):
+        self.samples = collections.deque(maxlen=size)
+
+    def record(self, elapsed: float):
+        self.samples.append(elapsed)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Return the q-quantile of the recent latencies, or None with too few samples."""
+        samples = sorted(self.samples)
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(int(len(samples) * q), len(samples) - 1)]
+
+
+class HedgeBudget:
+    """
+    Caps hedged (second) invocations to a percentage of hedgeable requests.
+    
+    A token bucket: each request adds ``percent / 100`` of a hedge and each
+    hedge takes a whole one. The bucket holds at most HEDGE_BURST hedges, so
+    credit saved up during quiet traffic cannot be spent in one burst when the
+    downstream turns slow.
+    """
+
+    def __init__(self):
+        self.tokens = 0.0
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.lock = threading.Lock()
+
+    def record_request(self, percent: float):
+        """Count a hedgeable request, earning ``percent`` of a hedge."""
+        with self.lock:
+            self.requests += 1
+            self.tokens = min(self.tokens + percent / 100, HEDGE_BURST)
+
+    def try_acquire(self) -> bool:
+        """Take one hedge from the bucket if a whole one is available."""
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            self.hedges += 1
+            return True
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {'requests': self.requests, 'hedges': self.hedges, 'hedge_wins': self.hedge_wins}
+
+
+latency_trackers: Dict[str, LatencyTracker] = {}
+hedge_budget = HedgeBudget()
+hedge_executor = None
+hedge_lock = threading.Lock()
+# Invocations running on the hedge pool, including abandoned ones still in flight
+hedge_in_flight = 0
+
+
+def get_hedge_executor(config: Config):
+    """
+    Get or create the thread pool running hedged invocations.
+    
+    It has one worker per client connection (CLIENT_MAX_POOL_CONNECTIONS), as
+    more could only wait for a connection. Abandoned calls keep their worker
+    until they finish, so callers check hedge_worker_free before submitting.
+    """
+    global hedge_executor
+    if hedge_executor is None:
+        with hedge_lock:
+            if hedge_executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                hedge_executor = ThreadPoolExecutor(max_workers=config.client_max_pool_connections,
+                                                    thread_name_prefix='hedge')
+    return hedge_executor
+
+
+def hedge_worker_free(config: Config) -> bool:
+    """Tell whether a hedge pool worker is idle, so a new call would start at once."""
+    return hedge_in_flight < config.client_max_pool_connections
+
+
+def submit_hedge_call(arn: str, payload: bytes, tracker: LatencyTracker, config: Config):
+    """
+    Start call_special_lambda on the hedge pool.
+    
+    The call's latency is recorded when it finishes, also when it lost the
+    race and was abandoned, so the tracker keeps seeing the slow tail.
+    
+    Returns:
+        Future of the call
+    """
+    global hedge_in_flight
+    with hedge_lock:
+        hedge_in_flight += 1
+    
+    def finished(future):
+        global hedge_in_flight
+        with hedge_lock:
+            hedge_in_flight -= 1
+        if future.exception() is None:
+            tracker.record(future.result()[2])
+    
+    future = get_hedge_executor(config).submit(call_special_lambda, arn, payload)
+    future.add_done_callback(finished)
+    return future
+
+
+def get_hedge_stats() -> Dict[str, int]:
+    """Return hedgeable request, hedge and hedge-win counts for this sandbox."""
+    return hedge_budget.stats()
+
+
+def clear_hedge_state():
+    """Forget recorded latencies and reset the hedge budget."""
+    global hedge_budget, hedge_in_flight
+    latency_trackers.clear()
+    hedge_budget = HedgeBudget()
+    with hedge_lock:
+        hedge_in_flight = 0
+
+
+def invoke_hedged(arn: str, payload: bytes, config: Config) -> Tuple[Dict[str, Any], bytes]:
+    """
+    Invoke an idempotent special Lambda, hedging with a second call if slow.
+    
+    If the first call has not answered after the hedge delay (HEDGE_DELAY, or
+    the observed p95 latency of the function when 0) and the hedge budget
+    allows it, an identical second call is started. The first successful
+    answer wins; the other call is abandoned and its result ignored. Every
+    call's latency is recorded. When all hedge pool workers are still busy
+    with abandoned calls, the function is invoked inline without hedging.
+    
+    Args:
+        arn: Function ARN
+        payload: Serialized request payload
+        config: Configuration
+    
+    Returns:
+        Tuple of (invoke response, payload bytes) of the winning call
+    
+    Raises:
+        Exception: The last error if every call failed
+    """
+    tracker = latency_trackers.get(arn)
+    if tracker is None:
+        tracker = latency_trackers.setdefault(arn, LatencyTracker())
+    hedge_budget.record_request(config.hedge_budget)
+    delay = config.hedge_delay or tracker.percentile(HEDGE_PERCENTILE)
+    if delay is None or not hedge_worker_free(config):
+        # No latency profile yet, or no idle worker: invoke inline and learn from it
+        response, body, elapsed = call_special_lambda(arn, payload)
+        tracker.record(elapsed)
+        return response, body
+    
+    from concurrent.futures import as_completed, wait
+    futures = [submit_hedge_call(arn, payload, tracker, config)]
+    wait(futures, timeout=delay)
+    if not futures[0].done() and hedge_worker_free(config) and hedge_budget.try_acquire():
+        logger.info('Hedging invocation of %s after %.3fs', arn, delay)
+        futures.append(submit_hedge_call(arn, payload, tracker, config))
+    
+    error = None
+    for future in as_completed(futures):
+        try:
+            response, body, _ = future.result()
+        except Exception as e:
+            error = e
+            continue
+        if future is not futures[0]:
+            with hedge_budget.lock:
+                hedge_budget.hedge_wins += 1
+        return response, body
+    raise error
+
+
+def validate_alb_response(payload: Any) -> Optional[str]:
+    """
+    Check the top-level shape of a Lambda response destined for the ALB.
+    
+    Only the keys the ALB interprets are inspected; the body is never walked.
+    
+    Args:
+        payload: Decoded response from the special Lambda
+    
+    Returns:
+        A description of the problem, or None if the response is usable
+    """
+    if not isinstance(payload, dict):
+        return 'not a JSON object'
+    status = payload.get('statusCode')
+    if type(status) is not int or not 100 <= status <= 599:
+        return f'invalid statusCode {status!r}'
+    headers = payload.get('headers')
+    if headers is not None and not isinstance(headers, dict):
+        return 'headers must be an object'
+    multi_headers = payload.get('multiValueHeaders')
+    if multi_headers is not None and not isinstance(multi_headers, dict):
+        return 'multiValueHeaders must be an object'
+    body = payload.get('body')
+    if body is not None and not isinstance(body, str):
+        return 'body must be a string'
+    if not isinstance(payload.get('isBase64Encoded', False), bool):
+        return 'isBase64Encoded must be a boolean'
+    return None
+
+
+def get_bad_gateway_response(message: str) -> Dict[str, Any]:
+    """
+    Return a 502 response for an unusable special Lambda response.
+    
+    Args:
+        message: Error description
+    
+    Returns:
+        ALB error response
+    """
+    return RESPONSE_CATALOG['bad_gateway'].render(message)
+
+
+def get_accepted_response() -> Dict[str, Any]:
+    """
+    Return the 202 response sent after an asynchronous special Lambda invocation.
+    
+    Returns:
+        ALB response acknowledging the request
+    """
+    return RESPONSE_CATALOG['accepted'].render()
 
 
-def get_maintenance_response(event: Dict[str, Any], context: Any, config: Dict[str, Any] = None) -> Dict[str, Any]:
+def get_maintenance_response(event: Dict[str, Any], context: Any, config: Optional[Config] = None,
+                             timer: Optional[PhaseTimer] = None) -> Dict[str, Any]:
     """
     Fetch maintenance page from S3 and return with parameter replacement.
     
     Args:
         event: ALB event containing request information
         context: Lambda context
-        config: Configuration dict (optional, will fetch if not provided)
+        config: Configuration (optional, uses the sandbox snapshot if not provided)
+        timer: Phase timer to charge the fetch and render to (optional)
     
     Returns:
         ALB response with maintenance page
@@ -185,26 +2713,49 @@ def get_maintenance_response(event: Dict[str, Any], context: Any, config: Dict[s
         config = get_config()
         
     try:
-        # Fetch maintenance page from S3
-        response = get_s3_client().get_object(Bucket=config['S3_BUCKET'], Key=config['S3_KEY'])
-        maintenance_html = response['Body'].read().decode('utf-8')
+        # Fetch maintenance page from the cache tiers (or S3)
+        page, tier, language = lookup_tenant_page(event, config)
+        logger.debug('Maintenance page served from %s tier', tier)
+        if timer is not None:
+            timer.mark('fetch')
+            timer.tier = tier
         
-        # Replace parameters in the maintenance page
-        maintenance_html = replace_parameters(maintenance_html, event, context)
+        headers = {
+            'Content-Type': 'text/html; charset=utf-8',
+            'Retry-After': '3600',
+            'Vary': 'Accept-Encoding'
+        }
+        if config.page_languages:
+            headers['Vary'] = 'Accept-Encoding, Accept-Language'
+            headers['Content-Language'] = language
+        encoding = None
+        if config.compression_enabled:
+            encoding = negotiate_encoding((event.get('headers') or {}).get('accept-encoding'),
+                                          not page.template.resolvers)
+        
+        if encoding:
+            # Compressed variant, with parameters replaced
+            headers['Content-Encoding'] = encoding
+            body = page.template.variant(encoding).render(event, context)
+        else:
+            # Replace parameters in the maintenance page
+            body = page.template.render(event, context)
+        if timer is not None:
+            timer.mark('render')
         
         return {
             'statusCode': 503,
             'statusDescription': '503 Service Unavailable',
-            'isBase64Encoded': False,
-            'headers': {
-                'Content-Type': 'text/html; charset=utf-8',
-                'Retry-After': '3600'
-            },
-            'body': maintenance_html
+            'isBase64Encoded': encoding is not None,
+            'headers': headers,
+            'body': body
         }
         
     except Exception as e:
         # If we can't fetch the maintenance page, return a simple fallback
+        if timer is not None:
+            timer.mark('fetch')
+            timer.branch = 'fallback'
         return get_fallback_maintenance_response(str(e))
 
 
@@ -222,6 +2773,9 @@ def replace_parameters(html: str, event: Dict[str, Any], context: Any) -> str:
     - {{HOST}}: Host header
     - {{FUNCTION_NAME}}: Lambda function name
     
+    Further parameters can be added with the @placeholder decorator. Only the
+    resolvers for parameters present in the template are evaluated.
+    
     Args:
         html: HTML template with {{PARAMETER}} placeholders
         event: ALB event
@@ -229,27 +2783,11 @@ def replace_parameters(html: str, event: Dict[str, Any], context: Any) -> str:
     
     Returns:
         HTML with parameters replaced
-    """
-    import datetime
-    
-    # Extract values from event and context
-    replacements = {
-        'REQUEST_ID': context.request_id,
-        'TIMESTAMP': datetime.datetime.now(datetime.timezone.utc).isoformat(),
-        'PATH': event.get('path', '/'),
-        'METHOD': event.get('httpMethod', 'GET'),
-        'SOURCE_IP': event.get('requestContext', {}).get('identity', {}).get('sourceIp', 'unknown'),
-        'USER_AGENT': event.get('headers', {}).get('user-agent', 'unknown'),
-        'HOST': event.get('headers', {}).get('host', 'unknown'),
-        'FUNCTION_NAME': context.function_name,
-    }
-    
-    # Replace all parameters in the HTML
-    for key, value in replacements.items():
-        pattern = '{{' + key + '}}'
-        html = html.replace(pattern, str(value))
     
-    return html
+    Raises:
+        TemplateError: If the template uses an unknown parameter
+    """
+    return compile_template(html).render(event, context)
 
 
 def get_fallback_maintenance_response(error_message: str) -> Dict[str, Any]:
@@ -262,7 +2800,27 @@ def get_fallback_maintenance_response(error_message: str) -> Dict[str, Any]:
     Returns:
         ALB response with fallback maintenance page
     """
-    fallback_html = """
+    logger.error('Serving the fallback maintenance page: %s', error_message)
+    return RESPONSE_CATALOG['fallback'].render()
+
+
+def handle_error(error: Exception) -> Dict[str, Any]:
+    """
+    Handle unexpected errors and return appropriate response.
+    
+    Args:
+        error: Exception that occurred
+    
+    Returns:
+        ALB error response
+    """
+    return RESPONSE_CATALOG['internal_error'].render(str(error))
+
+
+# Response catalog: static responses serialized once at import
+RESPONSE_SLOT = 'RESPONSE_CATALOG_SLOT'
+JSON_HEADERS = {'Content-Type': 'application/json'}
+FALLBACK_HTML = """
     <!DOCTYPE html>
     <html>
     <head>
@@ -301,38 +2859,138 @@ def get_fallback_maintenance_response(error_message: str) -> Dict[str, Any]:
     </body>
     </html>
     """
+
+
+class StaticResponse:
+    """
+    An ALB response built and serialized once.
     
-    return {
-        'statusCode': 503,
-        'statusDescription': '503 Service Unavailable',
-        'isBase64Encoded': False,
-        'headers': {
-            'Content-Type': 'text/html; charset=utf-8',
-            'Retry-After': '3600'
-        },
-        'body': fallback_html
-    }
+    ``render()`` hands out a shallow copy with its own headers dict. A JSON
+    body may hold one RESPONSE_SLOT value; ``render(value)`` splices the
+    JSON-escaped value between the pre-serialized prefix and suffix instead of
+    rebuilding and re-serializing the whole body.
+    """
 
+    __slots__ = ('response', 'prefix', 'suffix', 'encode')
 
-def handle_error(error: Exception) -> Dict[str, Any]:
+    def __init__(self, status_description: str, headers: Dict[str, str], body: Any,
+                 separators: Optional[Tuple[str, str]] = None, ensure_ascii: bool = True):
+        self.encode = functools.partial(json.dumps, separators=separators, ensure_ascii=ensure_ascii)
+        self.prefix = self.suffix = None
+        if not isinstance(body, str):
+            body = self.encode(body)
+            if self.encode(RESPONSE_SLOT) in body:
+                self.prefix, self.suffix = body.split(self.encode(RESPONSE_SLOT))
+        self.response = {
+            'statusCode': int(status_description.split(' ', 1)[0]),
+            'statusDescription': status_description,
+            'isBase64Encoded': False,
+            'headers': dict(headers),
+            'body': body
+        }
+
+    def render(self, value: Optional[str] = None) -> Dict[str, Any]:
+        """Return a copy of the response, with ``value`` in the body slot if it has one."""
+        response = self.response.copy()
+        response['headers'] = response['headers'].copy()
+        if self.prefix is not None:
+            response['body'] = self.prefix + self.encode(value) + self.suffix
+        return response
+
+
+RESPONSE_CATALOG = {
+    'normal': StaticResponse('200 OK', JSON_HEADERS, {
+        'message': 'Service is operational',
+        'path': RESPONSE_SLOT
+    }, separators=(',', ':'), ensure_ascii=False),
+    'accepted': StaticResponse('202 Accepted', JSON_HEADERS, {'message': 'Accepted'}),
+    'internal_error': StaticResponse('500 Internal Server Error', JSON_HEADERS, {
+        'error': 'Internal server error',
+        'message': RESPONSE_SLOT
+    }),
+    'invoke_error': StaticResponse('500 Internal Server Error', JSON_HEADERS, {'error': RESPONSE_SLOT}),
+    'bad_gateway': StaticResponse('502 Bad Gateway', JSON_HEADERS, {'error': RESPONSE_SLOT}),
+    'not_configured': StaticResponse('503 Service Unavailable', JSON_HEADERS, {
+        'error': 'Special Lambda ARN not configured'
+    }),
+    'fallback': StaticResponse('503 Service Unavailable', {
+        'Content-Type': 'text/html; charset=utf-8',
+        'Retry-After': '3600'
+    }, FALLBACK_HTML),
+}
+
+
+def warmup(config: Optional[Config] = None, result: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """
-    Handle unexpected errors and return appropriate response.
+    Create the AWS clients and prefetch the maintenance page ahead of the first request.
+    
+    Only the work this sandbox's configuration needs is done: the S3 client and
+    page (compiled, plus its gzip variant) in maintenance mode, and the Lambda
+    client when a special route has an ARN.
     
     Args:
-        error: Exception that occurred
+        config: Configuration (optional, uses the sandbox snapshot if not provided)
+        result: Dict to record completed steps into (optional)
     
     Returns:
-        ALB error response
+        Dict listing the completed steps and any error
     """
-    return {
-        'statusCode': 500,
-        'statusDescription': '500 Internal Server Error',
-        'isBase64Encoded': False,
-        'headers': {
-            'Content-Type': 'application/json'
-        },
-        'body': json.dumps({
-            'error': 'Internal server error',
-            'message': str(error)
-        })
-    }
+    if config is None:
+        config = get_config()
+    if result is None:
+        result = {}
+    result['steps'] = []
+    try:
+        if config.maintenance_mode:
+            get_s3_client()
+            result['steps'].append('s3_client')
+        if any(route.arn for route in config.special_routes.routes):
+            get_lambda_client()
+            result['steps'].append('lambda_client')
+        if config.maintenance_mode and config.page_cache_enabled:
+            template = fetch_maintenance_page(config).template
+            result['steps'].append('page')
+            if config.compression_enabled and 'gzip' in ENCODED_TEMPLATE_TYPES:
+                template.variant('gzip')
+                result['steps'].append('gzip')
+    except Exception as e:
+        result['error'] = str(e)
+    return result
+
+
+def run_warmup(config: Optional[Config] = None, timeout: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Run warmup() in a background thread, waiting at most ``timeout`` seconds.
+    
+    A warmup that overruns its budget keeps going in the background (the
+    lock-protected caches make that safe) while INIT completes; errors are
+    logged and never raised.
+    
+    Args:
+        config: Configuration (optional, uses the sandbox snapshot if not provided)
+        timeout: Time budget in seconds (defaults to WARMUP_TIMEOUT)
+    
+    Returns:
+        Dict with the completed steps, elapsed time and whether the budget ran out
+    """
+    if config is None:
+        config = get_config()
+    if timeout is None:
+        timeout = config.warmup_timeout
+    result = {}
+    started = time.monotonic()
+    thread = threading.Thread(target=warmup, args=(config, result), name='warmup', daemon=True)
+    thread.start()
+    thread.join(timeout)
+    result['timed_out'] = thread.is_alive()
+    result['elapsed'] = time.monotonic() - started
+    if result['timed_out'] or 'error' in result:
+        logger.warning('Warmup incomplete: %s', result)
+    return result
+
+
+# Parse the configuration during INIT so invalid settings fail the cold start
+get_config()
+
+# Optional INIT-phase warmup (most useful with provisioned concurrency)
+warmup_result = run_warmup() if config_snapshot.warmup_enabled else None
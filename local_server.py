@@ -0,0 +1,349 @@
+"""
+Local ALB emulator for the maintenance handler.
+
+Serves HTTP with asyncio (standard library only), turns each request into an
+ALB target event like those in ``examples/``, runs ``lambda_handler`` with a
+fake context and writes the returned dict back as the HTTP response. S3 and
+the special Lambda functions can be replaced by local stand-ins so load tools
+such as ``wrk`` can drive the handler without AWS.
+
+Usage:
+    MAINTENANCE_MODE=true python local_server.py --port 8080 --s3-dir . --lambda echo
+    wrk -t4 -c64 -d30s http://127.0.0.1:8080/
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import http
+import importlib
+import io
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# Add this directory to path to import lambda_handler when run from elsewhere
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import lambda_handler
+
+logger = logging.getLogger(__name__)
+
+TARGET_GROUP_ARN = 'arn:aws:elasticloadbalancing:ap-northeast-1:123456789012:targetgroup/lambda-target/1234567890123456'
+TEXT_CONTENT_TYPES = ('text/', 'application/json', 'application/javascript', 'application/xml',
+                      'application/x-www-form-urlencoded')
+MAX_HEADER_BYTES = 64 * 1024
+
+
+class FakeContext:
+    """Minimal stand-in for the Lambda context object."""
+
+    def __init__(self, function_name: str = 'maintenance-handler-local', memory_limit_in_mb: int = 256,
+                 timeout: float = 30.0):
+        self.function_name = function_name
+        self.function_version = '$LATEST'
+        self.memory_limit_in_mb = memory_limit_in_mb
+        self.invoked_function_arn = f'arn:aws:lambda:ap-northeast-1:123456789012:function:{function_name}'
+        self.aws_request_id = str(uuid.uuid4())
+        self.request_id = self.aws_request_id
+        self.deadline = time.monotonic() + timeout
+
+    def get_remaining_time_in_millis(self) -> int:
+        return max(0, int((self.deadline - time.monotonic()) * 1000))
+
+
+class LocalS3Client:
+    """
+    S3 stand-in serving objects from a local directory.
+
+    The bucket is ignored and the key is resolved under ``root``. ETags are
+    MD5 digests of the file, so conditional GETs answer 304 like S3 does.
+    """
+
+    def __init__(self, root: str, latency: float = 0.0):
+        self.root = os.path.abspath(root)
+        self.latency = latency
+
+    def get_object(self, Bucket: str, Key: str, IfNoneMatch: Optional[str] = None) -> Dict[str, Any]:
+        if self.latency:
+            time.sleep(self.latency)
+        path = os.path.abspath(os.path.join(self.root, Key))
+        if not path.startswith(self.root + os.sep):
+            raise lambda_handler.S3Error(403, 'AccessDenied', Key)
+        try:
+            with open(path, 'rb') as f:
+                body = f.read()
+        except OSError:
+            raise lambda_handler.S3Error(404, 'NoSuchKey', Key) from None
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        if IfNoneMatch == etag:
+            raise lambda_handler.S3Error(304, '304')
+        return {'Body': io.BytesIO(body), 'ETag': etag, 'ContentLength': len(body)}
+
+
+def echo_function(payload: Dict[str, Any], context: FakeContext) -> Dict[str, Any]:
+    """Default special Lambda stand-in: echoes the method and path as JSON."""
+    event = payload.get('event', {})
+    return {
+        'statusCode': 200,
+        'statusDescription': '200 OK',
+        'isBase64Encoded': False,
+        'headers': {'Content-Type': 'application/json'},
+        'body': json.dumps({
+            'function': context.function_name,
+            'method': event.get('httpMethod'),
+            'path': event.get('path')
+        })
+    }
+
+
+class LocalLambdaClient:
+    """
+    Lambda stand-in running special functions in-process.
+
+    ``function`` receives the request payload sent by ``invoke_special_lambda``
+    and a FakeContext, and returns the ALB response dict. Exceptions are
+    reported as ``FunctionError`` like the Lambda service does; ``Event``
+    invocations run on a background thread and answer 202 at once.
+    """
+
+    def __init__(self, function: Callable[[Dict[str, Any], Any], Any] = echo_function, latency: float = 0.0):
+        self.function = function
+        self.latency = latency
+
+    def run(self, function_name: str, payload: Dict[str, Any]) -> Tuple[Optional[str], bytes]:
+        if self.latency:
+            time.sleep(self.latency)
+        try:
+            result = self.function(payload, FakeContext(function_name.rsplit(':', 1)[-1]))
+        except Exception as e:
+            return 'Unhandled', json.dumps({'errorMessage': str(e), 'errorType': type(e).__name__}).encode()
+        return None, json.dumps(result).encode()
+
+    def invoke(self, FunctionName: str, InvocationType: str = 'RequestResponse', Payload: bytes = b'{}'):
+        payload = json.loads(Payload)
+        if InvocationType == 'Event':
+            threading.Thread(target=self.run, args=(FunctionName, payload), daemon=True).start()
+            return {'StatusCode': 202, 'Payload': io.BytesIO(b'')}
+        function_error, body = self.run(FunctionName, payload)
+        response = {'StatusCode': 200, 'Payload': io.BytesIO(body)}
+        if function_error:
+            response['FunctionError'] = function_error
+        return response
+
+
+def load_function(spec: str) -> Callable:
+    """Resolve ``echo`` or a ``module:function`` spec to a special Lambda stand-in."""
+    if spec == 'echo':
+        return echo_function
+    module_name, _, attribute = spec.partition(':')
+    if not attribute:
+        raise ValueError(f'Expected module:function, got {spec!r}')
+    return getattr(importlib.import_module(module_name), attribute)
+
+
+def install_stand_ins(s3: Optional[LocalS3Client] = None, lambda_: Optional[LocalLambdaClient] = None):
+    """Make the handler use local stand-ins instead of the AWS clients."""
+    if s3 is not None:
+        lambda_handler.s3_client = s3
+    if lambda_ is not None:
+        lambda_handler.lambda_client = lambda_
+
+
+def build_event(method: str, target: str, headers: Dict[str, str], body: bytes,
+                client_ip: str = '127.0.0.1', port: int = 80) -> Dict[str, Any]:
+    """
+    Build an ALB target event from an HTTP request.
+
+    Header names are lower-cased and query parameters are passed undecoded
+    with the last value winning, as the ALB does without multi-value headers.
+    Bodies that are not text are base64-encoded.
+
+    Args:
+        method: HTTP method
+        target: Request target (path and query string)
+        headers: Request headers (lower-cased names)
+        body: Request body
+        client_ip: Peer address reported as the source IP
+        port: Listener port
+
+    Returns:
+        ALB event
+    """
+    path, _, query = target.partition('?')
+    params = {}
+    for pair in query.split('&'):
+        if pair:
+            name, _, value = pair.partition('=')
+            params[name] = value
+
+    headers = dict(headers)
+    headers.setdefault('x-forwarded-for', client_ip)
+    headers.setdefault('x-forwarded-port', str(port))
+    headers.setdefault('x-forwarded-proto', 'http')
+    headers.setdefault('x-amzn-trace-id', f'Root=1-{int(time.time()):08x}-{uuid.uuid4().hex[:24]}')
+
+    content_type = headers.get('content-type', '')
+    is_text = not body or content_type.startswith(TEXT_CONTENT_TYPES)
+    return {
+        'requestContext': {
+            'elb': {'targetGroupArn': TARGET_GROUP_ARN},
+            'identity': {'sourceIp': client_ip}
+        },
+        'httpMethod': method,
+        'path': path or '/',
+        'queryStringParameters': params,
+        'headers': headers,
+        'body': body.decode('utf-8', 'replace') if is_text else base64.b64encode(body).decode('ascii'),
+        'isBase64Encoded': not is_text
+    }
+
+
+def encode_response(response: Dict[str, Any], keep_alive: bool) -> bytes:
+    """Serialize an ALB response dict as an HTTP/1.1 response."""
+    status = int(response.get('statusCode', 502))
+    description = response.get('statusDescription')
+    if not description:
+        try:
+            description = f'{status} {http.HTTPStatus(status).phrase}'
+        except ValueError:
+            description = str(status)
+
+    body = response.get('body') or ''
+    body = base64.b64decode(body) if response.get('isBase64Encoded') else body.encode('utf-8')
+
+    lines = [f'HTTP/1.1 {description}']
+    header_names = set()
+    for name, value in (response.get('headers') or {}).items():
+        header_names.add(name.lower())
+        lines.append(f'{name}: {value}')
+    for name, values in (response.get('multiValueHeaders') or {}).items():
+        if name.lower() not in header_names:
+            lines.extend(f'{name}: {value}' for value in values)
+    lines.append(f'Content-Length: {len(body)}')
+    lines.append('Connection: keep-alive' if keep_alive else 'Connection: close')
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+
+
+class LocalAlbServer:
+    """
+    asyncio HTTP server forwarding requests to ``lambda_handler``.
+
+    ``concurrency`` is the number of handler invocations run at once (each on
+    a worker thread), roughly the number of warm sandboxes being emulated.
+    Unlike real sandboxes they share module-level state such as the page
+    cache, so that state is guarded by the handler's locks.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 8080, concurrency: int = 4,
+                 handler: Callable[[Dict[str, Any], Any], Dict[str, Any]] = None):
+        self.host = host
+        self.port = port
+        self.concurrency = concurrency
+        self.handler = handler or lambda_handler.lambda_handler
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='sandbox')
+        self.server = None
+        self.requests = 0
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port,
+                                                 limit=MAX_HEADER_BYTES)
+        self.port = self.server.sockets[0].getsockname()[1]
+        logger.info('Listening on http://%s:%d (concurrency=%d)', self.host, self.port, self.concurrency)
+
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        self.executor.shutdown(wait=False)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        peer = writer.get_extra_info('peername') or ('127.0.0.1', 0)
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    writer.write(encode_response({'statusCode': 431}, False))
+                    break
+
+                request_line, *header_lines = head.decode('latin-1').split('\r\n')
+                try:
+                    method, target, version = request_line.split(' ', 2)
+                except ValueError:
+                    writer.write(encode_response({'statusCode': 400}, False))
+                    break
+                headers = {}
+                for line in header_lines:
+                    if line:
+                        name, _, value = line.partition(':')
+                        headers[name.strip().lower()] = value.strip()
+
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+                if 'chunked' in headers.get('transfer-encoding', '').lower():
+                    writer.write(encode_response({'statusCode': 411}, False))
+                    break
+                body = await reader.readexactly(int(headers.get('content-length') or 0))
+
+                event = build_event(method, target, headers, body, peer[0], self.port)
+                response = await self.invoke(event)
+                writer.write(encode_response(response, keep_alive))
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def invoke(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        self.requests += 1
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self.executor, self.handler, event, FakeContext())
+        except Exception as e:
+            logger.exception('Handler raised')
+            return {'statusCode': 502, 'body': f'Handler raised: {e}'}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve lambda_handler behind a local ALB emulator.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='handler invocations run at once (default: 4)')
+    parser.add_argument('--s3-dir', help='serve S3 objects from this directory (key = relative path)')
+    parser.add_argument('--s3-latency-ms', type=float, default=0.0, help='added latency per S3 GET')
+    parser.add_argument('--lambda', dest='function',
+                        help='special Lambda stand-in: "echo" or module:function')
+    parser.add_argument('--lambda-latency-ms', type=float, default=0.0, help='added latency per invoke')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    install_stand_ins(
+        s3=LocalS3Client(args.s3_dir, args.s3_latency_ms / 1000) if args.s3_dir else None,
+        lambda_=LocalLambdaClient(load_function(args.function), args.lambda_latency_ms / 1000)
+        if args.function else None
+    )
+    server = LocalAlbServer(args.host, args.port, args.concurrency)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -2,7 +2,18 @@
 Unit tests for Lambda maintenance handler.
 """
 
+import asyncio
+import base64
+import dataclasses
+import gzip
+import http.server
 import json
+import subprocess
+import threading
+import time
+import urllib.parse
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 import pytest
 from unittest.mock import Mock, patch, MagicMock
 import sys
@@ -11,7 +22,55 @@ import os
 # Add parent directory to path to import lambda_handler
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+import benchmark_lambda_handler
+import coldstart_lambda_handler
 import lambda_handler
+import local_server
+
+
+def make_s3(objects):
+    """
+    Build a mock S3 client serving ``objects`` from memory.
+    
+    ``objects`` maps keys to bodies or to (body, ETag) pairs; the ETag
+    defaults to the quoted key. Unknown keys raise S3Error(404).
+    """
+    def get_object(Bucket, Key, IfNoneMatch=None):
+        if Key not in objects:
+            raise lambda_handler.S3Error(404, 'NoSuchKey')
+        body, etag = objects[Key] if isinstance(objects[Key], tuple) else (objects[Key], f'"{Key}"')
+        return {'Body': MagicMock(read=lambda: body), 'ETag': etag}
+    
+    mock_s3 = Mock()
+    mock_s3.get_object.side_effect = get_object
+    return mock_s3
+
+
+def make_page_s3(body=b'<html>v1</html>', etag='"v1"'):
+    """Build a mock S3 client holding one page at test.html."""
+    return make_s3({'test.html': (body, etag)})
+
+
+def requested_keys(mock_s3):
+    """Return the keys requested from a make_s3 client, in order."""
+    return [call.kwargs['Key'] for call in mock_s3.get_object.call_args_list]
+
+
+@pytest.fixture(autouse=True)
+def reset_handler_state(tmp_path, monkeypatch):
+    """Reset per-sandbox caches so tests do not leak state into each other."""
+    monkeypatch.setattr(lambda_handler, 'PAGE_TMP_DIR_DEFAULT', str(tmp_path / 'pages'))
+    # Tests patch os.environ, so the config snapshot is re-read on first use
+    lambda_handler.config_snapshot = None
+    lambda_handler.clear_page_cache()
+    lambda_handler.clear_circuit_breakers()
+    lambda_handler.clear_hedge_state()
+    monkeypatch.setattr(lambda_handler, 'invocation_count', 0)
+    yield
+    lambda_handler.config_snapshot = None
+    lambda_handler.clear_page_cache()
+    lambda_handler.clear_circuit_breakers()
+    lambda_handler.clear_hedge_state()
 
 
 class TestLambdaHandler:
@@ -106,6 +165,168 @@ class TestLambdaHandler:
         assert lambda_handler.should_invoke_special_lambda('/') == False
 
 
+class TestSpecialRoutes:
+    """Test cases for the special URL route table."""
+    
+    def test_prefix_is_segment_aware(self):
+        """Test that prefix routes do not match partial segments."""
+        config = lambda_handler.load_config({'SPECIAL_URL_PATH': '/special'})
+        
+        assert lambda_handler.should_invoke_special_lambda('/special/', config) == True
+        assert lambda_handler.should_invoke_special_lambda('/specialx', config) == False
+    
+    def test_route_table_from_json(self):
+        """Test exact, prefix and glob routes with their precedence."""
+        routes = [
+            {'path': '/api', 'arn': 'api'},
+            {'path': '/api/health', 'match': 'exact', 'arn': 'health'},
+            {'path': '/api/*/hook', 'match': 'glob', 'arn': 'hook'},
+            {'path': '/files/*.json', 'match': 'glob', 'arn': 'json'},
+            {'path': '/static/**', 'match': 'glob', 'arn': 'static'},
+        ]
+        config = lambda_handler.load_config({'SPECIAL_ROUTES': json.dumps(routes)})
+        
+        def arn(path):
+            route = lambda_handler.match_special_route(path, config)
+            return route.arn if route else None
+        
+        assert arn('/api') == 'api'
+        assert arn('/api/health') == 'health'
+        assert arn('/api/health/deep') == 'api'
+        assert arn('/api/v1/hook') == 'hook'
+        assert arn('/api/v1/hook/x') == 'api'
+        assert arn('/files/a.json') == 'json'
+        assert arn('/files/a.txt') is None
+        assert arn('/static') == 'static'
+        assert arn('/static/css/site.css') == 'static'
+        assert arn('/special') is None
+    
+    def test_in_segment_patterns(self):
+        """Test that in-segment patterns are indexed by affix and overlapping ones are still tried."""
+        routes = [{'path': f'/hook{i}-*/event', 'match': 'glob', 'arn': f'hook{i}'} for i in range(50)]
+        routes += [
+            {'path': '/files/*.json/a', 'match': 'glob', 'arn': 'json'},
+            {'path': '/files/data*/b', 'match': 'glob', 'arn': 'data'},
+            {'path': '/files/*-v?-*/c', 'match': 'glob', 'arn': 'versioned'},
+        ]
+        config = lambda_handler.load_config({'SPECIAL_ROUTES': json.dumps(routes)})
+        table = config.special_routes
+        
+        assert len(table.pattern_candidates(table.root, 'hook7-x')) == 1
+        assert table.pattern_candidates(table.root, 'other') == []
+        assert lambda_handler.match_special_route('/files/a-v2-b/c', config).arn == 'versioned'
+        assert lambda_handler.match_special_route('/hook49-github/event', config).arn == 'hook49'
+        assert lambda_handler.match_special_route('/hook7-x/event', config).arn == 'hook7'
+        assert lambda_handler.match_special_route('/hook7/event', config) is None
+        assert lambda_handler.match_special_route('/files/data.json/a', config).arn == 'json'
+        assert lambda_handler.match_special_route('/files/data.json/b', config).arn == 'data'
+    
+    def test_routes_file(self, tmp_path):
+        """Test loading routes from SPECIAL_ROUTES_FILE."""
+        routes_file = tmp_path / 'routes.json'
+        routes_file.write_text(json.dumps([{'path': '/hooks', 'arn': 'hooks'}]))
+        config = lambda_handler.load_config({'SPECIAL_ROUTES_FILE': str(routes_file)})
+        
+        assert lambda_handler.match_special_route('/hooks/github', config).arn == 'hooks'
+    
+    @pytest.mark.parametrize('routes', [
+        'not json',
+        '{"path": "/x"}',
+        '[{"path": "relative", "arn": "a"}]',
+        '[{"path": "/x", "match": "regex", "arn": "a"}]',
+        '[{"path": "/x", "arn": "a", "invocation_type": "DryRun"}]',
+        '[{"path": "/x/**/y", "match": "glob", "arn": "a"}]',
+        '[{"path": "/x", "arn": "a"}, {"path": "/x/", "arn": "b"}]',
+    ])
+    def test_invalid_routes_rejected(self, routes):
+        """Test that invalid route definitions fail at config load."""
+        with pytest.raises(lambda_handler.ConfigError):
+            lambda_handler.load_config({'SPECIAL_ROUTES': routes})
+    
+    @patch.dict(os.environ, {
+        'MAINTENANCE_MODE': 'true',
+        'SPECIAL_ROUTES': json.dumps([{'path': '/hooks', 'arn': 'arn:aws:lambda:us-east-1:123456789012:function:hooks'}])
+    })
+    @patch('lambda_handler.get_lambda_client')
+    def test_handler_invokes_route_arn(self, mock_get_lambda):
+        """Test that the handler invokes the ARN of the matched route."""
+        mock_lambda_client = Mock()
+        mock_get_lambda.return_value = mock_lambda_client
+        mock_lambda_client.invoke.return_value = {
+            'Payload': MagicMock(read=lambda: b'{"statusCode": 200}')
+        }
+        context = Mock(request_id='r', function_name='f', function_version='1', memory_limit_in_mb=128)
+        
+        response = lambda_handler.lambda_handler({'path': '/hooks/x', 'headers': {}}, context)
+        
+        assert response['statusCode'] == 200
+        assert mock_lambda_client.invoke.call_args.kwargs['FunctionName'].endswith(':hooks')
+
+
+class TestEventProjection:
+    """Test cases for per-route event projection."""
+    
+    def setup_method(self):
+        """Set up test fixtures."""
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'examples', 'alb-event-api-request.json')) as f:
+            self.event = json.load(f)
+        self.event['headers']['X-Custom'] = 'yes'
+        self.context = Mock(request_id='r', function_name='f', function_version='1', memory_limit_in_mb=128)
+    
+    def test_projection_rules(self):
+        """Test header allowlists and dropping body, query and request context."""
+        projection = lambda_handler.EventProjection.from_dict({
+            'headers': ['Host', 'x-custom'],
+            'body': False,
+            'query': False,
+            'request_context': False
+        }, '/api')
+        
+        projected = projection.apply(self.event)
+        
+        assert set(projected['headers']) == {'host', 'X-Custom'}
+        assert 'body' not in projected and 'isBase64Encoded' not in projected
+        assert 'queryStringParameters' not in projected
+        assert 'requestContext' not in projected
+        assert projected['path'] == self.event['path']
+        assert projected['httpMethod'] == self.event['httpMethod']
+        assert 'body' in self.event
+    
+    @pytest.mark.parametrize('spec', [
+        {'headers': 'host'},
+        {'body': 'no'},
+        {'cookies': False},
+        ['headers'],
+    ])
+    def test_invalid_projection_rejected(self, spec):
+        """Test that invalid projection rules fail at config load."""
+        routes = json.dumps([{'path': '/api', 'arn': 'a', 'projection': spec}])
+        with pytest.raises(lambda_handler.ConfigError):
+            lambda_handler.load_config({'SPECIAL_ROUTES': routes})
+    
+    @patch('lambda_handler.get_lambda_client')
+    def test_invoke_sends_projected_event(self, mock_get_lambda):
+        """Test that the invoke payload only carries the projected fields."""
+        routes = json.dumps([{
+            'path': '/api',
+            'arn': 'arn:aws:lambda:us-east-1:123456789012:function:api',
+            'projection': {'headers': False, 'body': False, 'context': False}
+        }])
+        config = lambda_handler.load_config({'SPECIAL_ROUTES': routes})
+        mock_lambda_client = Mock()
+        mock_get_lambda.return_value = mock_lambda_client
+        mock_lambda_client.invoke.return_value = {
+            'Payload': MagicMock(read=lambda: b'{"statusCode": 200}')
+        }
+        
+        lambda_handler.invoke_special_lambda(self.event, self.context, config)
+        
+        sent = json.loads(mock_lambda_client.invoke.call_args.kwargs['Payload'])
+        assert set(sent) == {'event'}
+        assert 'headers' not in sent['event'] and 'body' not in sent['event']
+        assert sent['event']['queryStringParameters'] == self.event['queryStringParameters']
+
+
 class TestParameterReplacement:
     """Test cases for parameter replacement functionality."""
     
@@ -171,6 +392,528 @@ class TestParameterReplacement:
         assert result == html
 
 
+class TestPageTiers:
+    """Test cases for the memory, /tmp, bundled and S3 page tiers."""
+    
+    def setup_method(self):
+        """Set up test fixtures."""
+        self.config = lambda_handler.load_config({'S3_BUCKET': 'test-bucket', 'S3_KEY': 'test.html'})
+    
+    @patch('lambda_handler.get_s3_client')
+    def test_tmp_copy_promoted_after_restart(self, mock_get_s3):
+        """Test that a copy persisted under /tmp is served once memory is lost."""
+        mock_s3 = make_page_s3()
+        mock_get_s3.return_value = mock_s3
+        
+        assert lambda_handler.lookup_maintenance_page(self.config)[1] == 's3'
+        lambda_handler.page_cache.clear()  # simulate a runtime restart
+        page, tier = lambda_handler.lookup_maintenance_page(self.config)
+        
+        assert tier == 'tmp'
+        assert page.body == '<html>v1</html>'
+        assert page.etag == '"v1"'
+        assert lambda_handler.lookup_maintenance_page(self.config)[1] == 'memory'
+        mock_s3.get_object.assert_called_once()
+    
+    @patch('lambda_handler.time.time')
+    @patch('lambda_handler.get_s3_client')
+    def test_expired_tmp_copy_revalidated(self, mock_get_s3, mock_time):
+        """Test that an expired /tmp copy is revalidated with its stored ETag."""
+        mock_s3 = make_page_s3()
+        mock_get_s3.return_value = mock_s3
+        mock_time.return_value = 1000000.0
+        lambda_handler.lookup_maintenance_page(self.config)
+        lambda_handler.page_cache.clear()
+        
+        not_modified = Exception('Not Modified')
+        not_modified.response = {'Error': {'Code': '304'}}
+        mock_s3.get_object.side_effect = not_modified
+        mock_time.return_value = 1000000.0 + 120
+        page, tier = lambda_handler.lookup_maintenance_page(self.config)
+        
+        assert tier == 's3'
+        assert page.body == '<html>v1</html>'
+        mock_s3.get_object.assert_called_with(Bucket='test-bucket', Key='test.html', IfNoneMatch='"v1"')
+    
+    @patch('lambda_handler.time.monotonic')
+    @patch('lambda_handler.get_s3_client')
+    def test_stale_memory_copy_on_s3_error(self, mock_get_s3, mock_monotonic):
+        """Test that an expired copy is served when S3 fails, even without SWR."""
+        mock_s3 = make_page_s3()
+        mock_get_s3.return_value = mock_s3
+        mock_monotonic.return_value = 1000.0
+        lambda_handler.lookup_maintenance_page(self.config)
+        
+        mock_s3.get_object.side_effect = Exception('S3 down')
+        mock_monotonic.return_value = 1100.0
+        page, tier = lambda_handler.lookup_maintenance_page(self.config)
+        
+        assert (page.body, tier) == ('<html>v1</html>', 'memory')
+    
+    @patch('lambda_handler.get_s3_client')
+    def test_bundled_copy_on_s3_error(self, mock_get_s3, tmp_path):
+        """Test that the bundled page is used when S3 fails and nothing was loaded."""
+        bundled = tmp_path / 'bundled.html'
+        bundled.write_text('<html>bundled {{PATH}}</html>', encoding='utf-8')
+        mock_get_s3.return_value.get_object.side_effect = Exception('S3 down')
+        config = dataclasses.replace(self.config, page_bundled_path=str(bundled))
+        context = Mock(request_id='req', function_name='func')
+        
+        response = lambda_handler.get_maintenance_response({'path': '/x'}, context, config)
+        
+        assert response['body'] == '<html>bundled /x</html>'
+        assert lambda_handler.get_page_cache_stats()['bundled_hits'] == 1
+    
+    @patch('lambda_handler.threading.Thread')
+    @patch('lambda_handler.get_s3_client')
+    def test_bundled_copy_served_while_first_fetch_runs(self, mock_get_s3, mock_thread, tmp_path):
+        """Test that SWR mode serves the bundled page while S3 is fetched in the background."""
+        bundled = tmp_path / 'bundled.html'
+        bundled.write_text('<html>bundled</html>', encoding='utf-8')
+        mock_get_s3.return_value = make_page_s3()
+        config = dataclasses.replace(self.config, page_bundled_path=str(bundled), page_cache_swr=True)
+        
+        page, tier = lambda_handler.lookup_maintenance_page(config)
+        assert (page.body, tier) == ('<html>bundled</html>', 'bundled')
+        mock_get_s3.return_value.get_object.assert_not_called()
+        
+        mock_thread.call_args.kwargs['target']()
+        page, tier = lambda_handler.lookup_maintenance_page(config)
+        assert (page.body, tier) == ('<html>v1</html>', 'memory')
+    
+    @pytest.mark.parametrize('meta', [
+        b'not json',
+        b'["bucket", "key"]',
+        b'{"bucket": "b", "key": "k", "fetched_at": "yesterday"}',
+        b'{"bucket": "b", "key": "k", "fetched_at": [1]}',
+        b'{"bucket": "b", "key": "k", "etag": ["v1"]}',
+        b'{"bucket": "other", "key": "k"}',
+    ])
+    def test_corrupt_tmp_metadata_ignored(self, tmp_path, meta):
+        """Test that unreadable /tmp metadata is treated as a missing copy."""
+        config = dataclasses.replace(self.config, page_tmp_dir=str(tmp_path))
+        body_path, meta_path = lambda_handler.tmp_page_paths(str(tmp_path), 'b', 'k')
+        with open(body_path, 'wb') as f:
+            f.write(b'<html>v1</html>')
+        with open(meta_path, 'wb') as f:
+            f.write(meta)
+        
+        assert lambda_handler.load_tmp_page(config, 'b', 'k') is None
+    
+    def test_tmp_tier_disabled(self):
+        """Test that an empty PAGE_TMP_DIR disables the /tmp tier."""
+        config = lambda_handler.load_config({'PAGE_TMP_DIR': ''})
+        page = lambda_handler.CachedPage('<html></html>', '"v1"', 0.0)
+        
+        lambda_handler.save_tmp_page(config, 'b', 'k', page)
+        assert lambda_handler.load_tmp_page(config, 'b', 'k') is None
+
+
+class TestMultiTenantPages:
+    """Test cases for choosing the page by Host header and the byte-bounded cache."""
+    
+    def setup_method(self):
+        """Set up test fixtures."""
+        self.config = lambda_handler.load_config({
+            'S3_KEY_TEMPLATE': 'tenants/{host}/maintenance.html',
+            'S3_KEY_MAP': json.dumps({'Shop.Example.com': 'brands/shop.html'}),
+            'PAGE_TMP_DIR': ''
+        })
+        self.objects = {
+            'maintenance.html': b'<p>default</p>',
+            'brands/shop.html': b'<p>shop</p>',
+            'tenants/blog.example.com/maintenance.html': b'<p>blog</p>'
+        }
+        self.s3 = make_s3(self.objects)
+    
+    def event(self, host):
+        return {'path': '/', 'headers': {'host': host}}
+    
+    def test_resolve_s3_key(self):
+        """Test the mapping wins over the template, and bad hosts get the default."""
+        resolve = lambda host: lambda_handler.resolve_s3_key(self.event(host), self.config)
+        
+        assert resolve('shop.example.com:443') == 'brands/shop.html'
+        assert resolve('Blog.Example.com') == 'tenants/blog.example.com/maintenance.html'
+        assert resolve('../../etc') == 'maintenance.html'
+        assert resolve('') == 'maintenance.html'
+        assert lambda_handler.resolve_s3_key(self.event('shop.example.com'),
+                                             lambda_handler.load_config({})) == 'maintenance.html'
+    
+    @patch('lambda_handler.get_s3_client')
+    def test_pages_per_host(self, mock_get_s3):
+        """Test each host gets its own cached page."""
+        mock_get_s3.return_value = self.s3
+        
+        for host, expected in (('shop.example.com', 'shop'), ('blog.example.com', 'blog'),
+                               ('shop.example.com', 'shop')):
+            page = lambda_handler.lookup_tenant_page(self.event(host), self.config)[0]
+            assert page.body == f'<p>{expected}</p>'
+        
+        assert requested_keys(self.s3) == ['brands/shop.html', 'tenants/blog.example.com/maintenance.html']
+    
+    @patch('lambda_handler.get_s3_client')
+    def test_unknown_tenant_falls_back_to_default(self, mock_get_s3):
+        """Test a missing tenant page serves S3_KEY and is not refetched within the TTL."""
+        mock_get_s3.return_value = self.s3
+        
+        for _ in range(3):
+            page = lambda_handler.lookup_tenant_page(self.event('nobody.example.com'), self.config)[0]
+            assert page.body == '<p>default</p>'
+        
+        assert requested_keys(self.s3) == ['tenants/nobody.example.com/maintenance.html', 'maintenance.html']
+    
+    @patch('lambda_handler.get_s3_client')
+    def test_missing_hosts_evicted_lru(self, mock_get_s3, monkeypatch):
+        """Test a full negative cache evicts the least recently seen host, not every entry."""
+        mock_get_s3.return_value = self.s3
+        monkeypatch.setattr(lambda_handler, 'MISSING_PAGES_MAX', 3)
+        lookup = lambda host: lambda_handler.lookup_tenant_page(self.event(f'{host}.example.com'), self.config)
+        
+        for host in ('a', 'b', 'c', 'a', 'd'):
+            lookup(host)
+        
+        assert list(lambda_handler.missing_pages) == [
+            f'tenants/{host}.example.com/maintenance.html' for host in ('c', 'a', 'd')
+        ]
+        self.s3.get_object.reset_mock()
+        lookup('a')
+        lookup('c')
+        assert requested_keys(self.s3) == []
+    
+    @patch('lambda_handler.get_s3_client')
+    def test_concurrent_lookups(self, mock_get_s3, monkeypatch):
+        """Test the shared caches stay bounded when handler calls run on several threads."""
+        mock_get_s3.return_value = self.s3
+        monkeypatch.setattr(lambda_handler, 'MISSING_PAGES_MAX', 3)
+        
+        def work(i):
+            lambda_handler.lookup_tenant_page(self.event(f'host{i % 20}.example.com'), self.config)
+            return lambda_handler.get_compiled_template('<p>{{PATH}}</p>', f'"v{i % 20}"')
+        
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            templates = list(executor.map(work, range(400)))
+        
+        assert len(lambda_handler.missing_pages) == 3
+        assert all(f'"v{i}"' in lambda_handler.template_cache for i in range(20))
+        assert len(set(map(id, templates))) == 20
+    
+    def test_template_hosts(self):
+        """Test S3_KEY_TEMPLATE_HOSTS limits the template to the listed domains."""
+        config = dataclasses.replace(self.config, s3_key_template_hosts=('example.com',))
+        resolve = lambda host: lambda_handler.resolve_s3_key(self.event(host), config)
+        
+        assert resolve('blog.example.com') == 'tenants/blog.example.com/maintenance.html'
+        assert resolve('example.com') == 'tenants/example.com/maintenance.html'
+        assert resolve('example.com.evil.net') == 'maintenance.html'
+        assert resolve('badexample.com') == 'maintenance.html'
+        assert lambda_handler.load_config(
+            {'S3_KEY_TEMPLATE_HOSTS': '.Example.com, example.net'}
+        ).s3_key_template_hosts == ('example.com', 'example.net')
+    
+    def test_lru_bounded_by_bytes(self):
+        """Test the least recently used pages are evicted past the byte limit."""
+        cache = lambda_handler.PageLRU()
+        pages = {name: lambda_handler.CachedPage('x' * 1000, None, 0.0) for name in 'abc'}
+        limit = pages['a'].nbytes * 2
+        
+        cache.put(('b', 'a'), pages['a'], limit)
+        cache.put(('b', 'b'), pages['b'], limit)
+        cache.get(('b', 'a'))
+        cache.put(('b', 'c'), pages['c'], limit)
+        
+        assert ('b', 'a') in cache and ('b', 'c') in cache
+        assert ('b', 'b') not in cache
+        assert cache.total_bytes == limit
+        assert lambda_handler.get_page_cache_stats()['evictions'] == 1
+    
+    @patch('lambda_handler.get_s3_client')
+    def test_variants_charged_to_cache(self, mock_get_s3):
+        """Test compressed variants built after a page was stored count toward its size."""
+        mock_get_s3.return_value = self.s3
+        page = lambda_handler.lookup_tenant_page(self.event('shop.example.com'), self.config)[0]
+        stored = lambda_handler.page_cache.total_bytes
+        
+        variant = page.template.variant('gzip')
+        lambda_handler.lookup_tenant_page(self.event('shop.example.com'), self.config)
+        
+        assert variant.nbytes > 0
+        assert lambda_handler.page_cache.total_bytes == stored + variant.nbytes
+    
+    @patch('lambda_handler.get_s3_client')
+    def test_evicted_templates_released(self, mock_get_s3):
+        """Test the template cache does not keep the templates of evicted pages alive."""
+        mock_get_s3.return_value = self.s3
+        config = dataclasses.replace(self.config, page_cache_max_bytes=1)  # one page at a time
+        shop_key = (config.s3_bucket, 'brands/shop.html')
+        
+        lambda_handler.lookup_tenant_page(self.event('shop.example.com'), config)
+        etag = lambda_handler.page_cache.entries[shop_key].etag
+        assert etag in lambda_handler.template_cache
+        lambda_handler.lookup_tenant_page(self.event('blog.example.com'), config)
+        
+        assert shop_key not in lambda_handler.page_cache
+        assert etag not in lambda_handler.template_cache
+    
+    def test_invalid_settings(self):
+        """Test invalid tenant settings are rejected."""
+        with pytest.raises(lambda_handler.ConfigError):
+            lambda_handler.load_config({'S3_KEY_TEMPLATE': 'tenants/maintenance.html'})
+        with pytest.raises(lambda_handler.ConfigError):
+            lambda_handler.load_config({'S3_KEY_MAP': '["shop.html"]'})
+
+
+class TestLanguageNegotiation:
+    """Test cases for choosing the page language from Accept-Language."""
+    
+    LANGUAGES = ('en', 'zh-TW')
+    
+    def setup_method(self):
+        """Set up test fixtures."""
+        lambda_handler.negotiate_language.cache_clear()
+        self.config = lambda_handler.load_config({
+            'PAGE_LANGUAGES': 'en, zh-TW',
+            'PAGE_TMP_DIR': '',
+            'COMPRESSION_ENABLED': 'false'
+        })
+        self.objects = {
+            'maintenance.html': b'<p>ja {{PATH}}</p>',
+            'maintenance.en.html': b'<p>en {{PATH}}</p>'
+        }
+        self.s3 = make_s3(self.objects)
+    
+    def negotiate(self, header):
+        return lambda_handler.negotiate_language(header, self.LANGUAGES, 'ja')
+    
+    def test_q_values(self):
+        """Test ranges are tried by q-value, falling back to shorter tags."""
+        assert self.negotiate('ja-JP,ja;q=0.9,en-US;q=0.8,en;q=0.7') == 'ja'
+        assert self.negotiate('fr;q=1, en-GB;q=0.5, ja;q=0.4') == 'en'
+        assert self.negotiate('en;q=0.2, zh-tw;q=0.9') == 'zh-TW'
+        assert self.negotiate('zh-TW-x-private, en;q=0.1') == 'zh-TW'
+        assert self.negotiate('en;q=0, fr') == 'ja'
+        assert self.negotiate('*, en;q=0.5') == 'ja'
+        assert self.negotiate('en;q=oops') == 'ja'
+        assert self.negotiate(None) == 'ja'
+    
+    def test_memoized_per_header(self):
+        """Test repeated headers are answered from the memo."""
+        for _ in range(3):
+            self.negotiate('en-US,en;q=0.9')
+        
+        info = lambda_handler.negotiate_language.cache_info()
+        assert (info.hits, info.misses) == (2, 1)
+    
+    def test_language_key(self):
+        """Test variant keys insert the language before the extension."""
+        assert lambda_handler.language_key('maintenance.html', 'en') == 'maintenance.en.html'
+        assert lambda_handler.language_key('tenants/a.example.com/page', 'en') == 'tenants/a.example.com/page.en'
+    
+    @patch('lambda_handler.get_s3_client')
+    def test_serves_variant_with_headers(self, mock_get_s3):
+        """Test the English variant is served with Content-Language and Vary."""
+        mock_get_s3.return_value = self.s3
+        event = {'path': '/shop', 'headers': {'accept-language': 'en-US,en;q=0.9,ja;q=0.5'}}
+        
+        response = lambda_handler.get_maintenance_response(event, Mock(), self.config)
+        
+        assert response['body'] == '<p>en /shop</p>'
+        assert response['headers']['Content-Language'] == 'en'
+        assert response['headers']['Vary'] == 'Accept-Encoding, Accept-Language'
+    
+    @patch('lambda_handler.get_s3_client')
+    def test_missing_variant_falls_back_to_default(self, mock_get_s3):
+        """Test a missing translation serves the default page and is not refetched."""
+        mock_get_s3.return_value = self.s3
+        event = {'path': '/', 'headers': {'accept-language': 'zh-TW'}}
+        
+        for _ in range(2):
+            response = lambda_handler.get_maintenance_response(event, Mock(), self.config)
+            assert response['body'] == '<p>ja /</p>'
+            assert response['headers']['Content-Language'] == 'ja'
+        
+        assert requested_keys(self.s3) == ['maintenance.zh-TW.html', 'maintenance.html']
+    
+    def test_invalid_language_tag(self):
+        """Test malformed language tags are rejected."""
+        with pytest.raises(lambda_handler.ConfigError):
+            lambda_handler.load_config({'PAGE_LANGUAGES': 'en,../x'})
+
+
+class TestTemplateCompilation:
+    """Test cases for the compiled template engine."""
+    
+    def test_compile_splits_literals_and_slots(self):
+        """Test that a template compiles into alternating literals and slots."""
+        template = lambda_handler.compile_template('<p>{{PATH}}</p><p>{{HOST}}</p>')
+        
+        assert template.parts == ['<p>', 'PATH', '</p><p>', 'HOST', '</p>']
+        assert template.slots == frozenset(['PATH', 'HOST'])
+    
+    def test_unknown_placeholder_rejected_at_compile_time(self):
+        """Test that unknown placeholders are reported instead of left in the output."""
+        with pytest.raises(lambda_handler.TemplateError, match='NOPE'):
+            lambda_handler.compile_template('a {{NOPE}} b {{PATH}} c')
+    
+    def test_only_used_resolvers_run(self):
+        """Test that resolvers run only for slots present in the template."""
+        context = Mock(request_id='req', function_name='func')
+        
+        with patch.dict(lambda_handler.PLACEHOLDER_RESOLVERS, {'TIMESTAMP': Mock()}) as resolvers:
+            template = lambda_handler.compile_template('{{PATH}} {{PATH}}')
+            assert template.render({'path': '/x'}, context) == '/x /x'
+            resolvers['TIMESTAMP'].assert_not_called()
+    
+    def test_custom_placeholder(self):
+        """Test that registered placeholders are resolved lazily."""
+        resolver = Mock(return_value='ja')
+        with patch.dict(lambda_handler.PLACEHOLDER_RESOLVERS):
+            lambda_handler.placeholder('LANG')(resolver)
+            template = lambda_handler.compile_template('<html lang="{{LANG}}">')
+            
+            assert template.render({}, Mock()) == '<html lang="ja">'
+            resolver.assert_called_once()
+    
+    def test_compiled_template_reused_per_etag(self):
+        """Test that a page version is parsed only once."""
+        first = lambda_handler.get_compiled_template('<p>{{PATH}}</p>', '"v1"')
+        second = lambda_handler.get_compiled_template('<p>{{PATH}}</p>', '"v1"')
+        third = lambda_handler.get_compiled_template('<p>{{HOST}}</p>', '"v2"')
+        
+        assert first is second
+        assert third is not first
+    
+    @patch('lambda_handler.compile_template', wraps=lambda_handler.compile_template)
+    @patch('lambda_handler.get_s3_client')
+    def test_page_compiled_once_across_requests(self, mock_get_s3, mock_compile):
+        """Test that cached pages are not recompiled on every request."""
+        mock_s3 = Mock()
+        mock_get_s3.return_value = mock_s3
+        mock_s3.get_object.return_value = {
+            'Body': MagicMock(read=lambda: b'<html>{{PATH}}</html>'),
+            'ETag': '"v1"'
+        }
+        context = Mock(request_id='req', function_name='func')
+        config = lambda_handler.load_config({'S3_BUCKET': 'b', 'S3_KEY': 'k'})
+        
+        for path in ('/a', '/b', '/c'):
+            response = lambda_handler.get_maintenance_response({'path': path}, context, config)
+            assert response['body'] == '<html>' + path + '</html>'
+        
+        assert mock_compile.call_count == 1
+
+
+class TestCompression:
+    """Test cases for precompressed maintenance page variants."""
+    
+    def setup_method(self):
+        """Set up test fixtures."""
+        self.mock_context = Mock()
+        self.mock_context.request_id = 'req-\u3042-123'
+        self.mock_context.function_name = 'test-func'
+        self.event = {'path': '/p', 'headers': {'host': 'example.com'}}
+        self.html = '<html>' + 'メンテナンス中 ' * 200 + '{{REQUEST_ID}} {{PATH}}{{PATH}} {{HOST}}</html>'
+    
+    @pytest.mark.parametrize('encoding, decompress', [
+        ('gzip', gzip.decompress),
+        ('deflate', zlib.decompress),
+    ])
+    def test_variant_round_trip(self, encoding, decompress):
+        """Test that spliced compressed variants decode to the rendered page."""
+        template = lambda_handler.compile_template(self.html)
+        body = template.variant(encoding).render(self.event, self.mock_context)
+        
+        expected = template.render(self.event, self.mock_context)
+        assert decompress(base64.b64decode(body)).decode('utf-8') == expected
+    
+    @pytest.mark.parametrize('html', ['', 'static only', '{{PATH}}', 'x' * 70000 + '{{PATH}}'])
+    def test_variant_edge_cases(self, html):
+        """Test empty, slot-free, slot-only and large templates."""
+        template = lambda_handler.compile_template(html)
+        event = {'path': '/' + 'y' * 70000}
+        
+        for encoding, decompress in (('gzip', gzip.decompress), ('deflate', zlib.decompress)):
+            body = template.variant(encoding).render(event, self.mock_context)
+            assert decompress(base64.b64decode(body)).decode('utf-8') == template.render(event, self.mock_context)
+    
+    def test_variant_bases_are_abstract(self):
+        """Test that the encoded template bases cannot be used without their hooks."""
+        template = lambda_handler.compile_template(self.html)
+        
+        for base in (lambda_handler.EncodedTemplate, lambda_handler.DeflateStreamTemplate):
+            with pytest.raises(TypeError):
+                base(template)
+    
+    def test_variant_built_once(self):
+        """Test that static parts are compressed once per template."""
+        template = lambda_handler.compile_template(self.html)
+        
+        assert template.variant('gzip') is template.variant('gzip')
+    
+    @pytest.mark.parametrize('header, expected', [
+        (None, None),
+        ('', None),
+        ('gzip, deflate', 'gzip'),
+        ('deflate', 'deflate'),
+        ('gzip;q=0.5, deflate', 'deflate'),
+        ('gzip;q=0, identity', None),
+        ('*', lambda_handler.ENCODING_PREFERENCE[0]),
+        ('identity', None),
+    ])
+    def test_negotiate_encoding(self, header, expected):
+        """Test Accept-Encoding negotiation with q-values."""
+        assert lambda_handler.negotiate_encoding(header) == expected
+    
+    def test_br_only_for_slot_free_pages(self, monkeypatch):
+        """Test that pages with slots prefer the spliced gzip/deflate variants over br."""
+        monkeypatch.setattr(lambda_handler, 'STATIC_ENCODING_PREFERENCE', ('br', 'gzip', 'deflate'))
+        lambda_handler.negotiate_encoding.cache_clear()
+        try:
+            assert lambda_handler.negotiate_encoding('gzip, deflate, br', True) == 'br'
+            assert lambda_handler.negotiate_encoding('gzip, deflate, br') == 'gzip'
+            assert lambda_handler.negotiate_encoding('br') is None
+        finally:
+            lambda_handler.negotiate_encoding.cache_clear()
+    
+    @patch.dict(os.environ, {'S3_BUCKET': 'test-bucket', 'S3_KEY': 'test.html'})
+    @patch('lambda_handler.get_s3_client')
+    def test_maintenance_response_gzip(self, mock_get_s3):
+        """Test that the maintenance page is gzip-encoded when the client accepts it."""
+        mock_s3 = Mock()
+        mock_get_s3.return_value = mock_s3
+        mock_s3.get_object.return_value = {
+            'Body': MagicMock(read=lambda: self.html.encode('utf-8')),
+            'ETag': '"v1"'
+        }
+        self.event['headers']['accept-encoding'] = 'gzip, deflate'
+        
+        response = lambda_handler.get_maintenance_response(self.event, self.mock_context)
+        
+        assert response['isBase64Encoded'] is True
+        assert response['headers']['Content-Encoding'] == 'gzip'
+        assert response['headers']['Vary'] == 'Accept-Encoding'
+        html = gzip.decompress(base64.b64decode(response['body'])).decode('utf-8')
+        assert 'req-\u3042-123' in html
+        assert '/p/p' in html
+    
+    @patch.dict(os.environ, {'S3_BUCKET': 'test-bucket', 'S3_KEY': 'test.html', 'COMPRESSION_ENABLED': 'false'})
+    @patch('lambda_handler.get_s3_client')
+    def test_compression_disabled(self, mock_get_s3):
+        """Test that compression can be switched off."""
+        mock_s3 = Mock()
+        mock_get_s3.return_value = mock_s3
+        mock_s3.get_object.return_value = {
+            'Body': MagicMock(read=lambda: b'<html>{{PATH}}</html>')
+        }
+        self.event['headers']['accept-encoding'] = 'gzip'
+        
+        response = lambda_handler.get_maintenance_response(self.event, self.mock_context)
+        
+        assert response['isBase64Encoded'] is False
+        assert 'Content-Encoding' not in response['headers']
+        assert response['body'] == '<html>/p</html>'
+
+
 class TestMaintenanceResponse:
     """Test cases for maintenance response generation."""
     
@@ -225,6 +968,474 @@ class TestMaintenanceResponse:
         assert 'text/html' in response['headers']['Content-Type']
 
 
+class TestConfig:
+    """Test cases for the configuration snapshot."""
+    
+    def test_defaults(self):
+        """Test default values when no variables are set."""
+        config = lambda_handler.load_config({})
+        
+        assert config.maintenance_mode is True
+        assert config.s3_bucket == 'maintenance-pages'
+        assert config.s3_key == 'maintenance.html'
+        assert config.special_routes.lookup('/special/x').arn == ''
+        assert config.page_cache_ttl == 60.0
+    
+    @pytest.mark.parametrize('env', [
+        {'MAINTENANCE_MODE': 'maybe'},
+        {'PAGE_CACHE_TTL': 'soon'},
+        {'PAGE_CACHE_TTL': '-1'},
+        {'S3_BUCKET': ''},
+        {'CLIENT_RETRY_MODE': 'aggressive'},
+        {'CLIENT_MAX_ATTEMPTS': '0'},
+        {'S3_READ_TIMEOUT': 'fast'},
+    ])
+    def test_invalid_values_rejected(self, env):
+        """Test that invalid settings fail when the snapshot is parsed."""
+        with pytest.raises(lambda_handler.ConfigError):
+            lambda_handler.load_config(env)
+    
+    def test_immutable(self):
+        """Test that the snapshot cannot be modified in place."""
+        config = lambda_handler.load_config({})
+        
+        with pytest.raises(AttributeError):
+            config.maintenance_mode = False
+        assert dataclasses.replace(config, maintenance_mode=False).maintenance_mode is False
+        assert config.maintenance_mode is True
+    
+    def test_snapshot_parsed_once(self):
+        """Test that get_config only reads the environment until reloaded."""
+        with patch.dict(os.environ, {'MAINTENANCE_MODE': 'true'}):
+            first = lambda_handler.get_config()
+        with patch.dict(os.environ, {'MAINTENANCE_MODE': 'false'}):
+            assert lambda_handler.get_config() is first
+            assert lambda_handler.reload_config().maintenance_mode is False
+
+
+class TestClients:
+    """Test cases for AWS client construction."""
+    
+    def teardown_method(self):
+        """Drop clients built with mocked settings."""
+        lambda_handler.s3_client = None
+        lambda_handler.lambda_client = None
+    
+    @patch.dict(os.environ, {
+        'CLIENT_CONNECT_TIMEOUT': '1.5',
+        'S3_READ_TIMEOUT': '2',
+        'LAMBDA_READ_TIMEOUT': '20',
+        'CLIENT_RETRY_MODE': 'standard',
+        'CLIENT_MAX_ATTEMPTS': '4',
+        'CLIENT_TCP_KEEPALIVE': 'false',
+        'CLIENT_MAX_POOL_CONNECTIONS': '25'
+    })
+    @patch('boto3.client')
+    def test_clients_use_configured_settings(self, mock_client):
+        """Test that both clients are built from the configured botocore settings."""
+        lambda_handler.s3_client = None
+        lambda_handler.lambda_client = None
+        
+        lambda_handler.get_s3_client()
+        lambda_handler.get_lambda_client()
+        
+        s3_config = mock_client.call_args_list[0].kwargs['config']
+        lambda_config = mock_client.call_args_list[1].kwargs['config']
+        assert mock_client.call_args_list[0].args == ('s3',)
+        assert s3_config.connect_timeout == 1.5
+        assert s3_config.read_timeout == 2.0
+        assert s3_config.retries == {'mode': 'standard', 'total_max_attempts': 4}
+        assert s3_config.tcp_keepalive is False
+        assert s3_config.max_pool_connections == 25
+        assert lambda_config.read_timeout == 20.0
+        assert lambda_config.retries == {'mode': 'standard', 'total_max_attempts': 1}
+    
+    @pytest.mark.parametrize('env', [
+        {'S3_READ_TIMEOUT': '8', 'CLIENT_MAX_ATTEMPTS': '3'},
+        {'LAMBDA_READ_TIMEOUT': '28'},
+        {'LAMBDA_READ_TIMEOUT': '10', 'FUNCTION_TIMEOUT': '12'},
+    ])
+    def test_timeouts_must_fit_function_timeout(self, env):
+        """Test that client timeouts that could outlast the function timeout are rejected."""
+        with pytest.raises(lambda_handler.ConfigError, match='FUNCTION_TIMEOUT'):
+            lambda_handler.load_config(env)
+
+
+class FakeS3Handler(http.server.BaseHTTPRequestHandler):
+    """Local S3 stand-in serving path-style GetObject with ETags."""
+    
+    protocol_version = 'HTTP/1.1'
+    objects = {}
+    requests = []
+    
+    def do_GET(self):
+        self.requests.append((self.path, dict(self.headers)))
+        if not self.headers.get('Authorization', '').startswith('AWS4-HMAC-SHA256 Credential=AKIDEXAMPLE/'):
+            return self.reply(403, b'<Error><Code>AccessDenied</Code></Error>')
+        obj = self.objects.get(urllib.parse.unquote(self.path))
+        if obj is None:
+            return self.reply(404, b'<Error><Code>NoSuchKey</Code></Error>')
+        body, etag = obj
+        if self.headers.get('If-None-Match') == etag:
+            return self.reply(304, b'', etag)
+        return self.reply(200, body, etag)
+    
+    def reply(self, status, body, etag=None):
+        self.send_response(status)
+        if etag:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, *args):
+        pass
+
+
+class TestLightweightS3Client:
+    """Test cases for the SigV4 S3 reader."""
+    
+    def setup_method(self):
+        """Start a local S3 stand-in."""
+        FakeS3Handler.objects = {'/test-bucket/pages/maintenance.html': (b'<html>{{PATH}}</html>', '"v1"')}
+        FakeS3Handler.requests = []
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FakeS3Handler)
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        self.endpoint = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.env = patch.dict(os.environ, {
+            'AWS_REGION': 'us-east-1',
+            'AWS_ACCESS_KEY_ID': 'AKIDEXAMPLE',
+            'AWS_SECRET_ACCESS_KEY': 'wJalrXUtnFEMI/K7MDENG+bPxRfiCYEXAMPLEKEY',
+            'AWS_SESSION_TOKEN': 'session-token'
+        })
+        self.env.start()
+    
+    def teardown_method(self):
+        """Stop the stand-in."""
+        self.env.stop()
+        self.server.shutdown()
+        self.server.server_close()
+        lambda_handler.s3_client = None
+    
+    def test_signature_matches_botocore(self):
+        """Test the SigV4 signature against botocore's signer."""
+        from botocore.auth import S3SigV4Auth
+        from botocore.awsrequest import AWSRequest
+        from botocore.credentials import Credentials
+        
+        headers = lambda_handler.sigv4_headers(
+            'GET', 'examplebucket.s3.amazonaws.com', '/a%20b/test.txt', 'us-east-1',
+            'AKIDEXAMPLE', 'secret', 'token', amz_date='20260101T000000Z'
+        )
+        request = AWSRequest(method='GET', url='https://examplebucket.s3.amazonaws.com/a%20b/test.txt', headers={
+            name: value for name, value in headers.items() if name != 'authorization'
+        })
+        request.context['timestamp'] = '20260101T000000Z'
+        auth = S3SigV4Auth(Credentials('AKIDEXAMPLE', 'secret', 'token'), 's3', 'us-east-1')
+        expected = auth.signature(auth.string_to_sign(request, auth.canonical_request(request)), request)
+        
+        assert headers['authorization'].endswith('Signature=' + expected)
+    
+    def test_get_object_and_conditional_get(self):
+        """Test plain and conditional GETs over one pooled connection."""
+        client = lambda_handler.LightweightS3Client(endpoint_url=self.endpoint)
+        
+        response = client.get_object(Bucket='test-bucket', Key='pages/maintenance.html')
+        assert response['Body'].read() == b'<html>{{PATH}}</html>'
+        assert response['ETag'] == '"v1"'
+        
+        with pytest.raises(lambda_handler.S3Error) as excinfo:
+            client.get_object(Bucket='test-bucket', Key='pages/maintenance.html', IfNoneMatch='"v1"')
+        assert lambda_handler.is_not_modified(excinfo.value)
+        assert len(client.connections) == 1
+        assert FakeS3Handler.requests[0][1]['x-amz-security-token'] == 'session-token'
+    
+    def test_get_object_error(self):
+        """Test that S3 error codes are surfaced."""
+        client = lambda_handler.LightweightS3Client(endpoint_url=self.endpoint)
+        
+        with pytest.raises(lambda_handler.S3Error) as excinfo:
+            client.get_object(Bucket='test-bucket', Key='missing.html')
+        assert excinfo.value.response['Error']['Code'] == 'NoSuchKey'
+        assert not lambda_handler.is_not_modified(excinfo.value)
+    
+    def test_maintenance_page_via_sigv4_fetcher(self):
+        """Test the page cache end to end with S3_FETCHER=sigv4."""
+        config = lambda_handler.reload_config({
+            'S3_FETCHER': 'sigv4',
+            'S3_ENDPOINT_URL': self.endpoint,
+            'S3_BUCKET': 'test-bucket',
+            'S3_KEY': 'pages/maintenance.html',
+            'PAGE_CACHE_TTL': '0'
+        })
+        lambda_handler.s3_client = None
+        context = Mock(request_id='req', function_name='func')
+        
+        first = lambda_handler.get_maintenance_response({'path': '/a'}, context, config)
+        second = lambda_handler.get_maintenance_response({'path': '/b'}, context, config)
+        
+        assert isinstance(lambda_handler.s3_client, lambda_handler.LightweightS3Client)
+        assert first['body'] == '<html>/a</html>'
+        assert second['body'] == '<html>/b</html>'
+        assert lambda_handler.get_page_cache_stats()['not_modified'] == 1
+
+
+class TestWarmup:
+    """Test cases for the INIT-phase warmup."""
+    
+    @patch('lambda_handler.get_lambda_client')
+    @patch('lambda_handler.get_s3_client')
+    def test_warmup_prefetches_page(self, mock_get_s3, mock_get_lambda):
+        """Test that warmup builds clients and loads the compiled page into the cache."""
+        mock_s3 = Mock()
+        mock_get_s3.return_value = mock_s3
+        mock_s3.get_object.return_value = {
+            'Body': MagicMock(read=lambda: b'<html>{{PATH}}</html>'),
+            'ETag': '"v1"'
+        }
+        config = lambda_handler.load_config({'S3_BUCKET': 'b', 'S3_KEY': 'k', 'SPECIAL_LAMBDA_ARN': 'arn'})
+        
+        result = lambda_handler.run_warmup(config, timeout=5)
+        
+        assert result['timed_out'] is False
+        assert result['steps'] == ['s3_client', 'lambda_client', 'page', 'gzip']
+        mock_get_lambda.assert_called_once()
+        lambda_handler.fetch_maintenance_page(config)
+        assert lambda_handler.get_page_cache_stats()['hits'] == 1
+    
+    @patch('lambda_handler.get_s3_client')
+    def test_warmup_failure_is_reported(self, mock_get_s3):
+        """Test that warmup errors are recorded instead of raised."""
+        mock_get_s3.return_value.get_object.side_effect = Exception('S3 down')
+        config = lambda_handler.load_config({})
+        
+        result = lambda_handler.run_warmup(config, timeout=5)
+        
+        assert result['error'] == 'S3 down'
+        assert result['steps'] == ['s3_client']
+    
+    @patch('lambda_handler.get_s3_client')
+    def test_warmup_respects_budget(self, mock_get_s3):
+        """Test that a slow warmup does not hold up INIT past its budget."""
+        release = threading.Event()
+        mock_get_s3.side_effect = lambda: release.wait(5)
+        config = lambda_handler.load_config({})
+        
+        try:
+            result = lambda_handler.run_warmup(config, timeout=0.05)
+            assert result['timed_out'] is True
+        finally:
+            release.set()
+
+
+class TestPageCache:
+    """Test cases for the per-sandbox maintenance page cache."""
+    
+    def setup_method(self):
+        """Set up test fixtures."""
+        self.config = lambda_handler.load_config({'S3_BUCKET': 'test-bucket', 'S3_KEY': 'test.html'})
+    
+    @patch('lambda_handler.get_s3_client')
+    def test_hit_within_ttl(self, mock_get_s3):
+        """Test that a fresh entry is served without calling S3."""
+        mock_s3 = make_page_s3()
+        mock_get_s3.return_value = mock_s3
+        
+        assert lambda_handler.fetch_maintenance_page(self.config).body == '<html>v1</html>'
+        assert lambda_handler.fetch_maintenance_page(self.config).body == '<html>v1</html>'
+        
+        mock_s3.get_object.assert_called_once_with(Bucket='test-bucket', Key='test.html')
+        stats = lambda_handler.get_page_cache_stats()
+        assert stats['misses'] == 1
+        assert stats['hits'] == 1
+    
+    @patch('lambda_handler.time.monotonic')
+    @patch('lambda_handler.get_s3_client')
+    def test_revalidate_not_modified(self, mock_get_s3, mock_monotonic):
+        """Test that an expired entry is kept when S3 answers 304."""
+        mock_s3 = make_page_s3()
+        mock_get_s3.return_value = mock_s3
+        mock_monotonic.return_value = 1000.0
+        lambda_handler.fetch_maintenance_page(self.config)
+        
+        not_modified = Exception('Not Modified')
+        not_modified.response = {'Error': {'Code': '304'}, 'ResponseMetadata': {'HTTPStatusCode': 304}}
+        mock_s3.get_object.side_effect = not_modified
+        mock_monotonic.return_value = 1100.0
+        
+        assert lambda_handler.fetch_maintenance_page(self.config).body == '<html>v1</html>'
+        mock_s3.get_object.assert_called_with(Bucket='test-bucket', Key='test.html', IfNoneMatch='"v1"')
+        stats = lambda_handler.get_page_cache_stats()
+        assert stats['revalidations'] == 1
+        assert stats['not_modified'] == 1
+        
+        # The TTL restarts after a successful revalidation
+        mock_monotonic.return_value = 1150.0
+        lambda_handler.fetch_maintenance_page(self.config)
+        assert lambda_handler.get_page_cache_stats()['hits'] == 1
+    
+    @patch('lambda_handler.time.monotonic')
+    @patch('lambda_handler.get_s3_client')
+    def test_revalidate_modified(self, mock_get_s3, mock_monotonic):
+        """Test that a changed object replaces the cached copy."""
+        mock_get_s3.return_value = make_page_s3()
+        mock_monotonic.return_value = 1000.0
+        lambda_handler.fetch_maintenance_page(self.config)
+        
+        mock_get_s3.return_value = make_page_s3(b'<html>v2</html>', '"v2"')
+        mock_monotonic.return_value = 1100.0
+        
+        assert lambda_handler.fetch_maintenance_page(self.config).body == '<html>v2</html>'
+    
+    @patch('lambda_handler.get_s3_client')
+    def test_cache_disabled(self, mock_get_s3):
+        """Test that every call goes to S3 when the cache is disabled."""
+        mock_s3 = make_page_s3()
+        mock_get_s3.return_value = mock_s3
+        self.config = dataclasses.replace(self.config, page_cache_enabled=False)
+        
+        lambda_handler.fetch_maintenance_page(self.config)
+        lambda_handler.fetch_maintenance_page(self.config)
+        
+        assert mock_s3.get_object.call_count == 2
+        assert lambda_handler.get_page_cache_stats()['hits'] == 0
+    
+    @patch('lambda_handler.threading.Thread')
+    @patch('lambda_handler.time.monotonic')
+    @patch('lambda_handler.get_s3_client')
+    def test_stale_while_revalidate(self, mock_get_s3, mock_monotonic, mock_thread):
+        """Test that a stale entry is served at once while one refresh runs in the background."""
+        mock_get_s3.return_value = make_page_s3()
+        self.config = dataclasses.replace(self.config, page_cache_swr=True)
+        mock_monotonic.return_value = 1000.0
+        lambda_handler.fetch_maintenance_page(self.config)
+        
+        mock_get_s3.return_value = make_page_s3(b'<html>v2</html>', '"v2"')
+        mock_monotonic.return_value = 1100.0
+        
+        assert lambda_handler.fetch_maintenance_page(self.config).body == '<html>v1</html>'
+        assert lambda_handler.fetch_maintenance_page(self.config).body == '<html>v1</html>'
+        mock_thread.assert_called_once()
+        mock_get_s3.return_value.get_object.assert_not_called()
+        
+        # Run the background refresh; later requests see the new version
+        mock_thread.call_args.kwargs['target']()
+        assert lambda_handler.fetch_maintenance_page(self.config).body == '<html>v2</html>'
+        stats = lambda_handler.get_page_cache_stats()
+        assert stats['stale_hits'] == 2
+        assert stats['background_refreshes'] == 1
+    
+    @patch('lambda_handler.time.monotonic')
+    @patch('lambda_handler.get_s3_client')
+    def test_max_stale_refreshes_synchronously(self, mock_get_s3, mock_monotonic):
+        """Test that entries past the max-staleness bound are refetched in the request path."""
+        mock_get_s3.return_value = make_page_s3()
+        self.config = dataclasses.replace(self.config, page_cache_swr=True)
+        mock_monotonic.return_value = 1000.0
+        lambda_handler.fetch_maintenance_page(self.config)
+        
+        mock_get_s3.return_value = make_page_s3(b'<html>v2</html>', '"v2"')
+        mock_monotonic.return_value = 1000.0 + 60 + 3600 + 1
+        
+        assert lambda_handler.fetch_maintenance_page(self.config).body == '<html>v2</html>'
+    
+    @patch('lambda_handler.time.monotonic')
+    @patch('lambda_handler.get_s3_client')
+    def test_stale_copy_served_when_s3_fails(self, mock_get_s3, mock_monotonic):
+        """Test that a previously loaded page is preferred over the generic fallback."""
+        mock_s3 = make_page_s3()
+        mock_get_s3.return_value = mock_s3
+        self.config = dataclasses.replace(self.config, page_cache_swr=True)
+        mock_monotonic.return_value = 1000.0
+        lambda_handler.fetch_maintenance_page(self.config)
+        
+        mock_s3.get_object.side_effect = Exception('S3 down')
+        mock_monotonic.return_value = 1000.0 + 60 + 3600 + 1
+        
+        assert lambda_handler.fetch_maintenance_page(self.config).body == '<html>v1</html>'
+        assert lambda_handler.get_page_cache_stats()['refresh_errors'] == 1
+
+    @patch('lambda_handler.time.monotonic')
+    @patch('lambda_handler.get_s3_client')
+    def test_broken_version_keeps_last_good_page(self, mock_get_s3, mock_monotonic, tmp_path):
+        """Test that a new version with an unknown placeholder never replaces the cached page."""
+        self.config = dataclasses.replace(self.config, page_tmp_dir=str(tmp_path))
+        mock_get_s3.return_value = make_page_s3(b'<p>{{PATH}}</p>')
+        mock_monotonic.return_value = 1000.0
+        lambda_handler.fetch_maintenance_page(self.config)
+        
+        broken_s3 = make_page_s3(b'<p>{{SUPPORT_EMAIL}}</p>', '"v2"')
+        mock_get_s3.return_value = broken_s3
+        mock_monotonic.return_value = 1100.0
+        
+        with patch.object(lambda_handler.logger, 'warning') as mock_warning:
+            page = lambda_handler.fetch_maintenance_page(self.config)
+        assert page.template.render({'path': '/x'}, Mock()) == '<p>/x</p>'
+        mock_warning.assert_called_once()
+        assert lambda_handler.get_page_cache_stats()['template_errors'] == 1
+        
+        # Not refetched before the TTL expires, and /tmp still holds the good copy
+        mock_monotonic.return_value = 1150.0
+        assert lambda_handler.fetch_maintenance_page(self.config).body == '<p>{{PATH}}</p>'
+        assert broken_s3.get_object.call_count == 1
+        lambda_handler.clear_page_cache()
+        assert lambda_handler.fetch_maintenance_page(self.config).body == '<p>{{PATH}}</p>'
+    
+    @patch('lambda_handler.get_s3_client')
+    def test_broken_first_version_served_as_fallback(self, mock_get_s3):
+        """Test that a page that never compiled is logged and answered with the fallback."""
+        mock_get_s3.return_value = make_page_s3(b'<p>{{SUPPORT_EMAIL}}</p>')
+        
+        with patch.object(lambda_handler.logger, 'error') as mock_error:
+            response = lambda_handler.get_maintenance_response({'path': '/'}, Mock(), self.config)
+        
+        assert response == lambda_handler.RESPONSE_CATALOG['fallback'].render()
+        assert 'SUPPORT_EMAIL' in mock_error.call_args.args[1]
+
+
+class TestJsonBackend:
+    """Test cases for the pluggable JSON backend and response validation."""
+    
+    def test_stdlib_backend(self):
+        """Test the stdlib backend produces compact UTF-8 JSON."""
+        backend = lambda_handler.load_config({'JSON_BACKEND': 'stdlib'}).json
+        
+        assert backend.name == 'stdlib'
+        assert backend.dumps({'a': [1, 'メンテ']}) == '{"a":[1,"メンテ"]}'.encode('utf-8')
+        assert backend.loads(b'{"a": 1}') == {'a': 1}
+    
+    def test_auto_backend_prefers_orjson(self):
+        """Test that auto picks orjson when it is installed."""
+        orjson = pytest.importorskip('orjson')
+        backend = lambda_handler.load_config({}).json
+        
+        assert backend.name == 'orjson'
+        assert backend.loads(backend.dumps({'a': 'メンテ'})) == {'a': 'メンテ'}
+    
+    def test_orjson_required_but_missing(self):
+        """Test that an explicit orjson backend fails at config load when unavailable."""
+        with patch.dict(sys.modules, {'orjson': None}):
+            with pytest.raises(lambda_handler.ConfigError):
+                lambda_handler.load_config({'JSON_BACKEND': 'orjson'})
+            assert lambda_handler.load_config({}).json.name == 'stdlib'
+    
+    @pytest.mark.parametrize('payload, valid', [
+        ({'statusCode': 200}, True),
+        ({'statusCode': 200, 'headers': {}, 'body': 'x' * 100000, 'isBase64Encoded': False}, True),
+        ({'statusCode': '200'}, False),
+        ({'statusCode': True}, False),
+        ({'statusCode': 700}, False),
+        ({'statusCode': 200, 'body': {'nested': True}}, False),
+        ({'statusCode': 200, 'headers': []}, False),
+        ({'statusCode': 200, 'isBase64Encoded': 'no'}, False),
+        ({'errorMessage': 'boom'}, False),
+        ([], False),
+    ])
+    def test_validate_alb_response(self, payload, valid):
+        """Test the top-level ALB response checks."""
+        assert (lambda_handler.validate_alb_response(payload) is None) == valid
+
+
 class TestSpecialLambdaInvocation:
     """Test cases for special Lambda invocation."""
     
@@ -285,6 +1496,460 @@ class TestSpecialLambdaInvocation:
         
         assert response['statusCode'] == 500
         assert 'Error invoking special Lambda' in response['body']
+    
+    @patch.dict(os.environ, {
+        'SPECIAL_LAMBDA_ARN': 'arn:aws:lambda:us-east-1:123456789012:function:special'
+    })
+    @patch('lambda_handler.get_lambda_client')
+    def test_invoke_special_lambda_invalid_response(self, mock_get_lambda):
+        """Test that malformed or failed special Lambda responses become 502."""
+        mock_lambda_client = Mock()
+        mock_get_lambda.return_value = mock_lambda_client
+        
+        mock_lambda_client.invoke.return_value = {
+            'Payload': MagicMock(read=lambda: b'{"body": "missing status"}')
+        }
+        response = lambda_handler.invoke_special_lambda(self.sample_event, self.mock_context)
+        assert response['statusCode'] == 502
+        assert 'statusCode' in response['body']
+        
+        mock_lambda_client.invoke.return_value = {
+            'FunctionError': 'Unhandled',
+            'Payload': MagicMock(read=lambda: b'{"errorMessage": "boom"}')
+        }
+        response = lambda_handler.invoke_special_lambda(self.sample_event, self.mock_context)
+        assert response['statusCode'] == 502
+        assert 'Unhandled' in response['body']
+    
+    @patch.dict(os.environ, {
+        'SPECIAL_ROUTES': json.dumps([{
+            'path': '/special',
+            'arn': 'arn:aws:lambda:us-east-1:123456789012:function:webhook',
+            'invocation_type': 'Event'
+        }])
+    })
+    @patch('lambda_handler.get_lambda_client')
+    def test_invoke_special_lambda_event(self, mock_get_lambda):
+        """Test that Event routes are acknowledged with 202 without reading a payload."""
+        mock_lambda_client = Mock()
+        mock_get_lambda.return_value = mock_lambda_client
+        mock_lambda_client.invoke.return_value = {'StatusCode': 202, 'Payload': MagicMock()}
+        
+        response = lambda_handler.invoke_special_lambda(self.sample_event, self.mock_context)
+        
+        assert response['statusCode'] == 202
+        assert json.loads(response['body']) == {'message': 'Accepted'}
+        assert mock_lambda_client.invoke.call_args.kwargs['InvocationType'] == 'Event'
+        mock_lambda_client.invoke.return_value['Payload'].read.assert_not_called()
+
+
+class TestCircuitBreaker:
+    """Test cases for the per-ARN circuit breaker around special Lambda calls."""
+    
+    ARN = 'arn:aws:lambda:us-east-1:123456789012:function:special'
+    
+    def setup_method(self):
+        """Set up test fixtures."""
+        self.event = {'path': '/special/endpoint', 'httpMethod': 'GET', 'headers': {}}
+        self.context = Mock(request_id='test-req', function_name='main-func',
+                            function_version='1', memory_limit_in_mb=256)
+        self.config = lambda_handler.load_config({
+            'SPECIAL_LAMBDA_ARN': self.ARN,
+            'BREAKER_ENABLED': 'true',
+            'BREAKER_MIN_REQUESTS': '2',
+            'BREAKER_OPEN_DURATION': '60'
+        })
+    
+    def make_breaker(self, **overrides):
+        options = dict(window=30, min_requests=4, error_rate=0.5, slow_call=1.0,
+                       open_duration=10, half_open_probes=1)
+        options.update(overrides)
+        return lambda_handler.CircuitBreaker('test', **options)
+    
+    def invoke(self):
+        route = lambda_handler.match_special_route('/special/endpoint', self.config)
+        return lambda_handler.invoke_special_lambda(self.event, self.context, self.config, route)
+    
+    def test_trips_on_error_rate(self):
+        """Test the breaker opens once enough calls fail."""
+        breaker = self.make_breaker()
+        for success in (True, False, True):
+            assert breaker.allow_request()
+            breaker.record(success, 0.01)
+        assert breaker.state == 'closed'
+        breaker.record(False, 0.01)
+        
+        assert breaker.state == 'open'
+        assert not breaker.allow_request()
+        assert breaker.stats() == {'state': 'open', 'trips': 1, 'rejected': 1}
+    
+    def test_slow_calls_count_as_failures(self):
+        """Test calls over the latency threshold count as failures."""
+        breaker = self.make_breaker(min_requests=2)
+        breaker.record(True, 1.5)
+        breaker.record(True, 2.0)
+        
+        assert breaker.state == 'open'
+    
+    def test_half_open_probe(self):
+        """Test the breaker lets a probe through after the open duration."""
+        breaker = self.make_breaker(min_requests=1)
+        with patch('lambda_handler.time.monotonic', return_value=100.0):
+            breaker.record(False, 0.01)
+        with patch('lambda_handler.time.monotonic', return_value=105.0):
+            assert not breaker.allow_request()
+        with patch('lambda_handler.time.monotonic', return_value=111.0):
+            assert breaker.allow_request()
+            assert breaker.state == 'half_open'
+            assert not breaker.allow_request()
+            breaker.record(True, 0.01)
+        
+        assert breaker.state == 'closed'
+    
+    def test_failed_probe_reopens(self):
+        """Test a failed half-open probe opens the breaker again."""
+        breaker = self.make_breaker(min_requests=1, open_duration=0)
+        breaker.record(False, 0.01)
+        assert breaker.allow_request()
+        breaker.record(False, 0.01)
+        
+        assert breaker.state == 'open'
+        assert breaker.trips == 2
+    
+    @patch('lambda_handler.get_lambda_client')
+    def test_open_breaker_fails_fast(self, mock_get_lambda):
+        """Test requests skip the invoke while the breaker is open."""
+        mock_get_lambda.return_value.invoke.side_effect = Exception('Throttled')
+        
+        assert self.invoke()['statusCode'] == 500
+        assert self.invoke()['statusCode'] == 500
+        response = self.invoke()
+        
+        assert response['statusCode'] == 503
+        assert response['headers']['Retry-After'] == '60'
+        assert mock_get_lambda.return_value.invoke.call_count == 2
+        assert lambda_handler.get_circuit_breaker_stats()[self.ARN] == {
+            'state': 'open', 'trips': 1, 'rejected': 1
+        }
+    
+    @patch('lambda_handler.get_lambda_client')
+    def test_function_errors_count_as_failures(self, mock_get_lambda):
+        """Test FunctionError payloads trip the breaker."""
+        mock_get_lambda.return_value.invoke.return_value = {
+            'FunctionError': 'Unhandled',
+            'Payload': MagicMock(read=lambda: b'{"errorMessage": "boom"}')
+        }
+        self.invoke()
+        self.invoke()
+        
+        assert lambda_handler.circuit_breakers[self.ARN].state == 'open'
+    
+    @patch('lambda_handler.get_lambda_client')
+    def test_disabled_by_default(self, mock_get_lambda):
+        """Test no breaker is created unless BREAKER_ENABLED is set."""
+        self.config = dataclasses.replace(self.config, breaker_enabled=False)
+        mock_get_lambda.return_value.invoke.side_effect = Exception('Throttled')
+        for _ in range(3):
+            assert self.invoke()['statusCode'] == 500
+        
+        assert lambda_handler.circuit_breakers == {}
+    
+    def test_custom_response(self):
+        """Test BREAKER_RESPONSE replaces the default open response."""
+        custom = {'statusCode': 429, 'headers': {'X-Breaker': 'open'}, 'body': 'busy'}
+        config = lambda_handler.load_config({'BREAKER_RESPONSE': json.dumps(custom)})
+        response = lambda_handler.get_breaker_open_response(config)
+        response['headers']['X-Other'] = '1'
+        
+        assert response['statusCode'] == 429
+        assert config.breaker_response['headers'] == {'X-Breaker': 'open'}
+    
+    def test_invalid_settings(self):
+        """Test invalid breaker settings are rejected."""
+        with pytest.raises(lambda_handler.ConfigError):
+            lambda_handler.load_config({'BREAKER_ERROR_RATE': '1.5'})
+        with pytest.raises(lambda_handler.ConfigError):
+            lambda_handler.load_config({'BREAKER_RESPONSE': '{"body": "x"}'})
+
+
+class TestHedgedInvocation:
+    """Test cases for hedged invocations on idempotent routes."""
+    
+    ARN = 'arn:aws:lambda:us-east-1:123456789012:function:special'
+    
+    def setup_method(self):
+        """Set up test fixtures."""
+        self.event = {'path': '/special/endpoint', 'httpMethod': 'GET', 'headers': {}}
+        self.context = Mock(request_id='test-req', function_name='main-func',
+                            function_version='1', memory_limit_in_mb=256)
+        self.config = lambda_handler.load_config({
+            'SPECIAL_LAMBDA_ARN': self.ARN,
+            'SPECIAL_IDEMPOTENT': 'true',
+            'HEDGE_DELAY': '0.02',
+            'HEDGE_BUDGET': '100'
+        })
+        self.release = threading.Event()
+        self.calls = 0
+    
+    def teardown_method(self):
+        self.release.set()
+    
+    def fake_invoke(self, **kwargs):
+        """Answer the first call only once released; later calls answer at once."""
+        self.calls += 1
+        call = self.calls
+        if call == 1:
+            self.release.wait(5)
+        body = json.dumps({'statusCode': 200, 'headers': {}, 'body': f'call {call}'}).encode()
+        return {'Payload': MagicMock(read=lambda: body)}
+    
+    def invoke(self):
+        route = lambda_handler.match_special_route('/special/endpoint', self.config)
+        return lambda_handler.invoke_special_lambda(self.event, self.context, self.config, route)
+    
+    @patch('lambda_handler.get_lambda_client')
+    def test_slow_call_is_hedged(self, mock_get_lambda):
+        """Test a second invocation answers when the first is slow."""
+        mock_get_lambda.return_value.invoke.side_effect = self.fake_invoke
+        
+        response = self.invoke()
+        
+        assert response['body'] == 'call 2'
+        assert lambda_handler.get_hedge_stats() == {'requests': 1, 'hedges': 1, 'hedge_wins': 1}
+        
+        # The abandoned call's latency is recorded once it finishes, and its worker freed
+        self.release.set()
+        samples = lambda_handler.latency_trackers[self.ARN].samples
+        deadline = time.monotonic() + 5
+        while (len(samples) < 2 or lambda_handler.hedge_in_flight) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert len(samples) == 2
+        assert max(samples) >= 0.02
+        assert lambda_handler.hedge_in_flight == 0
+    
+    @patch('lambda_handler.get_lambda_client')
+    def test_budget_caps_hedges(self, mock_get_lambda):
+        """Test hedges stay within HEDGE_BUDGET percent of requests."""
+        self.config = dataclasses.replace(self.config, hedge_budget=50.0)
+        mock_get_lambda.return_value.invoke.side_effect = self.fake_invoke
+        self.release.set()
+        
+        assert self.invoke()['body'] == 'call 1'
+        assert self.calls == 1
+        
+        budget = lambda_handler.HedgeBudget()
+        budget.record_request(50.0)
+        assert not budget.try_acquire()
+        budget.record_request(50.0)
+        assert budget.try_acquire()
+        assert not budget.try_acquire()
+    
+    def test_budget_does_not_bank_quiet_traffic(self):
+        """Test credit earned during quiet traffic is capped at HEDGE_BURST hedges."""
+        budget = lambda_handler.HedgeBudget()
+        for _ in range(1000):
+            budget.record_request(5.0)
+        
+        assert sum(budget.try_acquire() for _ in range(100)) == lambda_handler.HEDGE_BURST
+    
+    @patch('lambda_handler.submit_hedge_call')
+    @patch('lambda_handler.get_lambda_client')
+    def test_busy_workers_invoke_inline(self, mock_get_lambda, mock_submit, monkeypatch):
+        """Test calls are not queued behind abandoned ones when every hedge worker is busy."""
+        mock_get_lambda.return_value.invoke.side_effect = self.fake_invoke
+        self.release.set()
+        monkeypatch.setattr(lambda_handler, 'hedge_in_flight', self.config.client_max_pool_connections)
+        
+        assert self.invoke()['body'] == 'call 1'
+        mock_submit.assert_not_called()
+        assert len(lambda_handler.latency_trackers[self.ARN].samples) == 1
+    
+    @patch('lambda_handler.get_lambda_client')
+    def test_non_idempotent_route_is_not_hedged(self, mock_get_lambda):
+        """Test routes not marked idempotent are invoked once."""
+        self.config = dataclasses.replace(self.config,
+            special_routes=lambda_handler.parse_routes({'SPECIAL_LAMBDA_ARN': self.ARN}))
+        mock_get_lambda.return_value.invoke.side_effect = self.fake_invoke
+        self.release.set()
+        
+        assert self.invoke()['body'] == 'call 1'
+        assert lambda_handler.get_hedge_stats()['requests'] == 0
+    
+    @patch('lambda_handler.get_lambda_client')
+    def test_adaptive_delay_needs_samples(self, mock_get_lambda):
+        """Test the p95 delay is used once enough latencies are recorded."""
+        self.config = dataclasses.replace(self.config, hedge_delay=0.0)
+        mock_get_lambda.return_value.invoke.side_effect = self.fake_invoke
+        self.release.set()
+        self.invoke()
+        
+        assert self.calls == 1
+        assert len(lambda_handler.latency_trackers[self.ARN].samples) == 1
+        tracker = lambda_handler.LatencyTracker()
+        assert tracker.percentile(0.95) is None
+        for i in range(lambda_handler.HEDGE_MIN_SAMPLES):
+            tracker.record(i / 100)
+        assert tracker.percentile(0.95) == 0.19
+    
+    @patch('lambda_handler.get_lambda_client')
+    def test_all_calls_failing(self, mock_get_lambda):
+        """Test errors still surface as 500 when no call succeeds."""
+        mock_get_lambda.return_value.invoke.side_effect = Exception('Throttled')
+        lambda_handler.latency_trackers[self.ARN] = lambda_handler.LatencyTracker()
+        
+        response = self.invoke()
+        
+        assert response['statusCode'] == 500
+        assert 'Throttled' in response['body']
+    
+    def test_idempotent_must_be_boolean(self):
+        """Test non-boolean idempotent flags are rejected."""
+        routes = [{'path': '/api', 'arn': 'arn', 'idempotent': 'yes'}]
+        with pytest.raises(lambda_handler.ConfigError):
+            lambda_handler.load_config({'SPECIAL_ROUTES': json.dumps(routes)})
+
+
+class TestPhaseMetrics:
+    """Test cases for the per-phase EMF timing lines."""
+    
+    def setup_method(self):
+        """Set up test fixtures."""
+        self.context = Mock(request_id='test-req', function_name='main-func',
+                            function_version='1', memory_limit_in_mb=256)
+    
+    def emitted(self, capsys):
+        lines = [line for line in capsys.readouterr().out.splitlines() if line.startswith('{')]
+        assert len(lines) == 1
+        return json.loads(lines[0])
+    
+    @patch.dict(os.environ, {'MAINTENANCE_MODE': 'true', 'METRICS_NAMESPACE': 'Test'})
+    @patch('lambda_handler.get_s3_client')
+    def test_maintenance_phases(self, mock_get_s3, capsys):
+        """Test a maintenance response reports fetch and render with its cache tier."""
+        mock_get_s3.return_value.get_object.return_value = {
+            'Body': MagicMock(read=lambda: b'<p>{{PATH}}</p>'), 'ETag': '"v1"'
+        }
+        lambda_handler.lambda_handler({'path': '/'}, self.context)
+        capsys.readouterr()
+        lambda_handler.lambda_handler({'path': '/'}, self.context)
+        
+        document = self.emitted(capsys)
+        directive = document['_aws']['CloudWatchMetrics'][0]
+        assert directive['Namespace'] == 'Test'
+        assert directive['Dimensions'] == [['Branch', 'CacheTier']]
+        assert [m['Name'] for m in directive['Metrics']] == [
+            'ConfigMs', 'RoutingMs', 'PageFetchMs', 'RenderMs', 'ResponseMs', 'TotalMs'
+        ]
+        assert document['Branch'] == 'maintenance'
+        assert document['CacheTier'] == 'memory'
+        assert document['TotalMs'] >= document['RenderMs'] >= 0
+    
+    @patch.dict(os.environ, {'SPECIAL_LAMBDA_ARN': 'arn:special'})
+    @patch('lambda_handler.get_lambda_client')
+    def test_special_phases(self, mock_get_lambda, capsys):
+        """Test a special route reports the invoke time."""
+        body = json.dumps({'statusCode': 200, 'headers': {}, 'body': 'ok'}).encode()
+        mock_get_lambda.return_value.invoke.return_value = {'Payload': MagicMock(read=lambda: body)}
+        
+        lambda_handler.lambda_handler({'path': '/special/x'}, self.context)
+        
+        document = self.emitted(capsys)
+        assert document['Branch'] == 'special'
+        assert document['CacheTier'] == 'none'
+        assert 'InvokeMs' in document
+    
+    @patch.dict(os.environ, {'SPECIAL_LAMBDA_ARN': 'arn:special', 'BREAKER_ENABLED': 'true',
+                             'BREAKER_MIN_REQUESTS': '1'})
+    @patch('lambda_handler.get_lambda_client')
+    def test_breaker_metrics(self, mock_get_lambda, capsys):
+        """Test breaker state, trips and rejections are reported per function ARN."""
+        mock_get_lambda.return_value.invoke.side_effect = Exception('boom')
+        
+        lambda_handler.lambda_handler({'path': '/special/x'}, self.context)
+        tripped = self.emitted(capsys)
+        lambda_handler.lambda_handler({'path': '/special/x'}, self.context)
+        rejected = self.emitted(capsys)
+        
+        directive = tripped['_aws']['CloudWatchMetrics'][1]
+        assert directive['Dimensions'] == [['FunctionArn']]
+        assert [m['Name'] for m in directive['Metrics']] == ['BreakerState', 'BreakerTrips', 'BreakerRejected']
+        assert tripped['FunctionArn'] == 'arn:special'
+        assert (tripped['BreakerState'], tripped['BreakerTrips'], tripped['BreakerRejected']) == (2, 1, 0)
+        assert (rejected['BreakerState'], rejected['BreakerTrips'], rejected['BreakerRejected']) == (2, 0, 1)
+        assert rejected['Breaker'] == {'state': 'open', 'trips': 1, 'rejected': 1}
+    
+    @patch.dict(os.environ, {'MAINTENANCE_MODE': 'true', 'PAGE_BUNDLED_PATH': ''})
+    @patch('lambda_handler.get_s3_client')
+    def test_fallback_branch(self, mock_get_s3, capsys):
+        """Test the fallback page is reported as its own branch."""
+        mock_get_s3.return_value.get_object.side_effect = Exception('S3 down')
+        
+        lambda_handler.lambda_handler({'path': '/'}, self.context)
+        
+        assert self.emitted(capsys)['Branch'] == 'fallback'
+    
+    @patch.dict(os.environ, {'MAINTENANCE_MODE': 'false', 'METRICS_ENABLED': 'false'})
+    def test_disabled(self, capsys):
+        """Test METRICS_ENABLED=false emits nothing."""
+        lambda_handler.lambda_handler({'path': '/'}, self.context)
+        
+        assert capsys.readouterr().out == ''
+
+
+class TestSamplingProfiler:
+    """Test cases for the sampling profiler hook."""
+    
+    def setup_method(self):
+        """Set up test fixtures."""
+        self.context = Mock(request_id='test-req', function_name='main-func',
+                            function_version='1', memory_limit_in_mb=256)
+    
+    def profile_records(self, capsys):
+        return [json.loads(line)['profile'] for line in capsys.readouterr().out.splitlines()
+                if line.startswith('{"profile"')]
+    
+    def test_profiles_one_in_n(self, tmp_path, capsys):
+        """Test every Nth invocation is profiled and dumped."""
+        import pstats
+        with patch.dict(os.environ, {
+            'MAINTENANCE_MODE': 'false',
+            'METRICS_ENABLED': 'false',
+            'PROFILE_EVERY_N': '3',
+            'PROFILE_TOP_K': '5',
+            'PROFILE_DIR': str(tmp_path)
+        }):
+            responses = [lambda_handler.lambda_handler({'path': '/'}, self.context) for _ in range(6)]
+        
+        records = self.profile_records(capsys)
+        assert all(response['statusCode'] == 200 for response in responses)
+        assert [record['invocation'] for record in records] == [3, 6]
+        record = records[0]
+        assert record['request_id'] == 'test-req'
+        assert 0 < len(record['functions']) <= 5
+        assert any('handle_request' in function[0] for function in record['functions'])
+        assert len(record['allocations']) <= 5
+        assert len(list(tmp_path.glob('*.pstats'))) == 2
+        pstats.Stats(record['dump'])
+    
+    def test_keeps_newest_dumps(self, tmp_path, capsys):
+        """Test old pstats dumps are pruned."""
+        with patch.dict(os.environ, {
+            'MAINTENANCE_MODE': 'false',
+            'PROFILE_EVERY_N': '1',
+            'PROFILE_DIR': str(tmp_path)
+        }), patch('lambda_handler.PROFILE_DUMPS_KEPT', 2):
+            for _ in range(4):
+                lambda_handler.lambda_handler({'path': '/'}, self.context)
+        
+        assert len(list(tmp_path.glob('*.pstats'))) == 2
+    
+    @patch.dict(os.environ, {'MAINTENANCE_MODE': 'false', 'METRICS_ENABLED': 'false'})
+    def test_disabled_by_default(self, capsys):
+        """Test nothing is profiled unless PROFILE_EVERY_N is set."""
+        lambda_handler.lambda_handler({'path': '/'}, self.context)
+        
+        assert self.profile_records(capsys) == []
+        assert lambda_handler.invocation_count == 0
 
 
 class TestErrorHandling:
@@ -301,5 +1966,238 @@ class TestErrorHandling:
         assert 'application/json' in response['headers']['Content-Type']
 
 
+class TestResponseCatalog:
+    """Test cases for the prebuilt static responses."""
+    
+    def test_slot_body_matches_full_serialization(self):
+        """Test splicing a value gives the same body as serializing the whole dict."""
+        message = 'quote " backslash \\ newline \n 日本語'
+        
+        response = lambda_handler.handle_error(Exception(message))
+        
+        assert response['body'] == json.dumps({'error': 'Internal server error', 'message': message})
+    
+    def test_normal_body_is_compact(self):
+        """Test the normal response keeps the compact, non-ASCII-escaped body."""
+        response = lambda_handler.RESPONSE_CATALOG['normal'].render('/日本')
+        
+        assert response['body'] == '{"message":"Service is operational","path":"/日本"}'
+    
+    def test_renders_are_independent_copies(self):
+        """Test callers cannot modify the catalog through a rendered response."""
+        first = lambda_handler.get_fallback_maintenance_response('S3 down')
+        first['headers']['X-Extra'] = '1'
+        first['statusCode'] = 200
+        second = lambda_handler.get_fallback_maintenance_response('S3 down')
+        
+        assert second['statusCode'] == 503
+        assert 'X-Extra' not in second['headers']
+        assert second['body'] is lambda_handler.FALLBACK_HTML
+    
+    def test_static_bodies(self):
+        """Test responses without a slot keep their prebuilt body."""
+        assert lambda_handler.get_accepted_response()['body'] == json.dumps({'message': 'Accepted'})
+        assert lambda_handler.RESPONSE_CATALOG['not_configured'].render()['statusCode'] == 503
+
+
+class TestLocalServer:
+    """Test cases for the local ALB emulator."""
+    
+    def test_build_event(self):
+        """Test HTTP requests become ALB-shaped events."""
+        event = local_server.build_event('POST', '/api/items?page=2&q=a%20b', {
+            'host': 'example.com',
+            'content-type': 'application/json'
+        }, b'{"a": 1}', '10.0.0.1', 8080)
+        
+        assert event['path'] == '/api/items'
+        assert event['queryStringParameters'] == {'page': '2', 'q': 'a%20b'}
+        assert event['headers']['x-forwarded-for'] == '10.0.0.1'
+        assert event['requestContext']['identity']['sourceIp'] == '10.0.0.1'
+        assert event['body'] == '{"a": 1}'
+        assert event['isBase64Encoded'] is False
+    
+    def test_binary_body_is_base64_encoded(self):
+        """Test non-text bodies are base64-encoded like the ALB does."""
+        event = local_server.build_event('PUT', '/upload', {'content-type': 'image/png'}, b'\x89PNG')
+        
+        assert event['isBase64Encoded'] is True
+        assert base64.b64decode(event['body']) == b'\x89PNG'
+    
+    def test_encode_response(self):
+        """Test ALB responses are serialized as HTTP, decoding base64 bodies."""
+        raw = local_server.encode_response({
+            'statusCode': 503,
+            'statusDescription': '503 Service Unavailable',
+            'isBase64Encoded': True,
+            'headers': {'Content-Type': 'text/html'},
+            'body': base64.b64encode(b'<p>down</p>').decode()
+        }, keep_alive=True)
+        
+        head, body = raw.split(b'\r\n\r\n', 1)
+        assert head.startswith(b'HTTP/1.1 503 Service Unavailable\r\n')
+        assert b'Content-Length: 11' in head
+        assert body == b'<p>down</p>'
+    
+    def test_local_s3_client(self, tmp_path):
+        """Test the S3 stand-in serves files with ETags and answers 304."""
+        (tmp_path / 'maintenance.html').write_text('<p>down</p>')
+        client = local_server.LocalS3Client(str(tmp_path))
+        
+        response = client.get_object(Bucket='any', Key='maintenance.html')
+        assert response['Body'].read() == b'<p>down</p>'
+        with pytest.raises(lambda_handler.S3Error) as excinfo:
+            client.get_object(Bucket='any', Key='maintenance.html', IfNoneMatch=response['ETag'])
+        assert lambda_handler.is_not_modified(excinfo.value)
+        with pytest.raises(lambda_handler.S3Error):
+            client.get_object(Bucket='any', Key='../secret')
+    
+    def test_local_lambda_client_reports_function_errors(self):
+        """Test exceptions in the Lambda stand-in surface as FunctionError."""
+        def failing(payload, context):
+            raise RuntimeError('boom')
+        
+        response = local_server.LocalLambdaClient(failing).invoke(FunctionName='f', Payload=b'{}')
+        
+        assert response['FunctionError'] == 'Unhandled'
+        assert b'boom' in response['Payload'].read()
+    
+    @patch.dict(os.environ, {'MAINTENANCE_MODE': 'true', 'SPECIAL_LAMBDA_ARN': 'arn:special'})
+    def test_round_trip(self, tmp_path):
+        """Test requests are served through the handler with local stand-ins."""
+        (tmp_path / 'maintenance.html').write_text('<p>{{PATH}}</p>')
+        local_server.install_stand_ins(local_server.LocalS3Client(str(tmp_path)),
+                                       local_server.LocalLambdaClient())
+        
+        async def exchange():
+            server = local_server.LocalAlbServer(port=0, concurrency=2)
+            await server.start()
+            try:
+                reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+                responses = []
+                for path in ('/shop', '/special/x'):
+                    writer.write(f'GET {path} HTTP/1.1\r\nHost: example.com\r\n\r\n'.encode())
+                    head = await reader.readuntil(b'\r\n\r\n')
+                    length = int(head.split(b'Content-Length: ')[1].split(b'\r\n')[0])
+                    responses.append((head, await reader.readexactly(length)))
+                writer.close()
+                return responses
+            finally:
+                await server.close()
+        
+        try:
+            (maintenance_head, maintenance_body), (special_head, special_body) = asyncio.run(exchange())
+        finally:
+            lambda_handler.s3_client = None
+            lambda_handler.lambda_client = None
+        
+        assert maintenance_head.startswith(b'HTTP/1.1 503')
+        assert maintenance_body == b'<p>/shop</p>'
+        assert special_head.startswith(b'HTTP/1.1 200')
+        assert json.loads(special_body)['path'] == '/special/x'
+
+
+class TestBenchmarkBaseline:
+    """Test cases for the benchmark baseline comparison."""
+    
+    def test_compare_flags_regressions_past_threshold(self):
+        """Test p50 or p99 slowdowns past the threshold are reported."""
+        baseline = {
+            'a': {'p50_us': 10.0, 'p99_us': 20.0},
+            'b': {'p50_us': 10.0, 'p99_us': 20.0},
+            'gone': {'p50_us': 1.0, 'p99_us': 1.0}
+        }
+        results = {
+            'a': {'p50_us': 11.0, 'p99_us': 23.0},
+            'b': {'p50_us': 10.0, 'p99_us': 30.0},
+            'new': {'p50_us': 99.0, 'p99_us': 99.0}
+        }
+        
+        regressions = benchmark_lambda_handler.compare(results, baseline, threshold=20)
+        
+        assert regressions == ['b p99_us: 20.00 -> 30.00 (+50%)']
+    
+    def test_template_builder(self):
+        """Test generated templates have the requested placeholders and size."""
+        html = benchmark_lambda_handler.build_template(10 * 1024, 100)
+        
+        assert len(lambda_handler.PLACEHOLDER_PATTERN.findall(html)) == 100
+        assert abs(len(html.encode('utf-8')) - 10 * 1024) < 1024
+
+
+class TestColdStartHarness:
+    """Test cases for the cold start harness."""
+    
+    def test_parse_importtime(self):
+        """Test the breakdown keeps only modules imported directly by lambda_handler."""
+        stderr = '\n'.join([
+            'import time: self [us] | cumulative | imported package',
+            'import time:       100 |        100 | encodings',
+            'import time:        50 |         50 |     _json',
+            'import time:       200 |        250 |   json',
+            'import time:       300 |        300 |   logging',
+            'import time:      1000 |       1550 | lambda_handler',
+            'import time:        10 |         10 | resource',
+        ])
+        
+        breakdown = coldstart_lambda_handler.parse_importtime(stderr)
+        
+        assert breakdown == {
+            'lambda_handler': 1.55,
+            'lambda_handler (self)': 1.0,
+            'logging': 0.3,
+            'json': 0.25
+        }
+    
+    def test_single_run(self):
+        """Test one cold start runs in a fresh interpreter without boto3."""
+        sample = coldstart_lambda_handler.run_once('maintenance', {})
+        
+        assert sample['status'] == 503
+        assert sample['boto3_imported'] is False
+        assert sample['import_ms'] > 0
+        assert 'lambda_handler' in sample['modules_ms']
+
+
+class TestImportTime:
+    """Cold-start import cost of the handler module."""
+    
+    # Budget for `import lambda_handler` (cumulative, ms); override with IMPORT_TIME_BUDGET_MS
+    BUDGET_MS = float(os.environ.get('IMPORT_TIME_BUDGET_MS', '100'))
+    RUNS = 3
+    
+    @staticmethod
+    def import_report():
+        """Import lambda_handler in a fresh interpreter with -X importtime."""
+        env = {k: v for k, v in os.environ.items() if k != 'WARMUP_ENABLED'}
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c',
+             'import sys, lambda_handler; print("boto3" in sys.modules)'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=env, capture_output=True, text=True, check=True
+        )
+        modules = {}
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            self_us, cumulative_us, name = line.split(':', 1)[1].split('|')
+            modules[name.strip()] = (int(self_us), int(cumulative_us))
+        return result.stdout.strip() == 'True', modules
+    
+    def test_import_within_budget(self):
+        """Test that importing the handler stays within the cold-start budget."""
+        reports = [self.import_report() for _ in range(self.RUNS)]
+        boto3_imported, modules = min(reports, key=lambda report: report[1]['lambda_handler'][1])
+        total_ms = modules['lambda_handler'][1] / 1000
+        
+        slowest = sorted(modules.items(), key=lambda item: item[1][0], reverse=True)[:10]
+        print(f'\nimport lambda_handler: {total_ms:.1f} ms (budget {self.BUDGET_MS:.0f} ms)')
+        for name, (self_us, cumulative_us) in slowest:
+            print(f'  {self_us / 1000:8.2f} ms self {cumulative_us / 1000:8.2f} ms cumulative  {name}')
+        
+        assert not boto3_imported, 'boto3 must only be imported when a client is created'
+        assert total_ms <= self.BUDGET_MS
+
+
 if __name__ == '__main__':
     pytest.main([__file__, '-v'])